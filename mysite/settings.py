@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,6 +37,118 @@ ALLOWED_HOSTS = ['*']  # Permitir todas las IPs (para desarrollo local y testing
 # Configuración de notificaciones
 # Solo se usa SMS via Mocean API (configurado en .env: MOCEAN_API_TOKEN)
 
+# Envíos de SMS simultáneos por proceso y límite de tasa del proveedor (mensajes/segundo)
+SMS_MAX_CONCURRENCIA = int(os.environ.get('SMS_MAX_CONCURRENCIA', '8'))
+SMS_TASA_POR_SEGUNDO = float(os.environ.get('SMS_TASA_POR_SEGUNDO', '5'))
+SMS_RAFAGA = int(os.environ.get('SMS_RAFAGA', '10'))
+
+# Hilos que drenan la bandeja de salida de notificaciones en cada proceso
+NOTIFICACIONES_WORKERS = int(os.environ.get('NOTIFICACIONES_WORKERS', '4'))
+# Segundos tras los cuales una notificación en 'enviando' se considera abandonada
+NOTIFICACIONES_TIMEOUT_ENVIO = int(os.environ.get('NOTIFICACIONES_TIMEOUT_ENVIO', '120'))
+# Reintentos de notificaciones fallidas: backoff exponencial (segundos) y plazo por alerta
+NOTIFICACIONES_MAX_INTENTOS = int(os.environ.get('NOTIFICACIONES_MAX_INTENTOS', '6'))
+NOTIFICACIONES_REINTENTO_BASE = float(os.environ.get('NOTIFICACIONES_REINTENTO_BASE', '10'))
+NOTIFICACIONES_REINTENTO_MAXIMO = float(os.environ.get('NOTIFICACIONES_REINTENTO_MAXIMO', '300'))
+NOTIFICACIONES_PLAZO_ALERTA = int(os.environ.get('NOTIFICACIONES_PLAZO_ALERTA', '1800'))
+
+# Detecciones de accidente del mismo repartidor dentro de esta ventana (segundos)
+# y distancia (metros) se fusionan en la alerta activa
+ALERTAS_DEDUP_VENTANA = int(os.environ.get('ALERTAS_DEDUP_VENTANA', '120'))
+ALERTAS_DEDUP_DISTANCIA_M = float(os.environ.get('ALERTAS_DEDUP_DISTANCIA_M', '300'))
+
+# Segundos entre recargas del registro de alertas activas desde la base de datos
+# (recoge los cambios hechos por otros procesos)
+ALERTAS_ACTIVAS_TTL = float(os.environ.get('ALERTAS_ACTIVAS_TTL', '5'))
+
+# Escritura diferida de puntos de trayectoria: se guardan en lotes de este
+# tamaño o cada tantos segundos, lo que ocurra primero
+TRAYECTORIAS_TAMANO_LOTE = int(os.environ.get('TRAYECTORIAS_TAMANO_LOTE', '200'))
+TRAYECTORIAS_INTERVALO = float(os.environ.get('TRAYECTORIAS_INTERVALO', '1'))
+
+# Segundos entre escrituras del último estado (ubicación y batería) de los repartidores.
+# El estado pendiente vive en cada proceso: con varios workers es también el
+# retraso máximo con que un worker ve los pings recibidos por otro
+UBICACIONES_INTERVALO_GUARDADO = float(os.environ.get('UBICACIONES_INTERVALO_GUARDADO', '5'))
+
+# Segundos entre revisiones de cambios en las zonas de riesgo hechos por otros procesos
+ZONAS_INDICE_TTL = float(os.environ.get('ZONAS_INDICE_TTL', '30'))
+
+# Rejilla (grados) para memorizar las zonas cercanas de repartidor_home (~110 m)
+ZONAS_CERCANAS_REJILLA = float(os.environ.get('ZONAS_CERCANAS_REJILLA', '0.001'))
+
+# Riesgo de las zonas a partir de las alertas: peso por tipo, vida media (días) del
+# aporte de cada alerta, intensidad que lleva la puntuación a ~6.7/10 y radio (km)
+# de las zonas que no indican 'radio_km'. La vida media debe ser de al menos 7 días:
+# la intensidad normalizada se desborda pasadas 1024 vidas medias desde su época
+# (ver agregacion_riesgo.EPOCA)
+RIESGO_PESO_PANICO = float(os.environ.get('RIESGO_PESO_PANICO', '1.0'))
+RIESGO_PESO_ACCIDENTE = float(os.environ.get('RIESGO_PESO_ACCIDENTE', '0.5'))
+RIESGO_VIDA_MEDIA_DIAS = float(os.environ.get('RIESGO_VIDA_MEDIA_DIAS', '30'))
+if RIESGO_VIDA_MEDIA_DIAS < 7:
+    raise ImproperlyConfigured(
+        f'RIESGO_VIDA_MEDIA_DIAS={RIESGO_VIDA_MEDIA_DIAS:g} es menor que el mínimo de 7 días'
+    )
+RIESGO_ESCALA_ALERTAS = float(os.environ.get('RIESGO_ESCALA_ALERTAS', '10'))
+RIESGO_RADIO_ZONA_KM = float(os.environ.get('RIESGO_RADIO_ZONA_KM', '1.0'))
+
+# Riesgo por hora de la semana (perfil 7×24 de cada zona) y alertas "previas"
+# repartidas parejo en la semana que suavizan los perfiles con pocas alertas
+RIESGO_HORARIO_ACTIVO = os.environ.get('RIESGO_HORARIO_ACTIVO', 'True') == 'True'
+RIESGO_HORARIO_PREVIO = float(os.environ.get('RIESGO_HORARIO_PREVIO', '24'))
+
+# Puntos calientes por agrupamiento de alertas (buscar_puntos_calientes): distancia (m)
+# entre alertas vecinas, alertas mínimas para un núcleo, radio mínimo (km) de las zonas y
+# margen (s) antes de la última alerta procesada que se vuelve a leer en cada ejecución
+PUNTOS_CALIENTES_DIR = os.environ.get('PUNTOS_CALIENTES_DIR', str(BASE_DIR / 'puntos_calientes'))
+PUNTOS_CALIENTES_EPS_M = float(os.environ.get('PUNTOS_CALIENTES_EPS_M', '300'))
+PUNTOS_CALIENTES_MINIMO_ALERTAS = int(os.environ.get('PUNTOS_CALIENTES_MINIMO_ALERTAS', '5'))
+PUNTOS_CALIENTES_RADIO_MINIMO_KM = float(os.environ.get('PUNTOS_CALIENTES_RADIO_MINIMO_KM', '0.3'))
+PUNTOS_CALIENTES_MARGEN_S = float(os.environ.get('PUNTOS_CALIENTES_MARGEN_S', '600'))
+
+# Ráster de riesgo precalculado (archivos .npy mapeados en memoria compartidos por los workers).
+# RASTER_RIESGO_ACTIVO lo usa también para puntuar las rutas, más rápido pero aproximado
+# (ver raster_riesgo); el grafo vial lo usa siempre para el riesgo de sus aristas
+RASTER_RIESGO_ACTIVO = os.environ.get('RASTER_RIESGO_ACTIVO', 'False') == 'True'
+RASTER_RIESGO_DIR = os.environ.get('RASTER_RIESGO_DIR', str(BASE_DIR / 'raster_riesgo'))
+RASTER_RIESGO_CELDA_M = float(os.environ.get('RASTER_RIESGO_CELDA_M', '50'))
+RASTER_RIESGO_MAXIMO_CELDAS = int(os.environ.get('RASTER_RIESGO_MAXIMO_CELDAS', '20000000'))
+# Segundos entre revisiones de la versión del ráster y espera antes de reconstruirlo tras un cambio
+RASTER_RIESGO_TTL = float(os.environ.get('RASTER_RIESGO_TTL', '30'))
+RASTER_RIESGO_ESPERA = float(os.environ.get('RASTER_RIESGO_ESPERA', '2'))
+
+# Polilíneas de las rutas: tolerancia (m) de Douglas–Peucker y espaciado (m) del
+# remuestreo para puntuar, y tolerancia de la versión que se envía y se guarda
+RUTAS_TOLERANCIA_PUNTUACION_M = float(os.environ.get('RUTAS_TOLERANCIA_PUNTUACION_M', '5'))
+RUTAS_ESPACIADO_PUNTUACION_M = float(os.environ.get('RUTAS_ESPACIADO_PUNTUACION_M', '25'))
+RUTAS_TOLERANCIA_VISUALIZACION_M = float(os.environ.get('RUTAS_TOLERANCIA_VISUALIZACION_M', '8'))
+
+# Caché de rutas de OSRM: origen y destino se ajustan a una rejilla de este tamaño (grados)
+RUTAS_CACHE_CAPACIDAD = int(os.environ.get('RUTAS_CACHE_CAPACIDAD', '2000'))
+RUTAS_CACHE_TTL = float(os.environ.get('RUTAS_CACHE_TTL', '3600'))
+RUTAS_CACHE_REJILLA = float(os.environ.get('RUTAS_CACHE_REJILLA', '0.001'))
+
+# Backend de rutas: 'osrm' (RUTAS_OSRM_URL, público o propio), 'local' (sin red,
+# para pruebas y pruebas de carga) o la ruta de una clase propia
+RUTAS_BACKEND = os.environ.get('RUTAS_BACKEND', 'osrm')
+RUTAS_OSRM_URL = os.environ.get('RUTAS_OSRM_URL', 'https://router.project-osrm.org')
+RUTAS_OSRM_TIMEOUT = float(os.environ.get('RUTAS_OSRM_TIMEOUT', '10'))
+RUTAS_POOL_CONEXIONES = int(os.environ.get('RUTAS_POOL_CONEXIONES', '10'))
+
+# Grafo vial local (archivo .npz de importar_grafo_vial) para rutas que evitan zonas de riesgo:
+# tiempo extra máximo sobre la ruta más rápida (fracción), pesos de riesgo a probar y
+# distancia máxima (m) de los puntos pedidos a la red
+RUTAS_GRAFO_ARCHIVO = os.environ.get('RUTAS_GRAFO_ARCHIVO', '')
+RUTAS_GRAFO_PRESUPUESTO_DESVIO = float(os.environ.get('RUTAS_GRAFO_PRESUPUESTO_DESVIO', '0.3'))
+RUTAS_GRAFO_PESOS_RIESGO = [
+    float(peso) for peso in os.environ.get('RUTAS_GRAFO_PESOS_RIESGO', '2,5,12').split(',') if peso.strip()
+]
+RUTAS_GRAFO_AJUSTE_MAXIMO_M = float(os.environ.get('RUTAS_GRAFO_AJUSTE_MAXIMO_M', '500'))
+
+# Hilos para consultar el backend de rutas y para puntuar alternativas (0 = núcleos del CPU)
+RUTAS_HILOS_RED = int(os.environ.get('RUTAS_HILOS_RED', '16'))
+RUTAS_HILOS_CALCULO = int(os.environ.get('RUTAS_HILOS_CALCULO', '0'))
+
 
 # Application definition
 
@@ -83,11 +196,38 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 ASGI_APPLICATION = 'mysite.asgi.application'
 
 # Configuración de Channels
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+# 'memoria': un solo proceso de Daphne (desarrollo).
+# 'redis': varios procesos o nodos comparten grupos (alertas, monitoreo,
+# ubicacion_<id>) a través de Redis. Con varios hosts en CHANNEL_REDIS_HOSTS
+# (separados por coma) los canales y la membresía de grupos se reparten entre
+# ellos por hash consistente del nombre.
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'memoria')
+CHANNEL_REDIS_HOSTS = [
+    host.strip()
+    for host in os.environ.get('CHANNEL_REDIS_HOSTS', 'redis://127.0.0.1:6379/0').split(',')
+    if host.strip()
+]
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_HOSTS,
+                'prefix': os.environ.get('CHANNEL_REDIS_PREFIX', 'rappisafe'),
+                # Mensajes en cola por canal antes de descartar (operadores lentos)
+                'capacity': int(os.environ.get('CHANNEL_REDIS_CAPACIDAD', '500')),
+                'expiry': int(os.environ.get('CHANNEL_REDIS_EXPIRACION', '60')),
+                'group_expiry': int(os.environ.get('CHANNEL_REDIS_EXPIRACION_GRUPOS', '86400')),
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
     }
-}
 
 
 # Database
@@ -97,6 +237,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Tomar el candado de escritura al iniciar la transacción: serializa
+            # las verificaciones de duplicados entre procesos y evita errores
+            # "database is locked" con los trabajadores en segundo plano
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
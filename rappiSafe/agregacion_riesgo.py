@@ -0,0 +1,342 @@
+"""
+Agregación incremental del riesgo de las zonas a partir de las alertas.
+
+Los contadores de EstadisticaRiesgo (total_alertas, alertas_panico,
+alertas_accidente) y puntuacion_riesgo solo se llenaban con los scripts de
+datos de ejemplo. Ahora cada alerta nueva se asigna a las zonas que la
+contienen (distancia al centro menor que su 'radio_km', o dentro del polígono
+en las zonas con polígono) con el índice espacial compartido, y se
+actualizan sus contadores y su puntuación en un solo UPDATE con expresiones F(), sin leer la fila ni recorrer el histórico.
+
+Puntuación con decaimiento
+--------------------------
+Cada alerta aporta su peso (RIESGO_PESO_PANICO / RIESGO_PESO_ACCIDENTE) y ese
+aporte se reduce a la mitad cada RIESGO_VIDA_MEDIA_DIAS. Para que sumar una
+alerta sea una simple suma atómica, intensidad_alertas guarda la intensidad
+normalizada a una época fija:
+
+    intensidad_alertas = Σ peso · 2^((creado_en - EPOCA) / vida_media)
+    intensidad actual  = intensidad_alertas · 2^(-(ahora - EPOCA) / vida_media)
+
+y la puntuación (escala 1-10) es 1 + 9 · (1 - e^(-intensidad actual / RIESGO_ESCALA_ALERTAS)).
+
+Las zonas que ya tenían una puntuación (las de los scripts de ejemplo o las
+capturadas a mano) parten de la intensidad equivalente a esa puntuación, así
+que la primera alerta no las reinicia.
+
+Las alertas marcadas como falsa alarma o eliminadas se descuentan. Para el
+histórico está recalcular_zonas (comando agregar_riesgo_alertas).
+
+El mismo aporte se suma en perfil_horario, en la franja de la semana de la
+alerta (ver riesgo_horario). Ese campo es un arreglo empaquetado, así que se
+lee y se escribe en la misma transacción que el UPDATE de los contadores.
+
+Fuera de la respuesta
+---------------------
+Las señales de Alerta solo deciden si la alerta suma o resta; el UPDATE se
+hace al confirmar la transacción, en un hilo en segundo plano, así que el
+botón de pánico no espera una segunda transacción de escritura. Agregar
+alertas solo cambia puntuaciones y contadores, no ultima_actualizacion: el
+índice espacial refresca las puntuaciones en sus mismas zonas y el ráster se
+reconstruye con la siguiente revisión de su versión (ver huella_puntuaciones),
+sin descartar las estructuras que dependen de la geometría.
+"""
+import copy
+import logging
+import math
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Exp, Round
+from django.utils import timezone
+
+# Época de la intensidad normalizada. 2^(t / vida media) se desborda (OverflowError)
+# pasadas 1024 vidas medias: unos 84 años con 30 días, unos 19 con el mínimo de 7.
+# Antes de eso hay que mover la época y reconstruir con recalcular_zonas.
+EPOCA = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+PUNTUACION_MINIMA = 1.0
+PUNTUACION_MAXIMA = 10.0
+# Las alertas marcadas así no cuentan para el riesgo de la zona
+ESTADOS_DESCARTADOS = ('falsa_alarma',)
+
+logger = logging.getLogger(__name__)
+
+
+def factor_tiempo(momento):
+    """
+    2^((momento - EPOCA) / vida media): multiplica el peso de una alerta para
+    normalizarlo a la época, y divide la intensidad para llevarla a `momento`
+    """
+    vida_media = settings.RIESGO_VIDA_MEDIA_DIAS * 86400
+    return 2 ** ((momento - EPOCA).total_seconds() / vida_media)
+
+
+def peso_alerta(tipo):
+    return settings.RIESGO_PESO_PANICO if tipo == 'panico' else settings.RIESGO_PESO_ACCIDENTE
+
+
+def puntuacion_para_intensidad(intensidad, ahora=None):
+    """
+    Puntuación 1-10 de una intensidad normalizada, vista en `ahora`
+    """
+    actual = max(intensidad, 0.0) / factor_tiempo(ahora or timezone.now())
+    rango = PUNTUACION_MAXIMA - PUNTUACION_MINIMA
+    return round(PUNTUACION_MINIMA + rango * (1 - math.exp(-actual / settings.RIESGO_ESCALA_ALERTAS)), 1)
+
+
+def intensidad_para_puntuacion(puntuacion, ahora=None):
+    """
+    Intensidad normalizada que hoy da `puntuacion` (inversa de puntuacion_para_intensidad)
+    """
+    rango = PUNTUACION_MAXIMA - PUNTUACION_MINIMA
+    fraccion = min(max((float(puntuacion) - PUNTUACION_MINIMA) / rango, 0.0), 0.99)
+    actual = -settings.RIESGO_ESCALA_ALERTAS * math.log(1 - fraccion)
+    return actual * factor_tiempo(ahora or timezone.now())
+
+
+def _expresion_puntuacion(intensidad, ahora):
+    """
+    La misma fórmula que puntuacion_para_intensidad como expresión de base de datos
+    """
+    escala = factor_tiempo(ahora) * settings.RIESGO_ESCALA_ALERTAS
+    rango = PUNTUACION_MAXIMA - PUNTUACION_MINIMA
+    return Round(
+        Value(PUNTUACION_MINIMA) + Value(rango) * (Value(1.0) - Exp(intensidad * Value(-1.0 / escala))),
+        1
+    )
+
+
+def _radios(indice):
+    """
+    Radio (km) de cada zona del índice, por su orden, y el mayor de todos.
+    Las zonas con polígono tienen radio 0: la distancia a ellas ya es 0 dentro.
+    """
+    radios = indice.extras.get('radios')
+    if radios is None:
+        radios = {}
+        for orden, zona, *_ in indice.entradas:
+            if orden in indice.poligonos:
+                radios[orden] = 0.0
+                continue
+            try:
+                radio = float(zona.coordenadas_zona.get('radio_km') or settings.RIESGO_RADIO_ZONA_KM)
+            except (TypeError, ValueError):
+                radio = settings.RIESGO_RADIO_ZONA_KM
+            radios[orden] = radio
+        indice.extras['radios'] = radios
+        indice.extras['radio_maximo'] = max(radios.values(), default=0.0)
+    return radios, indice.extras['radio_maximo']
+
+
+def entradas_de_punto(latitud, longitud, indice):
+    """
+    Entradas del índice de las zonas de riesgo que contienen el punto
+
+    Raises:
+        ValueError, TypeError, OverflowError: si el punto no es numérico
+    """
+    radios, radio_maximo = _radios(indice)
+    if radio_maximo <= 0 and not indice.poligonos:
+        return []
+
+    latitud, longitud = float(latitud), float(longitud)
+    lat_rad, lng_rad = math.radians(latitud), math.radians(longitud)
+    # Los polígonos están en todas las celdas de su caja, basta con la celda del punto
+    return [
+        entrada
+        for entrada in indice.candidatas(latitud, longitud, radio_maximo)
+        if indice.distancia(entrada, lat_rad, lng_rad, radios[entrada[0]]) <= radios[entrada[0]]
+    ]
+
+
+def zonas_de_punto(latitud, longitud, indice=None):
+    """
+    IDs de las zonas de riesgo que contienen el punto
+
+    Raises:
+        ValueError, TypeError, OverflowError: si el punto no es numérico
+    """
+    from .indice_espacial import obtener_indice_zonas
+
+    return [entrada[1].id for entrada in entradas_de_punto(latitud, longitud, indice or obtener_indice_zonas())]
+
+
+def aplicar_alerta(alerta, signo=1):
+    """
+    Sumar (signo=1) o descontar (signo=-1) una alerta en las zonas que la
+    contienen: un UPDATE por alerta
+
+    Returns:
+        int: zonas actualizadas
+    """
+    from .models import EstadisticaRiesgo
+
+    try:
+        zonas = zonas_de_punto(alerta.latitud, alerta.longitud)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    if not zonas:
+        return 0
+
+    from .riesgo_horario import desempaquetar, empaquetar, franja_de
+
+    ahora = timezone.now()
+    creado_en = alerta.creado_en or ahora
+    aporte = signo * peso_alerta(alerta.tipo) * factor_tiempo(creado_en)
+    intensidad = F('intensidad_alertas') + Value(aporte)
+    with transaction.atomic():
+        actualizadas = EstadisticaRiesgo.objects.filter(id__in=zonas).update(
+            total_alertas=F('total_alertas') + signo,
+            alertas_panico=F('alertas_panico') + (signo if alerta.tipo == 'panico' else 0),
+            alertas_accidente=F('alertas_accidente') + (signo if alerta.tipo == 'accidente' else 0),
+            intensidad_alertas=intensidad,
+            puntuacion_riesgo=_expresion_puntuacion(intensidad, ahora),
+        )
+
+        # Perfil horario: leer y reescribir con las filas ya bloqueadas por el UPDATE
+        franja = franja_de(creado_en)
+        perfiles = list(EstadisticaRiesgo.objects.select_for_update().filter(id__in=zonas).only('id', 'perfil_horario'))
+        for zona in perfiles:
+            perfil = desempaquetar(zona.perfil_horario)
+            perfil[franja] = max(perfil[franja] + aporte, 0.0)
+            zona.perfil_horario = empaquetar(perfil)
+        EstadisticaRiesgo.objects.bulk_update(perfiles, ['perfil_horario'])
+    return actualizadas
+
+
+_ejecutor = None
+_lock_ejecutor = threading.Lock()
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    with _lock_ejecutor:
+        if _ejecutor is None:
+            # Un solo hilo: las alertas se aplican en orden y sin competir por las filas de las zonas
+            _ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='agregacion-riesgo')
+        return _ejecutor
+
+
+def _aplicar_en_segundo_plano(alerta, signo):
+    try:
+        aplicar_alerta(alerta, signo)
+    except Exception:
+        logger.exception('No se pudo agregar la alerta %s a sus zonas', alerta.pk)
+    finally:
+        close_old_connections()
+
+
+def encolar_alerta(alerta, signo=1):
+    """
+    aplicar_alerta en segundo plano cuando se confirme la transacción actual
+    (con una copia: la vista puede seguir modificando la alerta)
+    """
+    copia = copy.copy(alerta)
+    transaction.on_commit(lambda: _obtener_ejecutor().submit(_aplicar_en_segundo_plano, copia, signo))
+
+
+def alerta_cambio(alerta, created):
+    """
+    Encolar un alta o cambio de estado de una alerta (señal post_save)
+
+    Solo cuenta la transición: una alerta que pasa a falsa alarma se
+    descuenta y una que deja de serlo se vuelve a sumar.
+    """
+    anterior = getattr(alerta, '_estado_guardado', None)
+    cuenta = alerta.estado not in ESTADOS_DESCARTADOS
+    if created:
+        contaba = False
+    elif anterior is None:
+        # Estado anterior desconocido (p. ej. campo diferido): no se puede saber si cambió
+        contaba = cuenta
+    else:
+        contaba = anterior not in ESTADOS_DESCARTADOS
+
+    if cuenta != contaba:
+        encolar_alerta(alerta, 1 if cuenta else -1)
+    alerta._estado_guardado = alerta.estado
+
+
+def actualizar_puntuaciones():
+    """
+    Volver a calcular la puntuación de todas las zonas con el decaimiento a
+    la fecha, a partir de la intensidad guardada (no lee las alertas). Los
+    procesos ven las puntuaciones nuevas en su siguiente revisión de la huella.
+
+    Returns:
+        int: zonas actualizadas
+    """
+    from .models import EstadisticaRiesgo
+
+    ahora = timezone.now()
+    return EstadisticaRiesgo.objects.update(
+        puntuacion_riesgo=_expresion_puntuacion(F('intensidad_alertas'), ahora),
+    )
+
+
+def recalcular_zonas(reiniciar=False, lote=5000):
+    """
+    Calcular contadores e intensidad de las zonas desde todo el histórico de alertas
+
+    Args:
+        reiniciar: poner en cero las zonas sin ninguna alerta; si no, esas
+            zonas conservan sus datos (p. ej. los de ejemplo)
+        lote: alertas leídas por consulta
+
+    Returns:
+        dict: {'alertas': leídas, 'asignadas': con al menos una zona, 'zonas': actualizadas}
+    """
+    from .indice_espacial import obtener_indice_zonas
+    from .models import Alerta, EstadisticaRiesgo
+    from .riesgo_horario import FRANJAS, empaquetar, franja_de
+
+    indice = obtener_indice_zonas()
+    totales = defaultdict(lambda: {'total_alertas': 0, 'alertas_panico': 0, 'alertas_accidente': 0,
+                                   'intensidad_alertas': 0.0})
+    perfiles = defaultdict(lambda: np.zeros(FRANJAS))
+    leidas = asignadas = 0
+
+    alertas = (
+        Alerta.objects.exclude(estado__in=ESTADOS_DESCARTADOS)
+        .values_list('latitud', 'longitud', 'tipo', 'creado_en')
+        .iterator(chunk_size=lote)
+    )
+    for latitud, longitud, tipo, creado_en in alertas:
+        leidas += 1
+        try:
+            zonas = zonas_de_punto(latitud, longitud, indice)
+        except (TypeError, ValueError, OverflowError):
+            continue
+        if zonas:
+            asignadas += 1
+        aporte = peso_alerta(tipo) * factor_tiempo(creado_en)
+        franja = franja_de(creado_en)
+        for zona_id in zonas:
+            datos = totales[zona_id]
+            datos['total_alertas'] += 1
+            datos['alertas_panico' if tipo == 'panico' else 'alertas_accidente'] += 1
+            datos['intensidad_alertas'] += aporte
+            perfiles[zona_id][franja] += aporte
+
+    ahora = timezone.now()
+    campos = ['total_alertas', 'alertas_panico', 'alertas_accidente', 'intensidad_alertas',
+              'perfil_horario', 'puntuacion_riesgo']
+    zonas = EstadisticaRiesgo.objects.all() if reiniciar else EstadisticaRiesgo.objects.filter(id__in=totales)
+    actualizar = []
+    for zona in zonas.iterator(chunk_size=lote):
+        datos = totales.get(zona.id) or totales.default_factory()
+        for campo, valor in datos.items():
+            setattr(zona, campo, valor)
+        zona.perfil_horario = empaquetar(perfiles[zona.id]) if zona.id in perfiles else None
+        zona.puntuacion_riesgo = puntuacion_para_intensidad(zona.intensidad_alertas, ahora)
+        actualizar.append(zona)
+
+    with transaction.atomic():
+        EstadisticaRiesgo.objects.bulk_update(actualizar, campos, batch_size=lote)
+    return {'alertas': leidas, 'asignadas': asignadas, 'zonas': len(actualizar)}
@@ -0,0 +1,191 @@
+"""
+Registro de alertas activas (pendientes o en atención).
+
+Responder "¿este repartidor tiene una alerta abierta?" y "¿cuáles son las
+alertas abiertas?" no debe recorrer la tabla de alertas, que crece sin límite.
+El registro mantiene en memoria las alertas activas de todo el sistema (son
+pocas) y se actualiza con las señales de Alerta en cada cambio de estado
+(crear, atender, cerrar, cancelar).
+
+Cada cierto tiempo el registro se recarga desde el índice parcial
+'alerta_activa_idx', que solo contiene las alertas activas, para recoger los
+cambios hechos por otros procesos.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+ESTADOS_ACTIVOS = ('pendiente', 'en_atencion')
+
+
+class RegistroAlertasActivas:
+    """
+    Alertas activas por repartidor: {repartidor_id: {alerta_id: creado_en}}
+    """
+
+    def __init__(self):
+        self._por_repartidor = {}
+        self._cargado_en = None
+        self._cambios_durante_carga = None
+        self._lock = threading.Lock()
+        self._carga_lock = threading.Lock()
+
+    def _vigente(self):
+        return (
+            self._cargado_en is not None
+            and time.monotonic() - self._cargado_en < settings.ALERTAS_ACTIVAS_TTL
+        )
+
+    def _asegurar_cargado(self):
+        if not self._vigente():
+            self.recargar()
+
+    def recargar(self):
+        """
+        Reconstruir el registro desde la base de datos.
+
+        Los cambios que llegan por señales mientras corre la consulta se
+        vuelven a aplicar sobre el resultado, para no perder una alerta creada
+        justo durante la recarga.
+        """
+        from .models import Alerta
+
+        with self._carga_lock:
+            if self._vigente():
+                return
+
+            with self._lock:
+                self._cambios_durante_carga = []
+
+            try:
+                filas = list(
+                    Alerta.objects.filter(estado__in=ESTADOS_ACTIVOS)
+                    .values_list('id', 'repartidor_id', 'creado_en')
+                )
+            except Exception:
+                with self._lock:
+                    self._cambios_durante_carga = None
+                raise
+
+            por_repartidor = {}
+            for alerta_id, repartidor_id, creado_en in filas:
+                por_repartidor.setdefault(repartidor_id, {})[alerta_id] = creado_en
+
+            with self._lock:
+                for cambio in self._cambios_durante_carga:
+                    self._aplicar(por_repartidor, *cambio)
+                self._cambios_durante_carga = None
+                self._por_repartidor = por_repartidor
+                self._cargado_en = time.monotonic()
+
+    @staticmethod
+    def _aplicar(por_repartidor, alerta_id, repartidor_id, creado_en, activa):
+        if activa:
+            por_repartidor.setdefault(repartidor_id, {})[alerta_id] = creado_en
+            return
+
+        alertas = por_repartidor.get(repartidor_id)
+        if alertas is not None:
+            alertas.pop(alerta_id, None)
+            if not alertas:
+                del por_repartidor[repartidor_id]
+
+    def actualizar(self, alerta):
+        """
+        Registrar el estado actual de una alerta (llamado desde las señales)
+        """
+        self._registrar_cambio(alerta.id, alerta.repartidor_id, alerta.creado_en, alerta.estado in ESTADOS_ACTIVOS)
+
+    def descartar(self, alerta):
+        self._registrar_cambio(alerta.id, alerta.repartidor_id, alerta.creado_en, False)
+
+    def _registrar_cambio(self, alerta_id, repartidor_id, creado_en, activa):
+        with self._lock:
+            cambio = (alerta_id, repartidor_id, creado_en, activa)
+            if self._cambios_durante_carga is not None:
+                self._cambios_durante_carga.append(cambio)
+            self._aplicar(self._por_repartidor, *cambio)
+
+    def de_repartidor(self, repartidor_id):
+        """
+        IDs de las alertas activas de un repartidor, de la más reciente a la más antigua
+        """
+        self._asegurar_cargado()
+        with self._lock:
+            alertas = dict(self._por_repartidor.get(repartidor_id, {}))
+        return [alerta_id for alerta_id, _ in sorted(alertas.items(), key=lambda a: a[1], reverse=True)]
+
+    def tiene_activa(self, repartidor_id):
+        self._asegurar_cargado()
+        with self._lock:
+            return bool(self._por_repartidor.get(repartidor_id))
+
+    def contar(self, repartidor_id=None):
+        self._asegurar_cargado()
+        with self._lock:
+            if repartidor_id is not None:
+                return len(self._por_repartidor.get(repartidor_id, {}))
+            return sum(len(alertas) for alertas in self._por_repartidor.values())
+
+    def todas(self):
+        """
+        IDs de todas las alertas activas del sistema
+        """
+        self._asegurar_cargado()
+        with self._lock:
+            return [alerta_id for alertas in self._por_repartidor.values() for alerta_id in alertas]
+
+    def recargando(self):
+        """
+        True mientras otro hilo reconstruye el registro desde la base de datos
+        """
+        with self._lock:
+            return self._cambios_durante_carga is not None
+
+    def invalidar(self):
+        with self._lock:
+            self._cargado_en = None
+
+
+registro_alertas_activas = RegistroAlertasActivas()
+
+
+def alerta_activa_de(repartidor):
+    """
+    Alerta activa más reciente del repartidor, o None.
+
+    Dentro de su TTL el registro es la fuente de verdad: las señales lo
+    mantienen al día, así que si no conoce ninguna alerta del repartidor no se
+    consulta la base de datos. Solo se confirma contra el índice parcial de
+    alertas activas mientras el registro se está recargando, o cuando la
+    alerta que recuerda ya no está activa (la cerró otro proceso).
+    """
+    from .models import Alerta
+
+    ids = registro_alertas_activas.de_repartidor(repartidor.id)
+    if ids:
+        alerta = Alerta.objects.filter(id=ids[0], estado__in=ESTADOS_ACTIVOS).first()
+        if alerta is not None:
+            return alerta
+        registro_alertas_activas.invalidar()
+    elif not registro_alertas_activas.recargando():
+        return None
+
+    return Alerta.objects.filter(
+        repartidor=repartidor,
+        estado__in=ESTADOS_ACTIVOS
+    ).order_by('-creado_en').first()
+
+
+def alertas_activas_queryset(repartidor=None):
+    """
+    QuerySet de alertas activas resuelto por llave primaria desde el registro
+    """
+    from .models import Alerta
+
+    if repartidor is not None:
+        ids = registro_alertas_activas.de_repartidor(repartidor.id)
+    else:
+        ids = registro_alertas_activas.todas()
+    return Alerta.objects.filter(id__in=ids, estado__in=ESTADOS_ACTIVOS)
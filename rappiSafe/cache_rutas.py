@@ -0,0 +1,112 @@
+"""
+Caché LRU con expiración para las rutas de OSRM.
+
+Los repartidores piden rutas una y otra vez entre los mismos grupos de
+restaurantes y colonias. Antes cada cálculo era una llamada HTTPS a OSRM de
+hasta 10 s. Ahora el origen y el destino se ajustan a una rejilla
+(RUTAS_CACHE_REJILLA grados, ~110 m por defecto) y, con el perfil, forman la
+clave de la caché.
+
+Solo se guarda la geometría, la distancia y la duración, no la puntuación de
+riesgo: esa se vuelve a calcular con las zonas vigentes cada vez que se usa
+una ruta de la caché, lo cual es barato con el ráster de riesgo.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class CacheRutas:
+    """
+    Diccionario LRU con TTL por entrada y contadores de aciertos y fallos
+    """
+
+    def __init__(self, capacidad=None, ttl=None, rejilla=None):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.rejilla = rejilla
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expiradas = 0
+        self.desalojadas = 0
+
+    def _capacidad(self):
+        return self.capacidad or settings.RUTAS_CACHE_CAPACIDAD
+
+    def _ttl(self):
+        return self.ttl if self.ttl is not None else settings.RUTAS_CACHE_TTL
+
+    def _ajustar(self, valor):
+        rejilla = self.rejilla or settings.RUTAS_CACHE_REJILLA
+        return round(round(float(valor) / rejilla) * rejilla, 6)
+
+    def clave(self, origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving', alternativas=False,
+              version=None):
+        """
+        Clave de la ruta con origen y destino ajustados a la rejilla. `version`
+        distingue geometrías que dependen de las zonas de riesgo (grafo vial).
+
+        Raises:
+            ValueError, TypeError: si alguna coordenada no es numérica
+        """
+        return (
+            perfil,
+            bool(alternativas),
+            version,
+            self._ajustar(origen_lat), self._ajustar(origen_lon),
+            self._ajustar(destino_lat), self._ajustar(destino_lon),
+        )
+
+    def obtener(self, clave):
+        """
+        Returns:
+            El valor guardado, o None si no está o ya expiró
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+
+            valor, expira_en = entrada
+            if time.monotonic() >= expira_en:
+                del self._entradas[clave]
+                self.expiradas += 1
+                self.fallos += 1
+                return None
+
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (valor, time.monotonic() + self._ttl())
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self._capacidad():
+                self._entradas.popitem(last=False)
+                self.desalojadas += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'capacidad': self._capacidad(),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 3) if consultas else 0.0,
+                'expiradas': self.expiradas,
+                'desalojadas': self.desalojadas,
+            }
+
+
+cache_rutas = CacheRutas()
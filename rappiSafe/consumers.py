@@ -2,7 +2,11 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from .models import Alerta, Trayectoria, User
+from django.core.exceptions import ValidationError
+from django.db.models import Count
+from .models import Alerta, RepartidorProfile, User
+from .alertas_activas import registro_alertas_activas
+from .trayectorias import buffer_trayectorias
 
 
 class AlertasConsumer(AsyncWebsocketConsumer):
@@ -67,6 +71,7 @@ class UbicacionConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.alerta_id = self.scope['url_route']['kwargs']['alerta_id']
         self.group_name = f'ubicacion_{self.alerta_id}'
+        self.alerta_valida = None
 
         # Verificar autenticación
         if self.scope["user"] == AnonymousUser():
@@ -96,14 +101,23 @@ class UbicacionConsumer(AsyncWebsocketConsumer):
             data = json.loads(text_data)
 
             if data.get('tipo') == 'ubicacion':
-                # Guardar la trayectoria en la base de datos
-                await self.guardar_trayectoria(
-                    self.alerta_id,
-                    data.get('latitud'),
-                    data.get('longitud'),
-                    data.get('precision'),
-                    data.get('velocidad')
-                )
+                # La alerta se valida una sola vez por conexión
+                if self.alerta_valida is None:
+                    self.alerta_valida = await self.validar_alerta(self.alerta_id)
+
+                # Guardar la trayectoria (escritura diferida en lotes)
+                if self.alerta_valida:
+                    try:
+                        buffer_trayectorias.agregar(
+                            self.alerta_id,
+                            data.get('latitud'),
+                            data.get('longitud'),
+                            data.get('precision'),
+                            data.get('velocidad')
+                        )
+                    except ValueError:
+                        # Coordenadas inválidas: no se guardan ni se retransmiten
+                        return
 
                 # Transmitir a todos en el grupo
                 await self.channel_layer.group_send(
@@ -134,21 +148,14 @@ class UbicacionConsumer(AsyncWebsocketConsumer):
         }))
 
     @database_sync_to_async
-    def guardar_trayectoria(self, alerta_id, latitud, longitud, precision, velocidad):
+    def validar_alerta(self, alerta_id):
         """
-        Guardar punto de trayectoria en la base de datos
+        Verificar que la alerta exista antes de guardar puntos de su trayectoria
         """
         try:
-            alerta = Alerta.objects.get(id=alerta_id)
-            Trayectoria.objects.create(
-                alerta=alerta,
-                latitud=latitud,
-                longitud=longitud,
-                precision=precision,
-                velocidad=velocidad
-            )
-        except Alerta.DoesNotExist:
-            pass
+            return Alerta.objects.filter(id=alerta_id).exists()
+        except (ValueError, ValidationError):
+            return False
 
 
 class MonitoreoConsumer(AsyncWebsocketConsumer):
@@ -236,11 +243,15 @@ class MonitoreoConsumer(AsyncWebsocketConsumer):
         """
         Obtener estado actual del sistema
         """
-        alertas_activas = Alerta.objects.filter(
-            estado__in=['pendiente', 'en_atencion']
-        ).count()
+        alertas_activas = registro_alertas_activas.contar()
+
+        # Solo conteos agregados; las posiciones llegan por los eventos de cada repartidor
+        repartidores_por_estado = dict(
+            RepartidorProfile.objects.order_by().values_list('estado').annotate(total=Count('user_id'))
+        )
 
         return {
             'alertas_activas': alertas_activas,
+            'repartidores_por_estado': repartidores_por_estado,
             'timestamp': None  # Se llenará en el cliente
         }
@@ -0,0 +1,155 @@
+"""
+Ventana de deduplicación para alertas de accidente.
+
+Un solo choque puede hacer que la lógica del acelerómetro del teléfono envíe
+varias alertas de accidente en pocos segundos. Las alertas que llegan dentro de
+la ventana de tiempo y distancia de una alerta de accidente activa del mismo
+repartidor se fusionan en ella en lugar de crear una alerta nueva.
+"""
+import threading
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .alertas_activas import ESTADOS_ACTIVOS
+from .utils import calcular_distancia_km
+
+
+class IndiceAlertasRecientes:
+    """
+    Índice en memoria de las alertas de accidente recientes por repartidor.
+
+    Cada entrada es (creado_en, latitud, longitud, alerta_id). Las entradas más
+    viejas que la ventana se descartan al consultar, así que el índice solo
+    guarda unas pocas alertas por repartidor.
+
+    Los candados son un número fijo de franjas compartidas entre repartidores,
+    así que no crecen con el número de repartidores que alguna vez reportaron
+    un accidente.
+    """
+
+    FRANJAS_BLOQUEO = 64
+
+    def __init__(self):
+        self._por_repartidor = defaultdict(deque)
+        self._bloqueos = [threading.Lock() for _ in range(self.FRANJAS_BLOQUEO)]
+        self._lock = threading.Lock()
+
+    def bloqueo(self, repartidor_id):
+        """
+        Candado del repartidor para que dos alertas simultáneas del mismo
+        repartidor no se creen en paralelo dentro de este proceso
+        """
+        return self._bloqueos[hash(repartidor_id) % self.FRANJAS_BLOQUEO]
+
+    def registrar(self, repartidor_id, alerta_id, latitud, longitud, creado_en):
+        limite = timezone.now() - timedelta(seconds=settings.ALERTAS_DEDUP_VENTANA)
+        with self._lock:
+            # Las alertas de accidente son pocas: al registrar una se descartan
+            # los repartidores cuya alerta más nueva ya salió de la ventana
+            vencidos = [rid for rid, recientes in self._por_repartidor.items() if not recientes or recientes[-1][0] < limite]
+            for rid in vencidos:
+                del self._por_repartidor[rid]
+            self._por_repartidor[repartidor_id].append((creado_en, float(latitud), float(longitud), alerta_id))
+
+    def buscar(self, repartidor_id, latitud, longitud, ahora=None):
+        """
+        Buscar la alerta reciente más nueva dentro de la ventana de tiempo y distancia
+
+        Returns:
+            ID de la alerta o None
+        """
+        ahora = ahora or timezone.now()
+        limite = ahora - timedelta(seconds=settings.ALERTAS_DEDUP_VENTANA)
+        distancia_maxima = settings.ALERTAS_DEDUP_DISTANCIA_M / 1000
+
+        with self._lock:
+            recientes = self._por_repartidor.get(repartidor_id)
+            if not recientes:
+                return None
+
+            while recientes and recientes[0][0] < limite:
+                recientes.popleft()
+            if not recientes:
+                del self._por_repartidor[repartidor_id]
+                return None
+
+            candidatas = list(recientes)
+
+        for creado_en, lat, lon, alerta_id in reversed(candidatas):
+            if calcular_distancia_km(lat, lon, latitud, longitud) <= distancia_maxima:
+                return alerta_id
+        return None
+
+    def descartar(self, repartidor_id, alerta_id):
+        with self._lock:
+            recientes = self._por_repartidor.get(repartidor_id)
+            if recientes:
+                self._por_repartidor[repartidor_id] = deque(e for e in recientes if e[3] != alerta_id)
+
+
+indice_accidentes = IndiceAlertasRecientes()
+
+
+def buscar_alerta_duplicada(repartidor, latitud, longitud):
+    """
+    Buscar una alerta de accidente activa del repartidor dentro de la ventana
+    de deduplicación.
+
+    Consulta primero el índice en memoria; si no hay coincidencia (por ejemplo
+    porque la alerta original la creó otro proceso) revisa la base de datos
+    con una consulta acotada al repartidor y a la ventana de tiempo.
+
+    Returns:
+        Alerta activa con la que fusionar, o None
+    """
+    from .models import Alerta
+
+    if latitud is None or longitud is None:
+        return None
+
+    alerta_id = indice_accidentes.buscar(repartidor.id, latitud, longitud)
+    if alerta_id is not None:
+        alerta = Alerta.objects.filter(id=alerta_id, estado__in=ESTADOS_ACTIVOS).first()
+        if alerta is not None:
+            return alerta
+        indice_accidentes.descartar(repartidor.id, alerta_id)
+
+    limite = timezone.now() - timedelta(seconds=settings.ALERTAS_DEDUP_VENTANA)
+    distancia_maxima = settings.ALERTAS_DEDUP_DISTANCIA_M / 1000
+    recientes = Alerta.objects.filter(
+        repartidor=repartidor,
+        tipo='accidente',
+        estado__in=ESTADOS_ACTIVOS,
+        creado_en__gte=limite
+    ).order_by('-creado_en')
+
+    for alerta in recientes:
+        indice_accidentes.registrar(repartidor.id, alerta.id, alerta.latitud, alerta.longitud, alerta.creado_en)
+        if calcular_distancia_km(alerta.latitud, alerta.longitud, latitud, longitud) <= distancia_maxima:
+            return alerta
+    return None
+
+
+def fusionar_en_alerta(alerta, data):
+    """
+    Agregar una alerta repetida a los datos de sensores de la alerta existente
+    """
+    from .models import Alerta
+
+    alerta = Alerta.objects.select_for_update().get(id=alerta.id)
+    datos = alerta.datos_sensores if isinstance(alerta.datos_sensores, dict) else {}
+    datos.setdefault('eventos_repetidos', []).append({
+        'recibido_en': timezone.now().isoformat(),
+        'latitud': data.get('latitud'),
+        'longitud': data.get('longitud'),
+        'bateria': data.get('bateria'),
+        'datos_sensores': data.get('datos_sensores', {}),
+    })
+    alerta.datos_sensores = datos
+    if data.get('bateria') is not None:
+        alerta.nivel_bateria = data.get('bateria')
+    alerta.save(update_fields=['datos_sensores', 'nivel_bateria', 'actualizado_en'])
+    return alerta
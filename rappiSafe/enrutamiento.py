@@ -0,0 +1,213 @@
+"""
+Backends de cálculo de rutas.
+
+utils.obtener_ruta_osrm y obtener_rutas_alternativas piden las rutas al
+backend configurado en RUTAS_BACKEND en lugar de llamar directamente a
+router.project-osrm.org:
+
+- 'osrm': un servidor OSRM (RUTAS_OSRM_URL, el público por defecto o uno
+  propio cerca de los servidores de la aplicación) con una sesión HTTP que
+  reutiliza conexiones keep-alive entre peticiones.
+- 'local': un enrutador determinista sin red para pruebas, demos y pruebas
+  de carga. Traza rutas en forma de L sobre la cuadrícula de calles y una
+  variante con rodeo.
+- 'grafo': búsqueda A* sobre el grafo vial local (RUTAS_GRAFO_ARCHIVO) que
+  evita las zonas de riesgo dentro de un presupuesto de desvío.
+
+También se acepta la ruta completa de una clase propia (como en los backends
+de Django), que debe implementar BackendRutas.rutas.
+"""
+import math
+import threading
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+RADIO_TIERRA_M = 6371000
+
+BACKENDS = {
+    'osrm': 'rappiSafe.enrutamiento.BackendOSRM',
+    'local': 'rappiSafe.enrutamiento.BackendLocal',
+    'grafo': 'rappiSafe.enrutamiento.BackendGrafo',
+}
+
+
+class ErrorEnrutamiento(Exception):
+    """
+    El backend no pudo calcular la ruta
+    """
+
+
+class BackendRutas:
+    """
+    Interfaz de un backend de rutas
+    """
+
+    def rutas(self, origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving', alternativas=False):
+        """
+        Args:
+            perfil: driving, walking o cycling
+            alternativas: pedir hasta 3 rutas en lugar de una
+
+        Returns:
+            list: dicts {'coordenadas': [[lat, lng], ...], 'distancia': metros,
+            'duracion': segundos}, la más rápida primero
+
+        Raises:
+            ErrorEnrutamiento: si no hay ruta
+        """
+        raise NotImplementedError
+
+
+class BackendOSRM(BackendRutas):
+    """
+    Servidor OSRM por HTTP con un pool de conexiones persistentes
+    """
+
+    def __init__(self, url=None, timeout=None, conexiones=None):
+        self.url = (url or settings.RUTAS_OSRM_URL).rstrip('/')
+        self.timeout = timeout or settings.RUTAS_OSRM_TIMEOUT
+        conexiones = conexiones or settings.RUTAS_POOL_CONEXIONES
+
+        # Un solo host: un pool con hasta `conexiones` conexiones keep-alive compartidas por los hilos
+        self.sesion = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=conexiones)
+        self.sesion.mount('http://', adaptador)
+        self.sesion.mount('https://', adaptador)
+
+    def rutas(self, origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving', alternativas=False):
+        url = f"{self.url}/route/v1/{perfil}/{origen_lon},{origen_lat};{destino_lon},{destino_lat}"
+        params = {
+            'overview': 'full',
+            'geometries': 'geojson',
+            'steps': 'false'
+        }
+        if alternativas:
+            params['alternatives'] = 'true'  # Solicitar rutas alternativas
+            params['continue_straight'] = 'false'  # Permitir giros en U para más alternativas
+
+        response = self.sesion.get(url, params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ErrorEnrutamiento(f'OSRM respondió {response.status_code}')
+
+        data = response.json()
+        if data.get('code') != 'Ok' or not data.get('routes'):
+            raise ErrorEnrutamiento(data.get('message') or 'OSRM no devolvió rutas')
+
+        return [
+            {
+                # Convertir coordenadas de [lon, lat] a [lat, lon]
+                'coordenadas': [[coord[1], coord[0]] for coord in route['geometry']['coordinates']],
+                'distancia': route['distance'],
+                'duracion': route['duration'],
+            }
+            for route in data['routes']
+        ]
+
+
+class BackendLocal(BackendRutas):
+    """
+    Enrutador determinista sin red: la misma consulta siempre da las mismas rutas
+    """
+
+    # Velocidad media por perfil (km/h)
+    VELOCIDADES = {'driving': 25.0, 'cycling': 15.0, 'walking': 5.0}
+
+    def __init__(self, espaciado_m=15.0, rodeo=0.6):
+        self.espaciado_m = espaciado_m
+        self.rodeo = rodeo
+
+    def rutas(self, origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving', alternativas=False):
+        origen = (float(origen_lat), float(origen_lon))
+        destino = (float(destino_lat), float(destino_lon))
+        if not all(math.isfinite(valor) for valor in origen + destino):
+            raise ErrorEnrutamiento('Coordenadas inválidas')
+
+        # Primero hacia el norte/sur y luego al este/oeste, y al revés
+        caminos = [[origen, (destino[0], origen[1]), destino]]
+        if alternativas:
+            caminos.append([origen, (origen[0], destino[1]), destino])
+            # Rodeo por un punto desplazado a un lado de la línea recta
+            medio = ((origen[0] + destino[0]) / 2, (origen[1] + destino[1]) / 2)
+            desvio = (
+                medio[0] - (destino[1] - origen[1]) * self.rodeo,
+                medio[1] + (destino[0] - origen[0]) * self.rodeo
+            )
+            caminos.append([origen, (desvio[0], origen[1]), desvio, (destino[0], desvio[1]), destino])
+
+        velocidad = self.VELOCIDADES.get(perfil, self.VELOCIDADES['driving']) / 3.6  # m/s
+        rutas = []
+        for vertices in caminos:
+            coordenadas, distancia = self._trazar(vertices)
+            rutas.append({'coordenadas': coordenadas, 'distancia': distancia, 'duracion': distancia / velocidad})
+        # Como OSRM: la más rápida primero
+        rutas.sort(key=lambda ruta: ruta['duracion'])
+        return rutas
+
+    def _trazar(self, vertices):
+        """
+        Densificar los tramos cada `espaciado_m` metros, como el overview=full de OSRM
+        """
+        coordenadas = [list(vertices[0])]
+        distancia = 0.0
+        for (lat1, lng1), (lat2, lng2) in zip(vertices, vertices[1:]):
+            largo = _distancia_m(lat1, lng1, lat2, lng2)
+            pasos = max(1, math.ceil(largo / self.espaciado_m))
+            for paso in range(1, pasos + 1):
+                t = paso / pasos
+                coordenadas.append([lat1 + (lat2 - lat1) * t, lng1 + (lng2 - lng1) * t])
+            distancia += largo
+        return coordenadas, distancia
+
+
+class BackendGrafo(BackendRutas):
+    """
+    Rutas sobre el grafo vial local: la más rápida y alternativas reales de menor riesgo
+    """
+
+    def __init__(self, grafo=None):
+        from .grafo_vial import obtener_grafo
+
+        self.grafo = grafo or obtener_grafo()
+        if self.grafo is None:
+            raise ErrorEnrutamiento('RUTAS_GRAFO_ARCHIVO no está configurado')
+
+    def rutas(self, origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving', alternativas=False):
+        rutas = self.grafo.rutas_seguras(
+            float(origen_lat), float(origen_lon), float(destino_lat), float(destino_lon),
+            maximo=3 if alternativas else 1
+        )
+        if not rutas:
+            raise ErrorEnrutamiento('No hay camino en el grafo vial entre esos puntos')
+        return rutas
+
+
+def _distancia_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return RADIO_TIERRA_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def obtener_backend():
+    """
+    Backend configurado en RUTAS_BACKEND, uno por proceso para compartir el pool de conexiones
+    """
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = import_string(BACKENDS.get(settings.RUTAS_BACKEND, settings.RUTAS_BACKEND))()
+        return _backend
+
+
+def reiniciar_backend():
+    """
+    Descartar el backend actual (por ejemplo tras cambiar RUTAS_BACKEND en pruebas)
+    """
+    global _backend
+    with _lock:
+        _backend = None
@@ -0,0 +1,160 @@
+"""
+Publicador de eventos WebSocket sin bloquear la vista.
+
+Las vistas síncronas llaman a los helpers enviar_* de utils; antes cada uno
+hacía uno o varios async_to_sync(group_send) en el hilo de la petición. Ahora
+los eventos se encolan en un event loop persistente y la llamada regresa de
+inmediato. Los envíos a varios grupos de un mismo evento (por ejemplo
+'alertas' y 'monitoreo' para una alerta nueva) se hacen en paralelo.
+
+Con InMemoryChannelLayer las colas de los consumidores viven en el event loop
+del servidor ASGI (Daphne), así que en ese caso los eventos se entregan en ese
+loop; con Redis se usa un hilo propio con su event loop.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from asgiref.sync import SyncToAsync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+class PublicadorEventos:
+    """
+    Cola de eventos hacia la capa de canales, drenada en un event loop persistente
+    """
+
+    def __init__(self, tamano_lote=100):
+        self.tamano_lote = tamano_lote
+        self._loop = None
+        self._loop_servidor = None
+        self._colas = {}
+        self._en_curso = 0
+        self._condicion = threading.Condition()
+        self._lock = threading.Lock()
+
+    def publicar(self, *envios):
+        """
+        Encolar un evento y regresar sin esperar la entrega.
+
+        Args:
+            envios: tuplas (grupo, mensaje); todas forman un solo evento
+        """
+        if not envios:
+            return
+
+        with self._condicion:
+            self._en_curso += 1
+        try:
+            self._loop_destino().call_soon_threadsafe(self._encolar, envios)
+        except RuntimeError:
+            # El loop se cerró (apagado del servidor): no hay a quién entregar
+            self._terminado(1)
+            logger.warning('Evento descartado, el event loop ya no está activo: %s', [g for g, _ in envios])
+
+    def esperar(self, timeout=None):
+        """
+        Esperar a que se entreguen los eventos encolados (scripts, pruebas y apagado)
+
+        Returns:
+            bool: True si no quedó ningún evento pendiente
+        """
+        with self._condicion:
+            return self._condicion.wait_for(lambda: self._en_curso == 0, timeout)
+
+    def _loop_destino(self):
+        loop = self._detectar_loop_servidor()
+        if loop is not None and isinstance(get_channel_layer(), InMemoryChannelLayer):
+            return loop
+        return self._obtener_loop_propio()
+
+    def _detectar_loop_servidor(self):
+        """
+        Event loop del servidor ASGI: asgiref lo deja en un threadlocal del hilo
+        que ejecuta la vista. Se recuerda para los eventos publicados desde
+        otros hilos (por ejemplo los trabajadores de notificaciones).
+        """
+        if getattr(SyncToAsync.threadlocal, 'main_event_loop_pid', None) == os.getpid():
+            loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+            if loop is not None:
+                self._loop_servidor = loop
+
+        loop = self._loop_servidor
+        if loop is not None and loop.is_running():
+            return loop
+        return None
+
+    def _obtener_loop_propio(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name='publicador-eventos',
+                    daemon=True
+                ).start()
+            return self._loop
+
+    def _encolar(self, envios):
+        # Se ejecuta dentro del loop destino
+        loop = asyncio.get_running_loop()
+        cola = self._colas.get(loop)
+        if cola is None:
+            cola = self._colas[loop] = asyncio.Queue()
+            loop.create_task(self._drenar(cola))
+        cola.put_nowait(envios)
+
+    async def _drenar(self, cola):
+        while True:
+            lote = [await cola.get()]
+            while not cola.empty() and len(lote) < self.tamano_lote:
+                lote.append(cola.get_nowait())
+
+            try:
+                await self._enviar_lote(lote)
+            except Exception:
+                logger.exception('Error al publicar %s evento(s) WebSocket', len(lote))
+            finally:
+                self._terminado(len(lote))
+
+    async def _enviar_lote(self, lote):
+        """
+        Enviar un lote de eventos: los grupos distintos en paralelo y los
+        mensajes de un mismo grupo en orden (p. ej. ubicaciones sucesivas)
+        """
+        por_grupo = defaultdict(list)
+        for envios in lote:
+            for grupo, mensaje in envios:
+                por_grupo[grupo].append(mensaje)
+
+        channel_layer = get_channel_layer()
+
+        async def enviar_grupo(grupo, mensajes):
+            for mensaje in mensajes:
+                await channel_layer.group_send(grupo, mensaje)
+
+        resultados = await asyncio.gather(
+            *(enviar_grupo(grupo, mensajes) for grupo, mensajes in por_grupo.items()),
+            return_exceptions=True
+        )
+        for grupo, resultado in zip(por_grupo, resultados):
+            if isinstance(resultado, Exception):
+                logger.error('Error al enviar al grupo %s: %s', grupo, resultado)
+
+    def _terminado(self, cantidad):
+        with self._condicion:
+            self._en_curso -= cantidad
+            if self._en_curso <= 0:
+                self._condicion.notify_all()
+
+
+publicador = PublicadorEventos()
+
+# Los scripts y comandos terminan justo después de publicar; dar un momento
+# para que los últimos eventos salgan antes de que muera el hilo del loop
+atexit.register(publicador.esperar, 2)
@@ -0,0 +1,401 @@
+"""
+Grafo vial local para calcular rutas seguras sin depender de OSRM.
+
+OSRM solo devuelve las alternativas que él decide; cuando regresan menos de
+tres, obtener_rutas_alternativas inventaba variantes "seguras" con la misma
+geometría. Con un extracto de la red vial cargado en memoria se buscan rutas
+reales que evitan las zonas de riesgo:
+
+- El grafo se guarda en arreglos compactos (formato CSR): para cada nodo, el
+  rango de sus aristas en `destinos`, `longitudes` y `tiempos`.
+- El costo de una arista es su tiempo de recorrido multiplicado por
+  (1 + peso × riesgo), donde el riesgo (0 a 1) es el mayor aporte de una zona
+  en el punto medio de la arista, leído del ráster de riesgo.
+- A* con la distancia en línea recta a la velocidad máxima como heurística
+  (nunca sobreestima el costo, así que la ruta es óptima para cada peso).
+- Con pesos de riesgo crecientes se obtienen rutas cada vez más seguras y se
+  conservan las que no exceden el presupuesto de desvío sobre la más rápida.
+
+El grafo se genera con el comando importar_grafo_vial a partir de un GeoJSON
+de calles (por ejemplo exportado de OpenStreetMap).
+"""
+import heapq
+import json
+import logging
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RADIO_TIERRA_M = 6371000
+
+# Velocidad (km/h) por tipo de vía de OpenStreetMap cuando no trae maxspeed
+VELOCIDADES_VIA = {
+    'motorway': 80, 'motorway_link': 50, 'trunk': 60, 'trunk_link': 40,
+    'primary': 45, 'primary_link': 35, 'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25, 'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+
+
+def _distancias_m(lat1, lng1, lat2, lng2):
+    """
+    Distancia Haversine en metros (acepta arreglos)
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(valor) for valor in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return RADIO_TIERRA_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class GrafoVial:
+    """
+    Red vial dirigida en arreglos compactos
+    """
+
+    def __init__(self, lat, lng, inicio, destinos, longitudes, velocidades):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.inicio = np.asarray(inicio, dtype=np.int64)
+        self.destinos = np.asarray(destinos, dtype=np.int32)
+        self.longitudes = np.asarray(longitudes, dtype=np.float32)
+        self.velocidades = np.asarray(velocidades, dtype=np.float32)
+        self.tiempos = self.longitudes / self.velocidades
+        self.velocidad_maxima = float(self.velocidades.max()) if len(self.velocidades) else 1.0
+
+        # Origen de cada arista, para el punto medio y para reconstruir rutas
+        self.origenes = np.repeat(np.arange(len(self.lat), dtype=np.int32), np.diff(self.inicio))
+
+        self._riesgos = None
+        self.version_riesgo = None
+        self._lock = threading.Lock()
+        # Copias como listas de Python: indexarlas en el ciclo de A* es mucho más rápido
+        self._listas = (
+            self.inicio.tolist(), self.destinos.tolist(), self.tiempos.tolist(),
+            self.lat.tolist(), self.lng.tolist()
+        )
+
+    @property
+    def num_nodos(self):
+        return len(self.lat)
+
+    @property
+    def num_aristas(self):
+        return len(self.destinos)
+
+    @classmethod
+    def desde_aristas(cls, lat, lng, origenes, destinos, velocidades):
+        """
+        Construir el grafo a partir de listas de aristas (índices de nodos,
+        velocidades en m/s); las longitudes se calculan con las coordenadas
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        origenes = np.asarray(origenes, dtype=np.int64)
+        destinos = np.asarray(destinos, dtype=np.int64)
+
+        orden = np.argsort(origenes, kind='stable')
+        origenes, destinos = origenes[orden], destinos[orden]
+        velocidades = np.asarray(velocidades, dtype=np.float32)[orden]
+        longitudes = _distancias_m(lat[origenes], lng[origenes], lat[destinos], lng[destinos])
+
+        inicio = np.zeros(len(lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(origenes, minlength=len(lat)), out=inicio[1:])
+        # Aristas de longitud 0 (nodos repetidos) no aportan y romperían los tiempos
+        longitudes = np.maximum(longitudes, 0.1)
+        return cls(lat, lng, inicio, destinos, longitudes, velocidades)
+
+    @classmethod
+    def desde_geojson(cls, datos, decimales=7):
+        """
+        Grafo a partir de un FeatureCollection de LineString/MultiLineString
+        con las propiedades de OpenStreetMap (highway, oneway, maxspeed).
+        Los vértices que coinciden (redondeados a `decimales`) se unen.
+        """
+        nodos = {}
+        lat, lng = [], []
+        origenes, destinos, velocidades = [], [], []
+
+        def nodo(coordenada):
+            clave = (round(coordenada[1], decimales), round(coordenada[0], decimales))
+            indice = nodos.get(clave)
+            if indice is None:
+                indice = nodos[clave] = len(lat)
+                lat.append(clave[0])
+                lng.append(clave[1])
+            return indice
+
+        for feature in datos.get('features', []):
+            propiedades = feature.get('properties') or {}
+            via = propiedades.get('highway')
+            if via not in VELOCIDADES_VIA:
+                # Banquetas, escaleras, ciclovías, etc.
+                continue
+
+            velocidad = _velocidad(propiedades.get('maxspeed'), VELOCIDADES_VIA[via]) / 3.6
+            sentido = str(propiedades.get('oneway', '')).lower()
+            ida = sentido not in ('-1', 'reverse')
+            vuelta = sentido in ('-1', 'reverse') or (
+                sentido not in ('yes', 'true', '1') and via not in ('motorway', 'motorway_link')
+            )
+
+            geometria = feature.get('geometry') or {}
+            if geometria.get('type') == 'LineString':
+                lineas = [geometria.get('coordinates', [])]
+            elif geometria.get('type') == 'MultiLineString':
+                lineas = geometria.get('coordinates', [])
+            else:
+                continue
+
+            for linea in lineas:
+                indices = [nodo(coordenada) for coordenada in linea]
+                for a, b in zip(indices, indices[1:]):
+                    if a == b:
+                        continue
+                    if ida:
+                        origenes.append(a)
+                        destinos.append(b)
+                        velocidades.append(velocidad)
+                    if vuelta:
+                        origenes.append(b)
+                        destinos.append(a)
+                        velocidades.append(velocidad)
+
+        if not lat:
+            raise ValueError('El GeoJSON no contiene calles utilizables')
+        return cls.desde_aristas(lat, lng, origenes, destinos, velocidades)
+
+    @classmethod
+    def cuadricula(cls, lat, lng, filas, columnas, separacion_m=150, velocidad_kmh=25, avenidas_cada=5):
+        """
+        Cuadrícula de calles de doble sentido (para pruebas y demos), con
+        avenidas más rápidas cada `avenidas_cada` calles
+        """
+        paso_lat = separacion_m / 111195.0
+        paso_lng = paso_lat / math.cos(math.radians(lat))
+        filas_n, columnas_n = np.meshgrid(np.arange(filas), np.arange(columnas), indexing='ij')
+        lat_nodos = (lat + filas_n * paso_lat).ravel()
+        lng_nodos = (lng + columnas_n * paso_lng).ravel()
+
+        origenes, destinos, velocidades = [], [], []
+        for f in range(filas):
+            for c in range(columnas):
+                nodo = f * columnas + c
+                for vecino, avenida in ((nodo + 1, f % avenidas_cada == 0), (nodo + columnas, c % avenidas_cada == 0)):
+                    if (vecino == nodo + 1 and c + 1 >= columnas) or vecino >= filas * columnas:
+                        continue
+                    velocidad = (velocidad_kmh * (1.6 if avenida else 1.0)) / 3.6
+                    origenes += [nodo, vecino]
+                    destinos += [vecino, nodo]
+                    velocidades += [velocidad, velocidad]
+        return cls.desde_aristas(lat_nodos, lng_nodos, origenes, destinos, velocidades)
+
+    @classmethod
+    def cargar(cls, archivo):
+        with np.load(archivo) as datos:
+            return cls(datos['lat'], datos['lng'], datos['inicio'], datos['destinos'],
+                       datos['longitudes'], datos['velocidades'])
+
+    def guardar(self, archivo):
+        np.savez_compressed(
+            archivo, lat=self.lat, lng=self.lng, inicio=self.inicio, destinos=self.destinos,
+            longitudes=self.longitudes, velocidades=self.velocidades
+        )
+
+    def nodo_mas_cercano(self, lat, lng):
+        """
+        Returns:
+            tuple: (índice del nodo, distancia en metros)
+        """
+        cos_lat = math.cos(math.radians(lat))
+        d2 = (self.lat - lat) ** 2 + ((self.lng - lng) * cos_lat) ** 2
+        nodo = int(np.argmin(d2))
+        return nodo, float(_distancias_m(lat, lng, self.lat[nodo], self.lng[nodo]))
+
+    def riesgos(self):
+        """
+        Riesgo (0 a 1) de cada arista según el ráster de riesgo vigente.
+        Se recalcula cuando cambia la versión del ráster; mientras el ráster
+        se reconstruye se siguen usando los riesgos anteriores.
+        """
+        from .raster_riesgo import obtener_raster, raster_en_memoria
+
+        raster = obtener_raster()
+        with self._lock:
+            if self._riesgos is not None and (raster is None or raster.version == self.version_riesgo):
+                return self._riesgos
+            if raster is None:
+                raster = raster_en_memoria()
+
+            lat_medio = (self.lat[self.origenes] + self.lat[self.destinos]) / 2
+            lng_medio = (self.lng[self.origenes] + self.lng[self.destinos]) / 2
+            self._riesgos = (raster.maximas(lat_medio, lng_medio) / 10.0).tolist()
+            self.version_riesgo = raster.version
+            return self._riesgos
+
+    def ruta(self, origen, destino, peso_riesgo=0.0, riesgos=None):
+        """
+        A* entre dos nodos minimizando tiempo × (1 + peso_riesgo × riesgo)
+
+        Returns:
+            list | None: nodos de la ruta, o None si no hay camino
+        """
+        inicio, destinos, tiempos, lat, lng = self._listas
+        if peso_riesgo and riesgos is None:
+            riesgos = self.riesgos()
+
+        lat_d, lng_d = math.radians(lat[destino]), math.radians(lng[destino])
+        cos_d = math.cos(lat_d)
+        velocidad = self.velocidad_maxima
+
+        def heuristica(nodo):
+            lat_n, lng_n = math.radians(lat[nodo]), math.radians(lng[nodo])
+            a = math.sin((lat_d - lat_n) / 2) ** 2 + math.cos(lat_n) * cos_d * math.sin((lng_d - lng_n) / 2) ** 2
+            return RADIO_TIERRA_M * 2 * math.asin(min(1.0, math.sqrt(a))) / velocidad * 0.999
+
+        costos = {origen: 0.0}
+        previos = {origen: -1}
+        cerrados = set()
+        abiertos = [(heuristica(origen), 0.0, origen)]
+
+        while abiertos:
+            _, costo, nodo = heapq.heappop(abiertos)
+            if nodo == destino:
+                camino = [nodo]
+                while previos[camino[-1]] != -1:
+                    camino.append(previos[camino[-1]])
+                return camino[::-1]
+            if nodo in cerrados:
+                continue
+            cerrados.add(nodo)
+
+            for arista in range(inicio[nodo], inicio[nodo + 1]):
+                vecino = destinos[arista]
+                if vecino in cerrados:
+                    continue
+                tramo = tiempos[arista]
+                if peso_riesgo:
+                    tramo *= 1.0 + peso_riesgo * riesgos[arista]
+                nuevo = costo + tramo
+                if nuevo < costos.get(vecino, math.inf):
+                    costos[vecino] = nuevo
+                    previos[vecino] = nodo
+                    heapq.heappush(abiertos, (nuevo + heuristica(vecino), nuevo, vecino))
+        return None
+
+    def _aristas(self, camino):
+        """
+        Índices de las aristas de un camino (la más rápida entre cada par de nodos)
+        """
+        inicio, destinos, tiempos = self._listas[:3]
+        aristas = []
+        for a, b in zip(camino, camino[1:]):
+            candidatas = [e for e in range(inicio[a], inicio[a + 1]) if destinos[e] == b]
+            aristas.append(min(candidatas, key=lambda e: tiempos[e]))
+        return aristas
+
+    def resumen(self, camino, riesgos=None):
+        """
+        Distancia (m), tiempo (s) y riesgo medio ponderado por tiempo (0 a 1) de un camino
+        """
+        aristas = self._aristas(camino)
+        riesgos = riesgos if riesgos is not None else self.riesgos()
+        tiempo = sum(self._listas[2][e] for e in aristas)
+        distancia = float(sum(float(self.longitudes[e]) for e in aristas))
+        riesgo = sum(self._listas[2][e] * riesgos[e] for e in aristas) / tiempo if tiempo else 0.0
+        return distancia, tiempo, riesgo
+
+    def rutas_seguras(self, origen_lat, origen_lon, destino_lat, destino_lon,
+                      presupuesto=None, pesos=None, maximo=3):
+        """
+        La ruta más rápida y hasta `maximo - 1` rutas de menor riesgo cuyo
+        tiempo no excede el de la más rápida en más de `presupuesto` (fracción)
+
+        Returns:
+            list: dicts {'coordenadas', 'distancia' (m), 'duracion' (s), 'riesgo' (0 a 1)},
+            la más rápida primero; vacía si los puntos están fuera del grafo o no hay camino
+        """
+        presupuesto = settings.RUTAS_GRAFO_PRESUPUESTO_DESVIO if presupuesto is None else presupuesto
+        pesos = pesos or settings.RUTAS_GRAFO_PESOS_RIESGO
+
+        origen, ajuste_origen = self.nodo_mas_cercano(origen_lat, origen_lon)
+        destino, ajuste_destino = self.nodo_mas_cercano(destino_lat, destino_lon)
+        if max(ajuste_origen, ajuste_destino) > settings.RUTAS_GRAFO_AJUSTE_MAXIMO_M:
+            return []
+
+        riesgos = self.riesgos()
+        rapido = self.ruta(origen, destino)
+        if rapido is None:
+            return []
+
+        caminos = [(rapido, self.resumen(rapido, riesgos))]
+        tiempo_limite = caminos[0][1][1] * (1 + presupuesto)
+        for peso in pesos:
+            if len(caminos) >= maximo:
+                break
+            camino = self.ruta(origen, destino, peso, riesgos)
+            if camino is None or any(camino == previo for previo, _ in caminos):
+                continue
+            distancia, tiempo, riesgo = self.resumen(camino, riesgos)
+            # Solo rutas más seguras que la última aceptada y dentro del presupuesto de desvío
+            if tiempo <= tiempo_limite and riesgo < caminos[-1][1][2]:
+                caminos.append((camino, (distancia, tiempo, riesgo)))
+
+        lat, lng = self._listas[3], self._listas[4]
+        rutas = []
+        for camino, (distancia, tiempo, riesgo) in caminos:
+            # Unir el punto pedido con el nodo de la red (tramo a pie o a la orilla de la calle)
+            coordenadas = [[float(origen_lat), float(origen_lon)]]
+            coordenadas += [[lat[n], lng[n]] for n in camino]
+            coordenadas.append([float(destino_lat), float(destino_lon)])
+            rutas.append({
+                'coordenadas': coordenadas,
+                'distancia': distancia + ajuste_origen + ajuste_destino,
+                'duracion': tiempo,
+                'riesgo': riesgo,
+            })
+        return rutas
+
+
+def _velocidad(maxspeed, por_defecto):
+    """
+    maxspeed de OpenStreetMap ('50', '30 mph', '50;60') a km/h
+    """
+    if not maxspeed:
+        return por_defecto
+    texto = str(maxspeed).split(';')[0].strip().lower()
+    try:
+        if texto.endswith('mph'):
+            return float(texto[:-3]) * 1.609
+        return float(texto.replace('km/h', '').strip())
+    except ValueError:
+        return por_defecto
+
+
+def cargar_geojson(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        return GrafoVial.desde_geojson(json.load(archivo))
+
+
+_grafo = None
+_cargado = False
+_lock_grafo = threading.Lock()
+
+
+def obtener_grafo():
+    """
+    Grafo vial del proceso (RUTAS_GRAFO_ARCHIVO), o None si no hay uno configurado
+    """
+    global _grafo, _cargado
+    with _lock_grafo:
+        if not _cargado:
+            _cargado = True
+            if settings.RUTAS_GRAFO_ARCHIVO:
+                try:
+                    _grafo = GrafoVial.cargar(settings.RUTAS_GRAFO_ARCHIVO)
+                    logger.info('Grafo vial cargado: %s nodos, %s aristas', _grafo.num_nodos, _grafo.num_aristas)
+                except (OSError, KeyError, ValueError):
+                    logger.exception('No se pudo cargar el grafo vial %s', settings.RUTAS_GRAFO_ARCHIVO)
+        return _grafo
@@ -0,0 +1,410 @@
+"""
+Índice espacial de rejilla sobre los centros de las zonas de riesgo.
+
+calcular_puntuacion_riesgo compara cada punto de la ruta contra las zonas; con
+rutas de miles de puntos el costo era puntos × zonas. El índice agrupa los
+centros de las zonas en celdas de latitud/longitud, así cada punto solo revisa
+las zonas de las celdas que pueden estar dentro del radio que se consulta
+(3 km de influencia o 10 km para la zona más cercana).
+
+La ventana de celdas se calcula con cotas conservadoras de la fórmula de
+Haversine, de modo que nunca se omite una zona dentro del radio: la distancia
+se sigue calculando exactamente igual y las puntuaciones no cambian.
+
+El índice compartido se construye una vez y se reconstruye cuando cambia
+EstadisticaRiesgo (señales en este proceso; huella de la tabla para cambios
+hechos por otros procesos). Las alertas agregadas solo cambian puntuaciones y
+contadores: esos se refrescan en las mismas zonas del índice
+(huella_puntuaciones), sin volver a armar la rejilla ni las ventanas.
+
+Las zonas con polígono (ver poligonos) se registran en todas las celdas que
+toca su caja envolvente, así la misma ventana de celdas encuentra cualquier
+polígono a la distancia consultada; IndiceZonas.distancia mide al polígono en
+lugar de al centro.
+
+zonas_cercanas usa el mismo índice para las k zonas más cercanas a un punto
+(repartidor_home). Memoriza por celda fina de ZONAS_CERCANAS_REJILLA grados
+las zonas que pueden estar entre las k más cercanas de algún punto de la
+celda, y mide y ordena las distancias desde el punto exacto.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .poligonos import poligono_de
+
+RADIO_TIERRA_KM = 6371
+# Margen en grados para errores de redondeo en las cotas de la ventana
+MARGEN_GRADOS = 1e-6
+# Ventanas de celdas memorizadas por índice antes de vaciar la memoria
+MAXIMO_VENTANAS = 50000
+# Campos de EstadisticaRiesgo que cambian con las alertas agregadas
+CAMPOS_PUNTUACION = (
+    'puntuacion_riesgo', 'intensidad_alertas', 'perfil_horario', 'total_alertas', 'alertas_panico', 'alertas_accidente'
+)
+# Datos de `extras` calculados con las puntuaciones
+EXTRAS_PUNTUACION = ('vectorizadas', 'perfiles_horarios')
+
+
+def distancia_haversine(lat1, lon1, lat2, lon2, cos_lat2):
+    """
+    Distancia en km entre un punto (en radianes) y el centro de una zona
+    (en radianes, con su coseno precalculado). Es la misma fórmula que
+    calcular_puntuacion_riesgo usaba por zona.
+    """
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * cos_lat2 * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return RADIO_TIERRA_KM * c
+
+
+class IndiceZonas:
+    """
+    Rejilla de zonas de riesgo por celda de `tamano_celda` grados.
+
+    Cada entrada es (orden, zona, lat_rad, lng_rad, cos_lat) y `orden` es la
+    posición de la zona en el QuerySet original; las candidatas se devuelven
+    en ese orden para que los resultados sean idénticos a recorrer todas.
+    Para los polígonos el centro de la entrada es su centroide y el polígono
+    está en `poligonos[orden]`.
+    """
+
+    def __init__(self, zonas, tamano_celda=0.05):
+        self.tamano_celda = tamano_celda
+        self.columnas = int(math.ceil(360 / tamano_celda))
+        self.celdas = {}
+        self.entradas = []
+        self.total = 0
+        # Datos derivados del índice (arreglos NumPy, ráster) que se descartan con él
+        self.extras = {}
+        self.poligonos = {}
+        self._ventanas = {}
+        self._cercanas = {}
+        self._lock = threading.Lock()
+
+        for orden, zona in enumerate(zonas):
+            self.total += 1
+            poligono = poligono_de(zona.coordenadas_zona)
+            try:
+                if poligono is not None:
+                    lat_zona, lng_zona = poligono.centro_lat, poligono.centro_lng
+                    celdas = self._celdas_caja(poligono)
+                else:
+                    coords_zona = zona.coordenadas_zona
+                    if not (isinstance(coords_zona, dict) and 'center' in coords_zona):
+                        continue
+                    lat_zona = float(coords_zona['center']['lat'])
+                    lng_zona = float(coords_zona['center']['lng'])
+                    celdas = [self._celda(lat_zona, lng_zona)]
+            except (KeyError, ValueError, TypeError, OverflowError):
+                # Zonas con coordenadas inválidas nunca aportaban puntuación
+                continue
+
+            lat_rad = math.radians(lat_zona)
+            entrada = (orden, zona, lat_rad, math.radians(lng_zona), math.cos(lat_rad))
+            for celda in celdas:
+                self.celdas.setdefault(celda, []).append(entrada)
+            self.entradas.append(entrada)
+            if poligono is not None:
+                self.poligonos[orden] = poligono
+
+    def refrescar_puntuaciones(self, filas):
+        """
+        Poner al día las puntuaciones y contadores de las zonas sin tocar la
+        geometría: la rejilla, las ventanas y los radios se conservan
+
+        Args:
+            filas: tuplas (id, *CAMPOS_PUNTUACION)
+        """
+        zonas = {entrada[1].id: entrada[1] for entrada in self.entradas}
+        for zona_id, *valores in filas:
+            zona = zonas.get(zona_id)
+            if zona is not None:
+                for campo, valor in zip(CAMPOS_PUNTUACION, valores):
+                    setattr(zona, campo, valor)
+        for clave in EXTRAS_PUNTUACION:
+            self.extras.pop(clave, None)
+
+    def _celda(self, lat, lng):
+        return (
+            math.floor(lat / self.tamano_celda),
+            math.floor((lng + 180) / self.tamano_celda) % self.columnas
+        )
+
+    def _celdas_caja(self, poligono):
+        """
+        Celdas que toca la caja envolvente del polígono
+        """
+        fila_min, columna_min = self._celda(poligono.lat_min, poligono.lng_min)
+        fila_max, columna_max = self._celda(poligono.lat_max, poligono.lng_max)
+        if columna_max < columna_min:
+            columna_max += self.columnas
+        return [
+            (fila, columna % self.columnas)
+            for fila in range(fila_min, fila_max + 1)
+            for columna in range(columna_min, columna_max + 1)
+        ]
+
+    def distancia(self, entrada, lat_rad, lng_rad, hasta_km=None):
+        """
+        Distancia en km de un punto (en radianes) a la zona de una entrada:
+        al centro de los círculos, al borde de los polígonos (0 dentro).
+        Con `hasta_km`, la de un polígono más lejano puede ser solo una cota inferior.
+        """
+        orden, _, lat_zona, lng_zona, cos_lat_zona = entrada
+        poligono = self.poligonos.get(orden)
+        if poligono is None:
+            return distancia_haversine(lat_rad, lng_rad, lat_zona, lng_zona, cos_lat_zona)
+        return poligono.distancia_km(math.degrees(lat_rad), math.degrees(lng_rad), hasta_km)
+
+    def candidatas(self, lat, lng, radio_km):
+        """
+        Zonas que pueden estar a `radio_km` o menos del punto, en el orden original
+
+        Raises:
+            ValueError, TypeError, OverflowError: si el punto no es numérico
+        """
+        fila, columna = self._celda(float(lat), float(lng))
+        clave = (fila, columna, radio_km)
+
+        ventana = self._ventanas.get(clave)
+        if ventana is None:
+            ventana = self._calcular_ventana(fila, columna, radio_km)
+            with self._lock:
+                if len(self._ventanas) >= MAXIMO_VENTANAS:
+                    self._ventanas.clear()
+                self._ventanas[clave] = ventana
+        return ventana
+
+    def cercanas(self, lat, lng, k=5, radio_km=10, radio_inicial_km=1):
+        """
+        Las k zonas más cercanas al punto a `radio_km` o menos
+
+        El radio de búsqueda se duplica desde `radio_inicial_km`: en cuanto
+        hay k zonas dentro del radio, son las k más cercanas, porque la
+        ventana de celdas incluye todas las zonas a esa distancia.
+
+        Returns:
+            list: tuplas (distancia_km, zona), de la más cercana a la más lejana
+        """
+        lat, lng = float(lat), float(lng)
+        lat_rad, lng_rad = math.radians(lat), math.radians(lng)
+
+        radio = min(radio_inicial_km, radio_km)
+        while True:
+            distancias = []
+            for entrada in self.candidatas(lat, lng, radio):
+                distancia = self.distancia(entrada, lat_rad, lng_rad, radio)
+                if distancia <= radio:
+                    distancias.append((distancia, entrada[0], entrada[1]))
+            if len(distancias) >= k or radio >= radio_km:
+                break
+            radio = min(radio * 2, radio_km)
+
+        distancias.sort(key=lambda item: item[:2])
+        return [(distancia, zona) for distancia, _, zona in distancias[:k]]
+
+    def cercanas_memorizadas(self, lat, lng, k=5, radio_km=10, rejilla=0.001):
+        """
+        El mismo resultado que cercanas(), con las zonas candidatas
+        memorizadas por celda de `rejilla` grados del punto
+
+        Para cualquier punto de la celda la distancia a una zona difiere a lo
+        más en media diagonal (h) de la medida desde el centro. Si d_k es la
+        distancia del centro a su k-ésima zona más cercana, ninguna zona a más
+        de d_k + 2h del centro puede estar entre las k más cercanas de un
+        punto de la celda, ni ninguna a más de radio_km + h dentro del radio.
+        Solo se memorizan esas candidatas; las distancias se miden desde el punto.
+        """
+        lat, lng = float(lat), float(lng)
+        fila = math.floor(lat / rejilla)
+        columna = math.floor(lng / rejilla)
+        clave = (fila, columna, k, radio_km)
+
+        candidatas = self._cercanas.get(clave)
+        if candidatas is None:
+            candidatas = self._candidatas_celda(fila, columna, k, radio_km, rejilla)
+            with self._lock:
+                if len(self._cercanas) >= MAXIMO_VENTANAS:
+                    self._cercanas.clear()
+                self._cercanas[clave] = candidatas
+
+        lat_rad, lng_rad = math.radians(lat), math.radians(lng)
+        distancias = []
+        for entrada in candidatas:
+            distancia = self.distancia(entrada, lat_rad, lng_rad, radio_km)
+            if distancia <= radio_km:
+                distancias.append((distancia, entrada[0], entrada[1]))
+        distancias.sort(key=lambda item: item[:2])
+        return [(distancia, zona) for distancia, _, zona in distancias[:k]]
+
+    def _candidatas_celda(self, fila, columna, k, radio_km, rejilla):
+        """
+        Entradas que pueden estar entre las k más cercanas de algún punto de la celda
+        """
+        lat_centro, lng_centro = (fila + 0.5) * rejilla, (columna + 0.5) * rejilla
+        # La celda mide `rejilla` grados de latitud y a lo más lo mismo en longitud
+        media_diagonal = RADIO_TIERRA_KM * math.radians(rejilla) * math.sqrt(2) / 2
+        alcance = radio_km + media_diagonal
+
+        lat_rad, lng_rad = math.radians(lat_centro), math.radians(lng_centro)
+        distancias = []
+        for entrada in self.candidatas(lat_centro, lng_centro, alcance):
+            distancia = self.distancia(entrada, lat_rad, lng_rad, alcance)
+            if distancia <= alcance:
+                distancias.append((distancia, entrada))
+        if len(distancias) >= k:
+            k_esima = sorted(distancia for distancia, _ in distancias)[k - 1]
+            alcance = min(alcance, k_esima + 2 * media_diagonal)
+        return [entrada for distancia, entrada in distancias if distancia <= alcance]
+
+    def _calcular_ventana(self, fila, columna, radio_km):
+        """
+        Todas las zonas de las celdas que algún punto de la celda (fila, columna)
+        podría tener a `radio_km` o menos.
+
+        - Latitud: la distancia nunca es menor que R·|Δlat|.
+        - Longitud: sin²(d/2) ≥ cos(lat1)·cos(lat2)·sin²(Δlng/2), acotando los
+          cosenos con la latitud más alejada del ecuador dentro de la ventana.
+        """
+        t = self.tamano_celda
+        angulo = radio_km / RADIO_TIERRA_KM
+        delta_lat = math.degrees(angulo) + MARGEN_GRADOS
+
+        lat_min = fila * t
+        lat_max = (fila + 1) * t
+        filas = range(math.floor((lat_min - delta_lat) / t), math.floor((lat_max + delta_lat) / t) + 1)
+
+        lat_punto = max(abs(lat_min), abs(lat_max))
+        lat_zona = lat_punto + delta_lat
+        columnas = None
+        if lat_zona < 90:
+            cotas = math.cos(math.radians(lat_punto)) * math.cos(math.radians(lat_zona))
+            seno = math.sin(angulo / 2) / math.sqrt(cotas)
+            if seno < 1:
+                delta_lng = math.degrees(2 * math.asin(seno)) + MARGEN_GRADOS
+                lng_min = columna * t - 180
+                lng_max = (columna + 1) * t - 180
+                inicio = math.floor((lng_min - delta_lng + 180) / t)
+                fin = math.floor((lng_max + delta_lng + 180) / t)
+                if fin - inicio + 1 < self.columnas:
+                    columnas = {c % self.columnas for c in range(inicio, fin + 1)}
+
+        if columnas is None:
+            columnas = range(self.columnas)
+        if len(filas) * len(columnas) <= len(self.celdas):
+            entradas = [
+                entrada
+                for fila_ventana in filas
+                for columna_ventana in columnas
+                for entrada in self.celdas.get((fila_ventana, columna_ventana), ())
+            ]
+        else:
+            # Ventana con más celdas que las ocupadas (radios enormes o cerca de los polos)
+            entradas = []
+            for celda, zonas in self.celdas.items():
+                if celda[0] in filas and celda[1] in columnas:
+                    entradas.extend(zonas)
+        if self.poligonos:
+            # Un polígono puede estar en varias celdas de la ventana
+            entradas = list({entrada[0]: entrada for entrada in entradas}.values())
+        entradas.sort(key=lambda entrada: entrada[0])
+        return entradas
+
+
+_indice = None
+_huella = None
+_huella_puntuaciones = None
+_revisado_en = None
+_lock_indice = threading.Lock()
+
+
+def huella_zonas():
+    """
+    (total, última actualización, id mayor) de EstadisticaRiesgo; cambia con
+    cualquier alta, baja o modificación de zonas, pero no con las alertas
+    agregadas (no tocan ultima_actualizacion)
+    """
+    from django.db.models import Count, Max
+    from .models import EstadisticaRiesgo
+
+    datos = EstadisticaRiesgo.objects.aggregate(total=Count('id'), ultima=Max('ultima_actualizacion'), mayor=Max('id'))
+    return (datos['total'], datos['ultima'], datos['mayor'])
+
+
+def huella_puntuaciones():
+    """
+    (alertas, intensidad, puntuación) sumadas sobre EstadisticaRiesgo; cambia
+    con las alertas agregadas y con actualizar_puntuaciones
+    """
+    from django.db.models import Sum
+    from .models import EstadisticaRiesgo
+
+    datos = EstadisticaRiesgo.objects.aggregate(
+        alertas=Sum('total_alertas'), intensidad=Sum('intensidad_alertas'), puntuacion=Sum('puntuacion_riesgo')
+    )
+    return (datos['alertas'], datos['intensidad'], datos['puntuacion'])
+
+
+def obtener_indice_zonas():
+    """
+    Índice compartido de todas las zonas de riesgo.
+
+    Se reconstruye si una señal lo invalidó o si la huella de la tabla (total,
+    última actualización) cambió desde la última revisión. Si solo cambiaron
+    las puntuaciones, se refrescan en el mismo índice. Las dos huellas se
+    revisan cada ZONAS_INDICE_TTL segundos.
+    """
+    global _indice, _huella, _huella_puntuaciones, _revisado_en
+    from .models import EstadisticaRiesgo
+
+    with _lock_indice:
+        ahora = time.monotonic()
+        if _indice is not None and _revisado_en is not None and ahora - _revisado_en < settings.ZONAS_INDICE_TTL:
+            return _indice
+
+        # Las huellas se toman antes de leer las zonas: un cambio a la mitad se ve en la siguiente revisión
+        huella, puntuaciones = huella_zonas(), huella_puntuaciones()
+        if _indice is None or huella != _huella:
+            _indice = IndiceZonas(EstadisticaRiesgo.objects.all())
+            _huella = huella
+        elif puntuaciones != _huella_puntuaciones:
+            _indice.refrescar_puntuaciones(EstadisticaRiesgo.objects.values_list('id', *CAMPOS_PUNTUACION))
+        _huella_puntuaciones = puntuaciones
+        _revisado_en = ahora
+        return _indice
+
+
+def zonas_cercanas(lat, lng, k=5, radio_km=10):
+    """
+    Las k zonas de riesgo más cercanas a `radio_km` o menos, con el índice compartido
+
+    Returns:
+        list: tuplas (distancia_km, zona), de la más cercana a la más lejana
+
+    Raises:
+        ValueError, TypeError, OverflowError: si el punto no es numérico
+    """
+    return obtener_indice_zonas().cercanas_memorizadas(lat, lng, k, radio_km, settings.ZONAS_CERCANAS_REJILLA)
+
+
+def indice_para(zonas_riesgo=None):
+    """
+    Índice para puntuar rutas: el compartido si no se indican zonas, el mismo
+    objeto si ya es un IndiceZonas, o uno nuevo sobre las zonas indicadas
+    """
+    if isinstance(zonas_riesgo, IndiceZonas):
+        return zonas_riesgo
+    if not zonas_riesgo:
+        return obtener_indice_zonas()
+    return IndiceZonas(zonas_riesgo)
+
+
+def invalidar_indice_zonas():
+    global _indice
+    with _lock_indice:
+        _indice = None
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from rappiSafe.agregacion_riesgo import actualizar_puntuaciones, recalcular_zonas
+
+
+class Command(BaseCommand):
+    help = ('Calcula los contadores y la puntuación de riesgo de las zonas desde el histórico de '
+            'alertas; las alertas nuevas se agregan solas al crearse')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Poner en cero las zonas sin alertas en el histórico (por defecto conservan sus datos)')
+        parser.add_argument('--solo-puntuacion', action='store_true',
+                            help='Solo aplicar el decaimiento a la fecha a las puntuaciones, sin leer las alertas')
+        parser.add_argument('--lote', type=int, default=5000,
+                            help='Alertas leídas por consulta')
+
+    def handle(self, *args, **options):
+        if options['solo_puntuacion']:
+            zonas = actualizar_puntuaciones()
+            self.stdout.write(self.style.SUCCESS(f'[OK] Puntuación actualizada en {zonas} zonas'))
+            return
+
+        resultado = recalcular_zonas(reiniciar=options['reiniciar'], lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f"[OK] {resultado['alertas']} alertas leídas, {resultado['asignadas']} dentro de alguna zona; "
+            f"{resultado['zonas']} zonas actualizadas"
+        ))
@@ -0,0 +1,174 @@
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[indice]
+
+
+def _trabajador(backend, config, grupo, conexiones, mensajes, timeout, listos, resultados):
+    """
+    Proceso que simula un worker de Daphne con `conexiones` operadores
+    suscritos al grupo; devuelve la latencia de cada mensaje recibido.
+    """
+
+    async def principal():
+        capa = import_string(backend)(**config)
+        canales = [await capa.new_channel() for _ in range(conexiones)]
+        for canal in canales:
+            await capa.group_add(grupo, canal)
+        listos.put(True)
+
+        latencias = []
+
+        async def escuchar(canal):
+            for _ in range(mensajes):
+                mensaje = await capa.receive(canal)
+                latencias.append(time.time() - mensaje['enviado'])
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(escuchar(canal) for canal in canales)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for canal in canales:
+                await capa.group_discard(grupo, canal)
+        return latencias
+
+    resultados.put(asyncio.run(principal()))
+
+
+class Command(BaseCommand):
+    help = ('Mide la latencia de difusión de la capa de canales (group_send a un grupo '
+            'con operadores repartidos en varios procesos) según el número de workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trabajadores', default='1,2,4,8',
+                            help='Números de procesos a probar, separados por coma')
+        parser.add_argument('--conexiones', type=int, default=25,
+                            help='Conexiones WebSocket simuladas por proceso')
+        parser.add_argument('--mensajes', type=int, default=50,
+                            help='Mensajes enviados al grupo en cada ronda')
+        parser.add_argument('--intervalo', type=float, default=10,
+                            help='Milisegundos entre mensajes')
+        parser.add_argument('--servidor-local', action='store_true',
+                            help='Levantar un Redis local de prueba (fakeredis) en lugar de usar CHANNEL_REDIS_HOSTS')
+        parser.add_argument('--shards', type=int, default=1,
+                            help='Con --servidor-local, número de servidores entre los que se reparten los grupos')
+
+    def handle(self, *args, **options):
+        backend, config = self._configuracion_capa(options)
+
+        try:
+            conteos = [int(n) for n in options['trabajadores'].split(',') if n.strip()]
+        except ValueError:
+            raise CommandError('--trabajadores debe ser una lista de enteros, por ejemplo 1,2,4,8')
+
+        self.stdout.write(f"Capa: {backend} ({len(config.get('hosts', []))} shard(s))")
+        self.stdout.write(f"{'workers':>8} {'receptores':>11} {'entregados':>11} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8}")
+
+        for trabajadores in conteos:
+            fila = self._ronda(backend, config, trabajadores, options)
+            self.stdout.write(
+                f"{trabajadores:>8} {fila['receptores']:>11} {fila['entregados']:>11} "
+                f"{fila['p50']:>8.2f} {fila['p95']:>8.2f} {fila['p99']:>8.2f} {fila['max']:>8.2f}"
+            )
+            if fila['entregados'] < fila['esperados']:
+                self.stdout.write(self.style.WARNING(
+                    f"[!] Se perdieron {fila['esperados'] - fila['entregados']} mensaje(s) con {trabajadores} worker(s)"
+                ))
+
+        self.stdout.write(self.style.SUCCESS('[OK] Benchmark terminado'))
+
+    def _configuracion_capa(self, options):
+        if options['servidor_local']:
+            try:
+                from fakeredis import TcpFakeServer
+            except ImportError:
+                raise CommandError('--servidor-local requiere fakeredis y lupa. Ejecuta: pip install fakeredis lupa')
+
+            hosts = []
+            for _ in range(max(1, options['shards'])):
+                servidor = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+                threading.Thread(target=servidor.serve_forever, daemon=True).start()
+                host, puerto = servidor.server_address
+                hosts.append(f'redis://{host}:{puerto}/0')
+
+            return 'channels_redis.core.RedisChannelLayer', {
+                'hosts': hosts,
+                'prefix': 'benchmark',
+                'capacity': 10000,
+            }
+
+        capa = settings.CHANNEL_LAYERS['default']
+        if capa['BACKEND'] == 'channels.layers.InMemoryChannelLayer':
+            raise CommandError(
+                'La capa en memoria no cruza procesos. Configura CHANNEL_LAYER_BACKEND=redis '
+                'o usa --servidor-local'
+            )
+        return capa['BACKEND'], dict(capa.get('CONFIG', {}))
+
+    def _ronda(self, backend, config, trabajadores, options):
+        contexto = multiprocessing.get_context('spawn')
+        listos = contexto.Queue()
+        resultados = contexto.Queue()
+        grupo = f'benchmark_{uuid.uuid4().hex[:12]}'
+        mensajes = options['mensajes']
+        timeout = 30 + mensajes * options['intervalo'] / 1000
+
+        procesos = [
+            contexto.Process(
+                target=_trabajador,
+                args=(backend, config, grupo, options['conexiones'], mensajes, timeout, listos, resultados),
+                daemon=True
+            )
+            for _ in range(trabajadores)
+        ]
+        for proceso in procesos:
+            proceso.start()
+
+        try:
+            for _ in procesos:
+                listos.get(timeout=60)
+        except queue.Empty:
+            for proceso in procesos:
+                proceso.terminate()
+            raise CommandError('Los procesos de prueba no se suscribieron al grupo a tiempo')
+
+        async def publicar():
+            capa = import_string(backend)(**config)
+            for numero in range(mensajes):
+                await capa.group_send(grupo, {'type': 'nueva_alerta', 'numero': numero, 'enviado': time.time()})
+                await asyncio.sleep(options['intervalo'] / 1000)
+
+        asyncio.run(publicar())
+
+        latencias = []
+        for _ in procesos:
+            latencias.extend(resultados.get(timeout=timeout + 30))
+        for proceso in procesos:
+            proceso.join(timeout=5)
+
+        latencias.sort()
+        milisegundos = [latencia * 1000 for latencia in latencias]
+        return {
+            'receptores': trabajadores * options['conexiones'],
+            'esperados': trabajadores * options['conexiones'] * mensajes,
+            'entregados': len(latencias),
+            'p50': _percentil(milisegundos, 50),
+            'p95': _percentil(milisegundos, 95),
+            'p99': _percentil(milisegundos, 99),
+            'max': milisegundos[-1] if milisegundos else 0.0,
+        }
@@ -0,0 +1,147 @@
+import math
+import random
+import tempfile
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rappiSafe.indice_espacial import IndiceZonas
+from rappiSafe.models import EstadisticaRiesgo
+from rappiSafe.raster_riesgo import RasterRiesgo, construir_raster, guardar_raster
+from rappiSafe.riesgo_horario import franja_actual
+from rappiSafe.riesgo_vectorizado import calcular_puntuacion_riesgo_vectorizada
+from rappiSafe.utils import calcular_puntuacion_riesgo
+
+# Centro de la Ciudad de México, como en los datos de demostración
+CENTRO = (19.4326, -99.1332)
+
+
+def _lista_enteros(valor, opcion):
+    try:
+        return [int(n) for n in valor.split(',') if n.strip()]
+    except ValueError:
+        raise CommandError(f'{opcion} debe ser una lista de enteros separados por coma')
+
+
+def _zonas_sinteticas(cantidad, radio_km, aleatorio):
+    """
+    Zonas de riesgo en memoria (sin guardar) repartidas en un círculo de `radio_km`
+    """
+    zonas = []
+    for i in range(cantidad):
+        distancia = radio_km * math.sqrt(aleatorio.random())
+        angulo = aleatorio.uniform(0, 2 * math.pi)
+        lat = CENTRO[0] + (distancia / 111.0) * math.cos(angulo)
+        lng = CENTRO[1] + (distancia / (111.0 * math.cos(math.radians(CENTRO[0])))) * math.sin(angulo)
+        zonas.append(EstadisticaRiesgo(
+            nombre_zona=f'Zona sintética {i + 1}',
+            coordenadas_zona={'center': {'lat': lat, 'lng': lng}, 'radius': 500},
+            puntuacion_riesgo=round(aleatorio.uniform(1.0, 10.0), 1),
+            periodo_inicio=date.today(),
+            periodo_fin=date.today()
+        ))
+    return zonas
+
+
+def _ruta_sintetica(puntos, radio_km, aleatorio):
+    """
+    Ruta que cruza la ciudad de lado a lado con un pequeño zigzag
+    """
+    grados = radio_km / 111.0
+    origen = (CENTRO[0] - grados * 0.7, CENTRO[1] - grados * 0.7)
+    destino = (CENTRO[0] + grados * 0.7, CENTRO[1] + grados * 0.7)
+    ruta = []
+    for i in range(puntos):
+        t = i / max(1, puntos - 1)
+        ruta.append([
+            origen[0] + (destino[0] - origen[0]) * t + aleatorio.uniform(-0.0005, 0.0005),
+            origen[1] + (destino[1] - origen[1]) * t + aleatorio.uniform(-0.0005, 0.0005)
+        ])
+    return ruta
+
+
+def _medir(funcion, repeticiones):
+    mejor = math.inf
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return resultado, mejor * 1000
+
+
+class Command(BaseCommand):
+    help = ('Compara la puntuación de riesgo de rutas escalar (utils.calcular_puntuacion_riesgo) '
+            'contra la vectorizada con NumPy para distintos tamaños de ruta y de zonas')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puntos', default='1000,10000,50000',
+                            help='Puntos por ruta a probar, separados por coma')
+        parser.add_argument('--zonas', default='10,100,1000,10000',
+                            help='Números de zonas de riesgo a probar, separados por coma')
+        parser.add_argument('--radio', type=float, default=25,
+                            help='Radio en km del área donde se reparten zonas y rutas')
+        parser.add_argument('--repeticiones', type=int, default=1,
+                            help='Repeticiones por caso (se reporta el mejor tiempo)')
+        parser.add_argument('--sin-escalar', action='store_true',
+                            help='Medir solo la versión vectorizada (útil para los casos más grandes)')
+        parser.add_argument('--raster', action='store_true',
+                            help='Medir también la consulta al ráster precalculado (mapeado en memoria)')
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        puntos = _lista_enteros(options['puntos'], '--puntos')
+        zonas = _lista_enteros(options['zonas'], '--zonas')
+        repeticiones = max(1, options['repeticiones'])
+        aleatorio = random.Random(options['semilla'])
+
+        self.stdout.write(f"{'puntos':>8} {'zonas':>7} {'escalar ms':>11} {'numpy ms':>9} "
+                          f"{'aceleración':>12} {'diferencia':>11} {'ráster ms':>10} {'dif. ráster':>12}")
+
+        diferencias = []
+        with tempfile.TemporaryDirectory() as directorio:
+            for num_zonas in zonas:
+                # El índice se construye una vez por tamaño, como el índice compartido en producción
+                indice = IndiceZonas(_zonas_sinteticas(num_zonas, options['radio'], aleatorio))
+                # Calentar los arreglos de zonas para no medir su construcción
+                calcular_puntuacion_riesgo_vectorizada([list(CENTRO)], indice)
+
+                raster = None
+                if options['raster']:
+                    inicio = time.perf_counter()
+                    datos, cercania, meta = construir_raster(indice, franja=franja_actual())
+                    guardar_raster(datos, cercania, meta, f'benchmark{num_zonas}', directorio)
+                    raster = RasterRiesgo.abrir(directorio)
+                    self.stdout.write(f"    ráster de {num_zonas} zonas: {raster.filas}×{raster.columnas} "
+                                      f"celdas en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+                for num_puntos in puntos:
+                    ruta = _ruta_sintetica(num_puntos, options['radio'], aleatorio)
+                    vectorizada, ms_numpy = _medir(
+                        lambda: calcular_puntuacion_riesgo_vectorizada(ruta, indice), repeticiones
+                    )
+                    columnas = [f"{num_puntos:>8}", f"{num_zonas:>7}"]
+
+                    if options['sin_escalar']:
+                        columnas += [f"{'-':>11}", f"{ms_numpy:>9.1f}", f"{'-':>12}", f"{'-':>11}"]
+                    else:
+                        escalar, ms_escalar = _medir(lambda: calcular_puntuacion_riesgo(ruta, indice), repeticiones)
+                        diferencia = abs(escalar - vectorizada)
+                        diferencias.append(diferencia)
+                        columnas += [f"{ms_escalar:>11.1f}", f"{ms_numpy:>9.1f}",
+                                     f"{ms_escalar / max(ms_numpy, 1e-9):>11.1f}x", f"{diferencia:>11.1f}"]
+
+                    if raster is not None:
+                        # El ráster aproxima con el centro de la celda; se compara contra el cálculo exacto
+                        puntuacion_raster, ms_raster = _medir(lambda: raster.puntuar(ruta), repeticiones)
+                        columnas += [f"{ms_raster:>10.1f}", f"{abs(puntuacion_raster - vectorizada):>12.1f}"]
+                    else:
+                        columnas += [f"{'-':>10}", f"{'-':>12}"]
+                    self.stdout.write(' '.join(columnas))
+
+        if any(diferencia > 0.1 for diferencia in diferencias):
+            self.stdout.write(self.style.WARNING(
+                '[!] Hay casos donde las puntuaciones difieren más de 0.1'
+            ))
+        self.stdout.write(self.style.SUCCESS('[OK] Benchmark terminado'))
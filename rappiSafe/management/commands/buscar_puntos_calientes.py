@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from rappiSafe.puntos_calientes import actualizar_puntos_calientes
+
+
+class Command(BaseCommand):
+    help = ('Agrupa las ubicaciones de las alertas por densidad y crea o refresca zonas de riesgo '
+            'con los puntos calientes; solo lee las alertas nuevas desde la ejecución anterior')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true',
+                            help='Volver a leer todas las alertas en lugar de solo las nuevas')
+        parser.add_argument('--simular', action='store_true',
+                            help='Mostrar los puntos calientes sin guardar zonas')
+        parser.add_argument('--eps', type=float, default=None,
+                            help='Distancia en metros entre alertas vecinas (por defecto PUNTOS_CALIENTES_EPS_M)')
+        parser.add_argument('--minimo', type=int, default=None,
+                            help='Alertas mínimas para un núcleo (por defecto PUNTOS_CALIENTES_MINIMO_ALERTAS)')
+        parser.add_argument('--directorio', default=None,
+                            help='Directorio del resumen de celdas (por defecto PUNTOS_CALIENTES_DIR)')
+
+    def handle(self, *args, **options):
+        resultado = actualizar_puntos_calientes(
+            directorio=options['directorio'],
+            completo=options['completo'],
+            simular=options['simular'],
+            eps_m=options['eps'],
+            minimo_alertas=options['minimo'],
+        )
+
+        for accion, grupo in resultado['zonas']:
+            self.stdout.write(
+                f"  {accion:<12} ({grupo['lat']:.5f}, {grupo['lng']:.5f}) radio {grupo['radio_km']:.2f} km, "
+                f"{grupo['total_alertas']} alertas"
+            )
+
+        lectura = 'todas las alertas' if resultado['completo'] else 'alertas nuevas'
+        prefijo = '[SIMULACIÓN]' if options['simular'] else '[OK]'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefijo} {resultado['alertas']} {lectura} en {resultado['celdas']} celdas; "
+            f"{resultado['grupos']} puntos calientes: {resultado['creadas']} zonas creadas, "
+            f"{resultado['actualizadas']} actualizadas, {resultado['cubiertas']} dentro de zonas existentes"
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rappiSafe.raster_riesgo import RasterRiesgo, reconstruir_raster
+
+
+class Command(BaseCommand):
+    help = ('Construye el ráster de riesgo compartido por los workers a partir de las zonas '
+            'de EstadisticaRiesgo; con --vigilar lo reconstruye cada vez que las zonas cambian')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vigilar', action='store_true',
+                            help='Seguir corriendo y reconstruir cuando cambie la tabla de zonas')
+        parser.add_argument('--intervalo', type=float, default=30.0,
+                            help='Con --vigilar, segundos entre revisiones de la tabla de zonas')
+        parser.add_argument('--forzar', action='store_true',
+                            help='Reconstruir aunque la versión actual esté al día')
+        parser.add_argument('--directorio', default=None,
+                            help='Directorio de salida (por defecto RASTER_RIESGO_DIR)')
+
+    def handle(self, *args, **options):
+        forzar = options['forzar']
+        try:
+            while True:
+                version = reconstruir_raster(options['directorio'], forzar=forzar)
+                forzar = False
+                if version:
+                    raster = RasterRiesgo.abrir(options['directorio'])
+                    self.stdout.write(self.style.SUCCESS(
+                        f"[OK] Ráster {version}: {raster.filas}×{raster.columnas} celdas de "
+                        f"{raster.meta['celda_m']:.0f} m, {raster.meta['zonas']} zona(s)"
+                    ))
+                elif not options['vigilar']:
+                    self.stdout.write('[OK] El ráster ya estaba al día')
+
+                if not options['vigilar']:
+                    break
+                close_old_connections()
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Deteniendo...')
@@ -0,0 +1,43 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rappiSafe.grafo_vial import GrafoVial, cargar_geojson
+
+
+class Command(BaseCommand):
+    help = ('Convierte un extracto de la red vial (GeoJSON de calles de OpenStreetMap) al grafo '
+            'compacto que usa el cálculo de rutas seguras (RUTAS_GRAFO_ARCHIVO)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('geojson', nargs='?',
+                            help='FeatureCollection de LineString con las propiedades highway/oneway/maxspeed')
+        parser.add_argument('--salida', required=True,
+                            help='Archivo .npz de salida')
+        parser.add_argument('--cuadricula', default=None,
+                            help='En lugar de un GeoJSON, generar una cuadrícula de prueba: '
+                                 'lat,lng,filas,columnas[,separación en m]')
+
+    def handle(self, *args, **options):
+        if options['cuadricula']:
+            try:
+                valores = [float(valor) for valor in options['cuadricula'].split(',')]
+                lat, lng, filas, columnas = valores[:4]
+                separacion = valores[4] if len(valores) > 4 else 150
+            except ValueError:
+                raise CommandError('--cuadricula debe ser lat,lng,filas,columnas[,separación]')
+            grafo = GrafoVial.cuadricula(lat, lng, int(filas), int(columnas), separacion)
+        elif options['geojson']:
+            try:
+                grafo = cargar_geojson(options['geojson'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f'No se pudo leer {options["geojson"]}: {e}')
+        else:
+            raise CommandError('Indica un archivo GeoJSON o --cuadricula')
+
+        grafo.guardar(options['salida'])
+        tamano = os.path.getsize(options['salida'])
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] Grafo vial: {grafo.num_nodos} nodos, {grafo.num_aristas} aristas '
+            f'({tamano / 1024 / 1024:.1f} MB) en {options["salida"]}'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rappiSafe.models import NotificacionContacto
+from rappiSafe.notificaciones import (
+    DespachadorNotificaciones, liberar_reclamos_vencidos, reprogramar_fallidas
+)
+
+
+class Command(BaseCommand):
+    help = 'Drena la bandeja de salida de notificaciones a contactos de emergencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trabajadores', type=int, default=None,
+                            help='Número de hilos de envío (por defecto NOTIFICACIONES_WORKERS)')
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help='Segundos entre revisiones de la bandeja de salida')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar lo pendiente y terminar')
+
+    def handle(self, *args, **options):
+        despachador = DespachadorNotificaciones(max_trabajadores=options['trabajadores'])
+        self.stdout.write('Procesando bandeja de salida de notificaciones...')
+
+        try:
+            while True:
+                liberadas = liberar_reclamos_vencidos()
+                if liberadas:
+                    self.stdout.write(f'[!] {liberadas} notificación(es) abandonada(s) devuelta(s) a pendiente')
+
+                reprogramadas = reprogramar_fallidas()
+                if reprogramadas:
+                    self.stdout.write(f'[!] {reprogramadas} notificación(es) fallida(s) reprogramada(s)')
+
+                despachador.despertar()
+
+                if options['una_vez']:
+                    while despachador.pendientes_en_curso():
+                        time.sleep(0.1)
+                    # Los reintentos programados para más tarde no se esperan
+                    if not NotificacionContacto.objects.filter(estado='pendiente').exists():
+                        break
+                    continue
+
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Deteniendo trabajadores...')
+        finally:
+            despachador.detener()
+
+        self.stdout.write(self.style.SUCCESS('[OK] Bandeja de salida procesada'))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0007_remove_contactoconfianza_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacioncontacto',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True, verbose_name='Última actualización'),
+        ),
+        migrations.AddField(
+            model_name='notificacioncontacto',
+            name='intentos',
+            field=models.PositiveIntegerField(default=0, verbose_name='Intentos de envío'),
+        ),
+        migrations.AlterField(
+            model_name='notificacioncontacto',
+            name='estado',
+            field=models.CharField(choices=[('enviado', 'Enviado'), ('entregado', 'Entregado'), ('fallido', 'Fallido'), ('pendiente', 'Pendiente'), ('enviando', 'Enviando')], default='pendiente', max_length=20, verbose_name='Estado'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacioncontacto',
+            index=models.Index(fields=['estado', 'enviado_en'], name='notif_estado_enviado_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0008_notificacioncontacto_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacioncontacto',
+            name='historial_intentos',
+            field=models.JSONField(blank=True, default=list, verbose_name='Historial de intentos'),
+        ),
+        migrations.AddField(
+            model_name='notificacioncontacto',
+            name='siguiente_intento',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Siguiente reintento'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacioncontacto',
+            index=models.Index(fields=['estado', 'siguiente_intento'], name='notif_estado_reintento_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+def eliminar_duplicados(apps, schema_editor):
+    """
+    Conservar una sola notificación por (alerta, contacto, método) antes de
+    crear la restricción única: la enviada más reciente si existe, si no la
+    más reciente de todas.
+    """
+    NotificacionContacto = apps.get_model('rappiSafe', 'NotificacionContacto')
+
+    conservadas = {}
+    duplicadas = []
+    for notificacion in NotificacionContacto.objects.order_by('enviado_en', 'id').iterator():
+        clave = (notificacion.alerta_id, notificacion.contacto_id, notificacion.metodo)
+        actual = conservadas.get(clave)
+        if actual is None:
+            conservadas[clave] = notificacion
+            continue
+
+        actual_enviada = actual.estado in ('enviado', 'entregado')
+        nueva_enviada = notificacion.estado in ('enviado', 'entregado')
+        if nueva_enviada or not actual_enviada:
+            duplicadas.append(actual.id)
+            conservadas[clave] = notificacion
+        else:
+            duplicadas.append(notificacion.id)
+
+    NotificacionContacto.objects.filter(id__in=duplicadas).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0009_notificacioncontacto_reintentos'),
+    ]
+
+    operations = [
+        migrations.RunPython(eliminar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notificacioncontacto',
+            constraint=models.UniqueConstraint(fields=('alerta', 'contacto', 'metodo'), name='notif_unica_alerta_contacto_metodo'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0010_notificacioncontacto_unica'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alerta',
+            index=models.Index(condition=models.Q(('estado__in', ['pendiente', 'en_atencion'])), fields=['repartidor', '-creado_en'], name='alerta_activa_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0011_alerta_activa_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trayectoria',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Fecha y hora'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:40
+
+from django.db import migrations
+
+LOTE = 500
+# Copia congelada de rappiSafe.polilineas (algoritmo de Google, 5 decimales):
+# la migración no debe cambiar si el módulo cambia. Las coordenadas guardadas
+# con más decimales quedan redondeadas a ~1 m y la reversa no los recupera.
+PRECISION = 5
+
+
+def _codificar(coordenadas):
+    caracteres = []
+    anterior_lat = anterior_lng = 0
+    for coordenada in coordenadas:
+        lat = int(round(float(coordenada[0]) * 10 ** PRECISION))
+        lng = int(round(float(coordenada[1]) * 10 ** PRECISION))
+        for delta in (lat - anterior_lat, lng - anterior_lng):
+            valor = ~(delta << 1) if delta < 0 else delta << 1
+            while valor >= 0x20:
+                caracteres.append(chr((0x20 | (valor & 0x1f)) + 63))
+                valor >>= 5
+            caracteres.append(chr(valor + 63))
+        anterior_lat, anterior_lng = lat, lng
+    return ''.join(caracteres)
+
+
+def _decodificar(polilinea):
+    valores = []
+    valor = desplazamiento = 0
+    for caracter in polilinea:
+        bloque = ord(caracter) - 63
+        valor |= (bloque & 0x1f) << desplazamiento
+        desplazamiento += 5
+        if bloque < 0x20:
+            valores.append(~(valor >> 1) if valor & 1 else valor >> 1)
+            valor = desplazamiento = 0
+
+    factor = 10 ** PRECISION
+    coordenadas = []
+    lat = lng = 0
+    for i in range(0, len(valores) - 1, 2):
+        lat += valores[i]
+        lng += valores[i + 1]
+        coordenadas.append([lat / factor, lng / factor])
+    return coordenadas
+
+
+def codificar_ruta(ruta):
+    codificada = {clave: valor for clave, valor in ruta.items() if clave != 'coordenadas'}
+    if 'polilinea' not in codificada:
+        codificada['polilinea'] = _codificar(ruta.get('coordenadas') or [])
+    return codificada
+
+
+def coordenadas_de(ruta):
+    if 'polilinea' in ruta:
+        return _decodificar(ruta['polilinea'])
+    return ruta.get('coordenadas') or []
+
+
+def _convertir(apps, convertir_ruta):
+    RutaSegura = apps.get_model('rappiSafe', 'RutaSegura')
+
+    lote = []
+    for ruta in RutaSegura.objects.only('id', 'ruta_rapida', 'ruta_segura').iterator(chunk_size=LOTE):
+        ruta.ruta_rapida = convertir_ruta(ruta.ruta_rapida)
+        ruta.ruta_segura = {
+            **ruta.ruta_segura,
+            'rutas': [convertir_ruta(segura) for segura in ruta.ruta_segura.get('rutas', [])]
+        }
+        lote.append(ruta)
+        if len(lote) >= LOTE:
+            RutaSegura.objects.bulk_update(lote, ['ruta_rapida', 'ruta_segura'])
+            lote = []
+    if lote:
+        RutaSegura.objects.bulk_update(lote, ['ruta_rapida', 'ruta_segura'])
+
+
+def codificar_rutas(apps, schema_editor):
+    """
+    Pasar las geometrías guardadas de arreglos de coordenadas a polilíneas codificadas
+    """
+    _convertir(apps, codificar_ruta)
+
+
+def decodificar_rutas(apps, schema_editor):
+    def decodificar_ruta(ruta):
+        decodificada = {clave: valor for clave, valor in ruta.items() if clave != 'polilinea'}
+        decodificada['coordenadas'] = coordenadas_de(ruta)
+        return decodificada
+
+    _convertir(apps, decodificar_ruta)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0012_trayectoria_timestamp'),
+    ]
+
+    operations = [
+        migrations.RunPython(codificar_rutas, decodificar_rutas),
+    ]
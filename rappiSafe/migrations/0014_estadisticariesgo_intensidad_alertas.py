@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:05
+
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+# Copia congelada de la curva de rappiSafe.agregacion_riesgo con los valores
+# por omisión de esta versión (RIESGO_ESCALA_ALERTAS=10, RIESGO_VIDA_MEDIA_DIAS=30).
+# Con otros valores, 'agregar_riesgo_alertas' recalcula las zonas.
+EPOCA = datetime(2025, 1, 1, tzinfo=timezone.utc)
+PUNTUACION_MINIMA = 1.0
+PUNTUACION_MAXIMA = 10.0
+ESCALA_ALERTAS = 10.0
+VIDA_MEDIA_DIAS = 30.0
+
+
+def intensidad_para_puntuacion(puntuacion, ahora):
+    """
+    Intensidad normalizada a EPOCA que en `ahora` da `puntuacion`
+    """
+    rango = PUNTUACION_MAXIMA - PUNTUACION_MINIMA
+    fraccion = min(max((float(puntuacion) - PUNTUACION_MINIMA) / rango, 0.0), 0.99)
+    actual = -ESCALA_ALERTAS * math.log(1 - fraccion)
+    return actual * 2 ** ((ahora - EPOCA).total_seconds() / (VIDA_MEDIA_DIAS * 86400))
+
+
+def sembrar_intensidad(apps, schema_editor):
+    """
+    Intensidad inicial equivalente a la puntuación actual de cada zona
+    """
+    EstadisticaRiesgo = apps.get_model('rappiSafe', 'EstadisticaRiesgo')
+
+    ahora = datetime.now(timezone.utc)
+    zonas = list(EstadisticaRiesgo.objects.only('id', 'puntuacion_riesgo'))
+    for zona in zonas:
+        zona.intensidad_alertas = intensidad_para_puntuacion(zona.puntuacion_riesgo, ahora)
+    EstadisticaRiesgo.objects.bulk_update(zonas, ['intensidad_alertas'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0013_rutasegura_polilineas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadisticariesgo',
+            name='intensidad_alertas',
+            field=models.FloatField(default=0, verbose_name='Intensidad de alertas (normalizada)'),
+        ),
+        migrations.RunPython(sembrar_intensidad, migrations.RunPython.noop),
+    ]
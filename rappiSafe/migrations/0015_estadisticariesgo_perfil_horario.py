@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rappiSafe', '0014_estadisticariesgo_intensidad_alertas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadisticariesgo',
+            name='perfil_horario',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Perfil horario de alertas'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
+from django.utils import timezone
 import uuid
 
 
@@ -106,6 +107,15 @@ class Alerta(models.Model):
         verbose_name = 'Alerta'
         verbose_name_plural = 'Alertas'
         ordering = ['-creado_en']
+        indexes = [
+            # Índice parcial: solo contiene las alertas activas, así que las
+            # consultas de alertas abiertas no dependen del tamaño del histórico
+            models.Index(
+                fields=['repartidor', '-creado_en'],
+                name='alerta_activa_idx',
+                condition=models.Q(estado__in=['pendiente', 'en_atencion'])
+            ),
+        ]
 
     def __str__(self):
         return f"Alerta {self.get_tipo_display()} - {self.repartidor.get_full_name()} - {self.creado_en.strftime('%Y-%m-%d %H:%M')}"
@@ -120,7 +130,7 @@ class Trayectoria(models.Model):
     longitud = models.DecimalField(max_digits=9, decimal_places=6, verbose_name='Longitud')
     precision = models.FloatField(null=True, blank=True, verbose_name='Precisión (metros)')
     velocidad = models.FloatField(null=True, blank=True, verbose_name='Velocidad (m/s)')
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name='Fecha y hora')
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name='Fecha y hora')
 
     class Meta:
         verbose_name = 'Punto de Trayectoria'
@@ -223,6 +233,10 @@ class EstadisticaRiesgo(models.Model):
     total_alertas = models.IntegerField(default=0, verbose_name='Total de alertas')
     alertas_panico = models.IntegerField(default=0, verbose_name='Alertas de pánico')
     alertas_accidente = models.IntegerField(default=0, verbose_name='Alertas de accidente')
+    # Intensidad de alertas con decaimiento, normalizada a una época fija (ver agregacion_riesgo)
+    intensidad_alertas = models.FloatField(default=0, verbose_name='Intensidad de alertas (normalizada)')
+    # La misma intensidad por hora de la semana: 7×24 float64 empaquetados (ver riesgo_horario)
+    perfil_horario = models.BinaryField(null=True, blank=True, editable=False, verbose_name='Perfil horario de alertas')
     ultima_actualizacion = models.DateTimeField(auto_now=True, verbose_name='Última actualización')
     periodo_inicio = models.DateField(verbose_name='Inicio del período')
     periodo_fin = models.DateField(verbose_name='Fin del período')
@@ -267,6 +281,10 @@ class SolicitudAyudaPsicologica(models.Model):
 class RutaSegura(models.Model):
     """
     Rutas seguras calculadas y guardadas
+
+    Las geometrías se guardan como polilíneas codificadas en la clave
+    'polilinea' de ruta_rapida y de cada ruta de ruta_segura['rutas'];
+    polilineas.coordenadas_de las decodifica.
     """
     repartidor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rutas', limit_choices_to={'rol': 'repartidor'})
     origen_lat = models.DecimalField(max_digits=9, decimal_places=6, verbose_name='Latitud origen')
@@ -304,6 +322,7 @@ class NotificacionContacto(models.Model):
         ('entregado', 'Entregado'),
         ('fallido', 'Fallido'),
         ('pendiente', 'Pendiente'),
+        ('enviando', 'Enviando'),
     )
 
     alerta = models.ForeignKey(Alerta, on_delete=models.CASCADE, related_name='notificaciones_contactos')
@@ -314,11 +333,25 @@ class NotificacionContacto(models.Model):
     respuesta_api = models.JSONField(null=True, blank=True, verbose_name='Respuesta del servicio')
     enviado_en = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de envío')
     error_mensaje = models.TextField(blank=True, verbose_name='Mensaje de error')
+    intentos = models.PositiveIntegerField(default=0, verbose_name='Intentos de envío')
+    historial_intentos = models.JSONField(default=list, blank=True, verbose_name='Historial de intentos')
+    siguiente_intento = models.DateTimeField(null=True, blank=True, verbose_name='Siguiente reintento')
+    actualizado_en = models.DateTimeField(auto_now=True, verbose_name='Última actualización')
 
     class Meta:
         verbose_name = 'Notificación a Contacto'
         verbose_name_plural = 'Notificaciones a Contactos'
         ordering = ['-enviado_en']
+        indexes = [
+            # La bandeja de salida se drena por estado en orden de llegada
+            models.Index(fields=['estado', 'enviado_en'], name='notif_estado_enviado_idx'),
+            # El programador de reintentos busca fallidas con reintento vencido
+            models.Index(fields=['estado', 'siguiente_intento'], name='notif_estado_reintento_idx'),
+        ]
+        constraints = [
+            # Un contacto recibe a lo sumo una notificación por alerta y método
+            models.UniqueConstraint(fields=['alerta', 'contacto', 'metodo'], name='notif_unica_alerta_contacto_metodo'),
+        ]
 
     def __str__(self):
         return f"Notificación a {self.contacto.nombre} - {self.get_metodo_display()}"
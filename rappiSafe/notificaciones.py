@@ -0,0 +1,343 @@
+"""
+Bandeja de salida (outbox) para las notificaciones a contactos de emergencia.
+
+Las vistas que crean alertas solo registran una NotificacionContacto en estado
+'pendiente' por cada contacto, dentro de la misma transacción que la alerta.
+Un pool de hilos en segundo plano drena esos registros y hace el envío real,
+de modo que la respuesta del botón de pánico no depende del proveedor de SMS.
+
+Los envíos fallidos se reintentan con backoff exponencial con jitter hasta el
+plazo máximo de la alerta, y cada intento queda en el historial del registro.
+"""
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def encolar_notificaciones(alerta):
+    """
+    Registrar en la bandeja de salida una notificación por cada contacto validado.
+
+    Debe llamarse dentro de la transacción que crea la alerta: si la transacción
+    se revierte no queda ningún trabajo huérfano, y los trabajadores solo se
+    despiertan cuando la transacción se confirma.
+
+    Args:
+        alerta: Objeto Alerta recién creado
+
+    Los contactos que ya tienen una notificación SMS para esta alerta se omiten,
+    de modo que llamarla varias veces para la misma alerta no duplica envíos.
+
+    Returns:
+        tuple: (notificaciones creadas en estado 'pendiente', contactos omitidos)
+    """
+    from .models import ContactoConfianza, NotificacionContacto
+    from .utils import generar_mensaje_alerta
+
+    contactos = ContactoConfianza.objects.filter(
+        repartidor=alerta.repartidor,
+        validado=True  # Solo notificar contactos validados
+    )
+
+    ya_notificados = set(
+        NotificacionContacto.objects.filter(alerta=alerta, metodo='sms').values_list('contacto_id', flat=True)
+    )
+    nuevos = [contacto for contacto in contactos if contacto.id not in ya_notificados]
+    omitidos = [contacto for contacto in contactos if contacto.id in ya_notificados]
+
+    mensaje = generar_mensaje_alerta(alerta)
+    # ignore_conflicts cubre la carrera con otro proceso que encole el mismo
+    # contacto; la restricción única decide cuál de los dos registros queda
+    candidatas = NotificacionContacto.objects.bulk_create([
+        NotificacionContacto(
+            alerta=alerta,
+            contacto=contacto,
+            metodo='sms',
+            estado='pendiente',
+            mensaje=mensaje,
+        )
+        for contacto in nuevos
+    ], ignore_conflicts=True)
+
+    # bulk_create con ignore_conflicts devuelve todos los objetos, también los
+    # que la base de datos descartó; solo cuentan como creados los registros
+    # cuya fecha de envío coincide con la que les asignó esta llamada
+    creadas = {(n.contacto_id, n.enviado_en) for n in candidatas}
+    notificaciones = [
+        n for n in NotificacionContacto.objects.filter(alerta=alerta, metodo='sms', contacto__in=nuevos)
+        if (n.contacto_id, n.enviado_en) in creadas
+    ]
+    ids_creados = {n.contacto_id for n in notificaciones}
+    omitidos += [contacto for contacto in nuevos if contacto.id not in ids_creados]
+
+    if notificaciones:
+        transaction.on_commit(despachador.despertar)
+    elif not omitidos:
+        logger.warning('Alerta %s: no hay contactos de emergencia validados', alerta.id)
+
+    return notificaciones, omitidos
+
+
+def procesar_notificacion(notificacion_id):
+    """
+    Reclamar una notificación pendiente y enviarla.
+
+    El reclamo es un UPDATE condicional sobre el estado, así que aunque varios
+    trabajadores (o procesos) intenten tomar el mismo registro, solo uno lo envía.
+
+    Returns:
+        NotificacionContacto procesada, o None si otro trabajador la tomó primero
+    """
+    from .models import NotificacionContacto
+    from .utils import enviar_notificacion_contacto
+
+    reclamada = NotificacionContacto.objects.filter(
+        id=notificacion_id,
+        estado='pendiente'
+    ).update(
+        estado='enviando',
+        intentos=F('intentos') + 1,
+        actualizado_en=timezone.now()
+    )
+    if not reclamada:
+        return None
+
+    notificacion = NotificacionContacto.objects.select_related('contacto', 'alerta').get(id=notificacion_id)
+
+    try:
+        resultado = enviar_notificacion_contacto(notificacion.contacto, notificacion.mensaje)
+    except Exception as e:
+        resultado = {'success': False, 'metodo': 'sms', 'respuesta': {'error': str(e)}}
+
+    registrar_resultado(notificacion, resultado)
+    notificacion.save(update_fields=[
+        'estado', 'respuesta_api', 'error_mensaje', 'historial_intentos', 'siguiente_intento', 'actualizado_en'
+    ])
+
+    if resultado['success']:
+        logger.info('Notificación %s enviada a %s', notificacion.id, notificacion.contacto.nombre)
+    elif notificacion.siguiente_intento:
+        logger.warning('Notificación %s fallida para %s, reintento a las %s: %s', notificacion.id,
+                       notificacion.contacto.nombre, notificacion.siguiente_intento, notificacion.error_mensaje)
+    else:
+        logger.error('Notificación %s fallida definitivamente para %s: %s', notificacion.id,
+                     notificacion.contacto.nombre, notificacion.error_mensaje)
+
+    return notificacion
+
+
+def calcular_espera_reintento(intentos):
+    """
+    Backoff exponencial con jitter para el reintento número `intentos`.
+
+    La mitad del intervalo es fija y la otra mitad aleatoria, para que los
+    reintentos de muchas notificaciones fallidas a la vez no lleguen juntos
+    al proveedor.
+
+    Returns:
+        float: Segundos de espera
+    """
+    tope = min(
+        settings.NOTIFICACIONES_REINTENTO_MAXIMO,
+        settings.NOTIFICACIONES_REINTENTO_BASE * (2 ** max(0, intentos - 1))
+    )
+    return tope / 2 + random.uniform(0, tope / 2)
+
+
+def registrar_resultado(notificacion, resultado):
+    """
+    Aplicar el resultado de un intento de envío a la notificación (sin guardarla).
+
+    Agrega el intento al historial y, si falló, programa el siguiente reintento
+    mientras no se excedan el máximo de intentos ni el plazo de la alerta.
+
+    Args:
+        notificacion: NotificacionContacto cuyo contador de intentos ya incluye este intento
+        resultado: dict devuelto por enviar_notificacion_contacto
+    """
+    ahora = timezone.now()
+    respuesta = resultado.get('respuesta') or {}
+    error = '' if resultado['success'] else (resultado.get('error') or respuesta.get('error', ''))
+
+    notificacion.estado = 'enviado' if resultado['success'] else 'fallido'
+    notificacion.respuesta_api = resultado.get('respuesta')
+    notificacion.error_mensaje = error
+    notificacion.historial_intentos = list(notificacion.historial_intentos or []) + [{
+        'intento': notificacion.intentos,
+        'fecha': ahora.isoformat(),
+        'estado': notificacion.estado,
+        'error': error,
+    }]
+    notificacion.siguiente_intento = None
+
+    if not resultado['success'] and notificacion.intentos < settings.NOTIFICACIONES_MAX_INTENTOS:
+        siguiente = ahora + timedelta(seconds=calcular_espera_reintento(notificacion.intentos))
+        plazo = notificacion.alerta.creado_en + timedelta(seconds=settings.NOTIFICACIONES_PLAZO_ALERTA)
+        if siguiente <= plazo:
+            notificacion.siguiente_intento = siguiente
+
+
+def reprogramar_fallidas():
+    """
+    Devolver a la bandeja de salida las notificaciones fallidas cuyo reintento ya venció.
+
+    Solo toca registros fallidos con reintento programado; los contactos que ya
+    recibieron el mensaje nunca se vuelven a enviar.
+
+    Returns:
+        int: Número de notificaciones reprogramadas
+    """
+    from .models import NotificacionContacto
+
+    return NotificacionContacto.objects.filter(
+        estado='fallido',
+        siguiente_intento__lte=timezone.now()
+    ).update(estado='pendiente', siguiente_intento=None, actualizado_en=timezone.now())
+
+
+def liberar_reclamos_vencidos():
+    """
+    Regresar a 'pendiente' las notificaciones que quedaron en 'enviando' porque
+    el proceso que las reclamó se detuvo antes de terminar el envío.
+
+    Returns:
+        int: Número de notificaciones liberadas
+    """
+    from .models import NotificacionContacto
+
+    limite = timezone.now() - timedelta(seconds=settings.NOTIFICACIONES_TIMEOUT_ENVIO)
+    return NotificacionContacto.objects.filter(
+        estado='enviando',
+        actualizado_en__lt=limite
+    ).update(estado='pendiente', actualizado_en=timezone.now())
+
+
+class DespachadorNotificaciones:
+    """
+    Pool de trabajadores que drena la bandeja de salida de notificaciones
+    """
+
+    def __init__(self, max_trabajadores=None, tamano_lote=100):
+        self.max_trabajadores = max_trabajadores
+        self.tamano_lote = tamano_lote
+        self._executor = None
+        self._en_curso = set()
+        self._temporizador = None
+        self._proximo_reintento = None
+        self._lock = threading.Lock()
+
+    def _obtener_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_trabajadores or settings.NOTIFICACIONES_WORKERS,
+                    thread_name_prefix='notificaciones'
+                )
+            return self._executor
+
+    def despertar(self):
+        """
+        Enviar al pool las notificaciones pendientes más antiguas
+        """
+        from .models import NotificacionContacto
+
+        pendientes = NotificacionContacto.objects.filter(
+            estado='pendiente'
+        ).order_by('enviado_en').values_list('id', flat=True)[:self.tamano_lote]
+
+        for notificacion_id in pendientes:
+            self.enviar(notificacion_id)
+
+    def enviar(self, notificacion_id):
+        """
+        Programar el envío de una notificación si no está ya en curso en este proceso
+        """
+        with self._lock:
+            if notificacion_id in self._en_curso:
+                return
+            self._en_curso.add(notificacion_id)
+
+        self._obtener_executor().submit(self._ejecutar, notificacion_id)
+
+    def _ejecutar(self, notificacion_id):
+        try:
+            notificacion = procesar_notificacion(notificacion_id)
+            if notificacion is not None and notificacion.siguiente_intento:
+                self.programar_reintento(notificacion.siguiente_intento)
+        except Exception:
+            logger.exception('Error al procesar la notificación %s', notificacion_id)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._en_curso.discard(notificacion_id)
+
+    def programar_reintento(self, cuando):
+        """
+        Despertar este proceso cuando venza el reintento de una notificación.
+
+        Un solo temporizador por proceso apunta al reintento más próximo; los
+        posteriores no crean hilos propios, se recogen desde la base de datos
+        cuando ese temporizador se dispara. Si el proceso se detiene antes, el
+        comando procesar_notificaciones recoge el reintento a partir de
+        `siguiente_intento`.
+        """
+        with self._lock:
+            if self._temporizador is not None and self._proximo_reintento <= cuando:
+                return
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+
+            espera = max(0.0, (cuando - timezone.now()).total_seconds())
+            self._proximo_reintento = cuando
+            self._temporizador = threading.Timer(espera, self._reintentar)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+
+    def _reintentar(self):
+        from .models import NotificacionContacto
+
+        with self._lock:
+            if self._temporizador is not threading.current_thread():
+                return
+            self._temporizador = None
+            self._proximo_reintento = None
+
+        try:
+            if reprogramar_fallidas():
+                self.despertar()
+
+            siguiente = NotificacionContacto.objects.filter(
+                estado='fallido',
+                siguiente_intento__isnull=False
+            ).order_by('siguiente_intento').values_list('siguiente_intento', flat=True).first()
+            if siguiente is not None:
+                self.programar_reintento(siguiente)
+        except Exception:
+            logger.exception('Error al reprogramar notificaciones fallidas')
+        finally:
+            close_old_connections()
+
+    def pendientes_en_curso(self):
+        with self._lock:
+            return len(self._en_curso)
+
+    def detener(self, esperar=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = self._proximo_reintento = None
+        if executor is not None:
+            executor.shutdown(wait=esperar)
+
+
+despachador = DespachadorNotificaciones()
@@ -0,0 +1,261 @@
+"""
+Zonas de riesgo con forma de polígono.
+
+coordenadas_zona puede traer, además del círculo {'center': {...}}, una
+geometría GeoJSON Polygon o MultiPolygon (directamente, como Feature o en la
+clave 'geometry'). Para esas zonas la "distancia a la zona" que usan las
+bandas de 1/2/3 km es la distancia al polígono, 0 si el punto está dentro,
+en lugar de la distancia al centro.
+
+Cada polígono se interpreta una sola vez (al construir el índice de zonas) y
+se guarda como arreglos de aristas proyectadas a kilómetros alrededor de su
+centroide, con su caja envolvente. Las pruebas de punto en polígono (regla
+par-impar sobre todos los anillos, así los huecos quedan fuera) y de
+distancia a las aristas se hacen con NumPy para muchos puntos a la vez, y
+solo para los puntos que la caja no descarta.
+
+Para la distancia las aristas se agrupan en tramos consecutivos con su propia
+caja: un tramo cuya caja está más lejos del punto que algún vértice del
+polígono no puede tener la arista más cercana, así que solo se miden las
+aristas de unos cuantos tramos por punto en lugar de todas.
+
+La proyección equirectangular local es suficiente para polígonos del tamaño
+de una colonia o alcaldía.
+"""
+import hashlib
+import math
+
+import numpy as np
+
+RADIO_TIERRA_KM = 6371
+KM_POR_GRADO = RADIO_TIERRA_KM * math.pi / 180
+# Elementos máximos de las matrices puntos × aristas por bloque
+ELEMENTOS_POR_BLOQUE = 2_000_000
+# Aristas por tramo para descartar aristas lejanas en el cálculo de distancias
+ARISTAS_POR_TRAMO = 16
+TIPOS = ('Polygon', 'MultiPolygon')
+
+
+def geometria_de(coordenadas_zona):
+    """
+    La geometría Polygon/MultiPolygon de coordenadas_zona, o None si la zona es un círculo
+    """
+    if not isinstance(coordenadas_zona, dict):
+        return None
+    geometria = coordenadas_zona
+    if geometria.get('type') == 'Feature' or 'geometry' in geometria:
+        geometria = geometria.get('geometry')
+    if isinstance(geometria, dict) and geometria.get('type') in TIPOS:
+        return geometria
+    return None
+
+
+class PoligonoZona:
+    """
+    Polígono o multipolígono como arreglos de aristas en km, con caja envolvente en grados
+    """
+
+    def __init__(self, anillos):
+        """
+        Args:
+            anillos: lista de arreglos (n, 2) de [lng, lat] en grados (exteriores y huecos)
+        """
+        vertices = np.concatenate(anillos)
+        # Identifica la geometría para reutilizar cálculos entre índices de zonas
+        huella = hashlib.sha1(np.asarray([len(anillo) for anillo in anillos]).tobytes())
+        huella.update(np.ascontiguousarray(vertices, dtype=float).tobytes())
+        self.clave = huella.hexdigest()
+        self.lat_min, self.lng_min = float(vertices[:, 1].min()), float(vertices[:, 0].min())
+        self.lat_max, self.lng_max = float(vertices[:, 1].max()), float(vertices[:, 0].max())
+
+        self.lat0 = (self.lat_min + self.lat_max) / 2
+        self.lng0 = (self.lng_min + self.lng_max) / 2
+        self.cos_lat0 = math.cos(math.radians(self.lat0))
+
+        inicios, finales = [], []
+        for anillo in anillos:
+            x, y = self._proyectar(anillo[:, 1], anillo[:, 0])
+            puntos = np.column_stack((x, y))
+            # Cerrar el anillo si GeoJSON no repite el primer vértice
+            if not np.array_equal(puntos[0], puntos[-1]):
+                puntos = np.vstack((puntos, puntos[:1]))
+            inicios.append(puntos[:-1])
+            finales.append(puntos[1:])
+        inicio, final = np.concatenate(inicios), np.concatenate(finales)
+        self.x1, self.y1 = inicio[:, 0], inicio[:, 1]
+        self.dx, self.dy = final[:, 0] - self.x1, final[:, 1] - self.y1
+        self.largo2 = self.dx * self.dx + self.dy * self.dy
+        self._preparar_tramos()
+
+        self.centro_lat, self.centro_lng = self._centroide(anillos[0])
+
+    @classmethod
+    def desde_geojson(cls, geometria):
+        """
+        Raises:
+            ValueError, TypeError, IndexError: si la geometría no es válida
+        """
+        if geometria['type'] == 'Polygon':
+            partes = [geometria['coordinates']]
+        else:
+            partes = geometria['coordinates']
+
+        anillos = []
+        for parte in partes:
+            for anillo in parte:
+                puntos = np.asarray(anillo, dtype=float)[:, :2]
+                if len(puntos) < 3 or not np.isfinite(puntos).all():
+                    raise ValueError('Anillo de polígono inválido')
+                anillos.append(puntos)
+        if not anillos:
+            raise ValueError('Polígono sin anillos')
+        return cls(anillos)
+
+    def _proyectar(self, lat, lng):
+        x = (np.asarray(lng, dtype=float) - self.lng0) * self.cos_lat0 * KM_POR_GRADO
+        y = (np.asarray(lat, dtype=float) - self.lat0) * KM_POR_GRADO
+        return x, y
+
+    def _centroide(self, anillo):
+        """
+        Centroide (por área) del primer anillo exterior; el promedio de vértices si es degenerado
+        """
+        lng, lat = anillo[:, 0], anillo[:, 1]
+        cruz = lng[:-1] * lat[1:] - lng[1:] * lat[:-1]
+        area = cruz.sum() / 2
+        if abs(area) < 1e-12:
+            return float(lat.mean()), float(lng.mean())
+        return (
+            float(((lat[:-1] + lat[1:]) * cruz).sum() / (6 * area)),
+            float(((lng[:-1] + lng[1:]) * cruz).sum() / (6 * area)),
+        )
+
+    def _preparar_tramos(self):
+        """
+        Aristas en tramos de ARISTAS_POR_TRAMO (matrices tramos × aristas,
+        rellenas repitiendo la última arista) con la caja de cada tramo
+        """
+        num_aristas = len(self.x1)
+        num_tramos = -(-num_aristas // ARISTAS_POR_TRAMO)
+        indices = np.minimum(np.arange(num_tramos * ARISTAS_POR_TRAMO), num_aristas - 1)
+        indices = indices.reshape(num_tramos, ARISTAS_POR_TRAMO)
+        self.tramo_x1, self.tramo_y1 = self.x1[indices], self.y1[indices]
+        self.tramo_dx, self.tramo_dy = self.dx[indices], self.dy[indices]
+        self.tramo_largo2 = self.largo2[indices]
+
+        x2, y2 = self.tramo_x1 + self.tramo_dx, self.tramo_y1 + self.tramo_dy
+        self.tramo_x_min = np.minimum(self.tramo_x1, x2).min(axis=1)
+        self.tramo_x_max = np.maximum(self.tramo_x1, x2).max(axis=1)
+        self.tramo_y_min = np.minimum(self.tramo_y1, y2).min(axis=1)
+        self.tramo_y_max = np.maximum(self.tramo_y1, y2).max(axis=1)
+
+    def _bloques(self, num_puntos, elementos_por_punto=None):
+        paso = max(1, ELEMENTOS_POR_BLOQUE // max(1, elementos_por_punto or len(self.x1)))
+        for inicio in range(0, num_puntos, paso):
+            yield slice(inicio, inicio + paso)
+
+    def _dentro(self, x, y):
+        """
+        Regla par-impar: cuántas aristas cruza un rayo hacia +x desde cada punto
+        """
+        dentro = np.zeros(len(x), dtype=bool)
+        y2 = self.y1 + self.dy
+        for bloque in self._bloques(len(x)):
+            px, py = x[bloque, np.newaxis], y[bloque, np.newaxis]
+            cruza = (self.y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cruce = self.x1 + (py - self.y1) * self.dx / self.dy
+            dentro[bloque] = ((cruza & (px < x_cruce)).sum(axis=1) % 2) == 1
+        return dentro
+
+    def contiene(self, lat, lng):
+        """
+        Qué puntos (arreglos en grados) están dentro del polígono
+        """
+        lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+        resultado = np.zeros(lat.shape, dtype=bool)
+        caja = (lat >= self.lat_min) & (lat <= self.lat_max) & (lng >= self.lng_min) & (lng <= self.lng_max)
+        if caja.any():
+            x, y = self._proyectar(lat[caja], lng[caja])
+            resultado[caja] = self._dentro(x, y)
+        return resultado
+
+    def _distancias_borde(self, x, y):
+        """
+        Distancia (km) de puntos proyectados a la arista más cercana, midiendo
+        solo los tramos que pueden contenerla
+        """
+        distancias = np.empty(len(x))
+        num_tramos = len(self.tramo_x_min)
+        for bloque in self._bloques(len(x), num_tramos):
+            px, py = x[bloque, np.newaxis], y[bloque, np.newaxis]
+            # Cota inferior: distancia a la caja del tramo; cota superior: a su primer vértice
+            fuera_x = np.maximum(np.maximum(self.tramo_x_min - px, px - self.tramo_x_max), 0.0)
+            fuera_y = np.maximum(np.maximum(self.tramo_y_min - py, py - self.tramo_y_max), 0.0)
+            inferior = np.hypot(fuera_x, fuera_y)
+            superior = np.hypot(px - self.tramo_x1[:, 0], py - self.tramo_y1[:, 0]).min(axis=1)
+
+            # Cada punto conserva al menos el tramo de su vértice más cercano
+            puntos, tramos = np.nonzero(inferior <= superior[:, np.newaxis])
+            minimos = np.empty(len(puntos))
+            for parte in self._bloques(len(puntos), ARISTAS_POR_TRAMO):
+                punto, tramo = puntos[parte], tramos[parte]
+                ax = px[punto] - self.tramo_x1[tramo]
+                ay = py[punto] - self.tramo_y1[tramo]
+                dx, dy = self.tramo_dx[tramo], self.tramo_dy[tramo]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = np.clip((ax * dx + ay * dy) / self.tramo_largo2[tramo], 0.0, 1.0)
+                t = np.nan_to_num(t)
+                minimos[parte] = np.hypot(ax - t * dx, ay - t * dy).min(axis=1)
+
+            # np.nonzero recorre los puntos en orden: un mínimo por grupo de pares
+            inicios = np.flatnonzero(np.r_[True, puntos[1:] != puntos[:-1]])
+            distancias[bloque] = np.minimum.reduceat(minimos, inicios)
+        return distancias
+
+    def distancias_km(self, lat, lng, hasta_km=None):
+        """
+        Distancia en km de cada punto (arreglos en grados) al polígono; 0 dentro
+
+        Args:
+            hasta_km: si se da, los puntos cuya caja envolvente ya está más
+                lejos que esto reciben la distancia a la caja (mayor que
+                hasta_km) sin medir las aristas
+        """
+        lat, lng = np.atleast_1d(np.asarray(lat, dtype=float)), np.atleast_1d(np.asarray(lng, dtype=float))
+        x, y = self._proyectar(lat, lng)
+        if hasta_km is None:
+            distancias = self._distancias_borde(x, y)
+        else:
+            x_min, y_min = self._proyectar(self.lat_min, self.lng_min)
+            x_max, y_max = self._proyectar(self.lat_max, self.lng_max)
+            distancias = np.hypot(
+                np.maximum(np.maximum(x_min - x, x - x_max), 0.0),
+                np.maximum(np.maximum(y_min - y, y - y_max), 0.0),
+            )
+            cerca = distancias <= hasta_km
+            if cerca.any():
+                distancias[cerca] = self._distancias_borde(x[cerca], y[cerca])
+
+        caja = (lat >= self.lat_min) & (lat <= self.lat_max) & (lng >= self.lng_min) & (lng <= self.lng_max)
+        if caja.any():
+            dentro = np.zeros(len(x), dtype=bool)
+            dentro[caja] = self._dentro(x[caja], y[caja])
+            distancias[dentro] = 0.0
+        return distancias
+
+    def distancia_km(self, lat, lng, hasta_km=None):
+        return float(self.distancias_km(lat, lng, hasta_km)[0])
+
+
+def poligono_de(coordenadas_zona):
+    """
+    PoligonoZona de la zona, o None si es un círculo o la geometría no es válida
+    """
+    geometria = geometria_de(coordenadas_zona)
+    if geometria is None:
+        return None
+    try:
+        return PoligonoZona.desde_geojson(geometria)
+    except (KeyError, ValueError, TypeError, IndexError):
+        return None
@@ -0,0 +1,197 @@
+"""
+Simplificación y remuestreo de las polilíneas de las rutas.
+
+OSRM con overview=full devuelve un vértice por cada quiebre de la calle, así
+que el número de puntos depende de qué tan densa sea la geometría de la vía y
+no de la longitud de la ruta. Antes de puntuar y de guardar/enviar una ruta se
+generan dos versiones:
+
+- Polilínea de puntuación: simplificada con Douglas–Peucker y remuestreada a
+  un espaciado uniforme, para que cada tramo de la ruta pese lo mismo sin
+  importar cuántos vértices tenía.
+- Polilínea de visualización: simplificada con una tolerancia mayor (la
+  diferencia no se nota en el mapa) y con las coordenadas redondeadas.
+
+Las distancias se miden en metros sobre una proyección equirectangular local,
+suficiente para la extensión de una ruta urbana.
+
+Para guardar y enviar las rutas se usa el formato de polilínea codificada de
+Google: diferencias entre puntos consecutivos en zigzag y en bloques de 5 bits
+como caracteres ASCII. Una coordenada ocupa ~6 caracteres en lugar de ~20 del
+arreglo JSON de floats.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+
+RADIO_TIERRA_M = 6371000
+# Decimales de las coordenadas de visualización (~1 m)
+DECIMALES_VISUALIZACION = 5
+
+
+def _proyectar(coordenadas):
+    """
+    Coordenadas [lat, lng] a metros (x, y) alrededor de la latitud media
+    """
+    puntos = np.asarray(coordenadas, dtype=float)[:, :2]
+    lat = np.radians(puntos[:, 0])
+    lng = np.radians(puntos[:, 1])
+    cos_lat0 = math.cos(float(lat.mean()))
+    return (lng - lng[0]) * cos_lat0 * RADIO_TIERRA_M, (lat - lat[0]) * RADIO_TIERRA_M
+
+
+def simplificar(coordenadas, tolerancia_m):
+    """
+    Douglas–Peucker: conserva solo los vértices que se alejan más de
+    `tolerancia_m` metros de la recta entre los vértices conservados
+
+    Args:
+        coordenadas: lista de [lat, lng]
+        tolerancia_m: distancia máxima permitida a la polilínea original
+
+    Returns:
+        list: subconjunto de las coordenadas originales, en orden
+    """
+    if len(coordenadas) < 3 or tolerancia_m <= 0:
+        return list(coordenadas)
+
+    x, y = _proyectar(coordenadas)
+    conservar = np.zeros(len(coordenadas), dtype=bool)
+    conservar[0] = conservar[-1] = True
+
+    # Pila en lugar de recursión: las rutas largas tienen decenas de miles de vértices
+    pila = [(0, len(coordenadas) - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin - inicio < 2:
+            continue
+
+        dx, dy = x[fin] - x[inicio], y[fin] - y[inicio]
+        px, py = x[inicio + 1:fin] - x[inicio], y[inicio + 1:fin] - y[inicio]
+        largo2 = dx * dx + dy * dy
+        if largo2 == 0:
+            distancias = np.hypot(px, py)
+        else:
+            # Distancia al segmento (no a la recta infinita) para rutas que regresan sobre sí mismas
+            t = np.clip((px * dx + py * dy) / largo2, 0.0, 1.0)
+            distancias = np.hypot(px - t * dx, py - t * dy)
+
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia_m:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pila.append((inicio, medio))
+            pila.append((medio, fin))
+
+    return [coordenadas[i] for i in np.flatnonzero(conservar)]
+
+
+def remuestrear(coordenadas, espaciado_m):
+    """
+    Puntos a lo largo de la polilínea separados `espaciado_m` metros
+    (el último tramo puede ser más corto), incluyendo ambos extremos
+    """
+    if len(coordenadas) < 2 or espaciado_m <= 0:
+        return [list(coord[:2]) for coord in coordenadas]
+
+    x, y = _proyectar(coordenadas)
+    acumulada = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    total = float(acumulada[-1])
+    if total == 0:
+        return [list(coordenadas[0][:2])]
+
+    distancias = np.linspace(0.0, total, math.ceil(total / espaciado_m) + 1)
+    puntos = np.asarray(coordenadas, dtype=float)
+    lat = np.interp(distancias, acumulada, puntos[:, 0])
+    lng = np.interp(distancias, acumulada, puntos[:, 1])
+    return [[float(a), float(b)] for a, b in zip(lat, lng)]
+
+
+def polilinea_puntuacion(coordenadas):
+    """
+    Polilínea para puntuar el riesgo: simplificada y con espaciado uniforme
+    """
+    simplificada = simplificar(coordenadas, settings.RUTAS_TOLERANCIA_PUNTUACION_M)
+    return remuestrear(simplificada, settings.RUTAS_ESPACIADO_PUNTUACION_M)
+
+
+def polilinea_visualizacion(coordenadas):
+    """
+    Polilínea compacta para el mapa del repartidor y para guardar en RutaSegura
+    """
+    simplificada = simplificar(coordenadas, settings.RUTAS_TOLERANCIA_VISUALIZACION_M)
+    return [
+        [round(coord[0], DECIMALES_VISUALIZACION), round(coord[1], DECIMALES_VISUALIZACION)]
+        for coord in simplificada
+    ]
+
+
+def codificar(coordenadas, precision=DECIMALES_VISUALIZACION):
+    """
+    Coordenadas [[lat, lng], ...] a polilínea codificada (algoritmo de Google)
+    """
+    if len(coordenadas) == 0:
+        return ''
+
+    enteros = np.round(np.asarray(coordenadas, dtype=float)[:, :2] * 10 ** precision).astype(np.int64)
+    # Diferencias respecto al punto anterior, en zigzag para que los negativos también sean pequeños
+    deltas = np.diff(enteros, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    valores = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    caracteres = []
+    for valor in valores:
+        while valor >= 0x20:
+            caracteres.append(chr((0x20 | (valor & 0x1f)) + 63))
+            valor >>= 5
+        caracteres.append(chr(valor + 63))
+    return ''.join(caracteres)
+
+
+def decodificar(polilinea, precision=DECIMALES_VISUALIZACION):
+    """
+    Polilínea codificada a coordenadas [[lat, lng], ...]
+
+    Raises:
+        ValueError: si el texto está truncado
+    """
+    valores = []
+    valor = desplazamiento = 0
+    for caracter in polilinea:
+        bloque = ord(caracter) - 63
+        valor |= (bloque & 0x1f) << desplazamiento
+        desplazamiento += 5
+        if bloque < 0x20:
+            valores.append(~(valor >> 1) if valor & 1 else valor >> 1)
+            valor = desplazamiento = 0
+    if desplazamiento or len(valores) % 2:
+        raise ValueError('Polilínea codificada incompleta')
+
+    factor = 10 ** precision
+    coordenadas = []
+    lat = lng = 0
+    for i in range(0, len(valores), 2):
+        lat += valores[i]
+        lng += valores[i + 1]
+        coordenadas.append([lat / factor, lng / factor])
+    return coordenadas
+
+
+def codificar_ruta(ruta):
+    """
+    Copia de una ruta ({'coordenadas': ..., 'distancia': ...}) con la geometría
+    como 'polilinea' codificada en lugar de 'coordenadas'
+    """
+    codificada = {clave: valor for clave, valor in ruta.items() if clave != 'coordenadas'}
+    if 'polilinea' not in codificada:
+        codificada['polilinea'] = codificar(ruta.get('coordenadas') or [])
+    return codificada
+
+
+def coordenadas_de(ruta):
+    """
+    Coordenadas de una ruta guardada, codificada o en el formato anterior
+    """
+    if 'polilinea' in ruta:
+        return decodificar(ruta['polilinea'])
+    return ruta.get('coordenadas') or []
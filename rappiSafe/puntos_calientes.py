@@ -0,0 +1,471 @@
+"""
+Descubrimiento de puntos calientes agrupando las ubicaciones de las alertas.
+
+Las zonas de riesgo eran colonias capturadas a mano. Este módulo agrupa la
+latitud/longitud de las alertas históricas por densidad (al estilo DBSCAN) y
+propone o refresca filas de EstadisticaRiesgo con centro, radio y conteos
+reales.
+
+Agrupamiento sobre una rejilla
+------------------------------
+Las alertas se acumulan en celdas de PUNTOS_CALIENTES_EPS_M / 2 de lado; cada
+celda guarda su conteo, la suma de coordenadas (para el centroide), los
+conteos por tipo, la intensidad con decaimiento de agregacion_riesgo y la
+primera y última alerta. El DBSCAN corre sobre las celdas, pesadas por su
+conteo, en lugar de sobre los puntos:
+
+- La densidad de una celda es la suma de los conteos de las celdas cuyo
+  centroide está a EPS o menos del suyo (solo se revisa la ventana de celdas
+  vecinas que puede estar a esa distancia).
+- Las celdas con densidad >= PUNTOS_CALIENTES_MINIMO_ALERTAS son núcleo; las
+  núcleo a EPS o menos entre sí forman un grupo y las demás celdas a EPS o
+  menos de un núcleo se unen al grupo del núcleo más cercano (borde). El
+  resto es ruido.
+
+El error respecto a DBSCAN sobre los puntos está acotado por el tamaño de la
+celda, y el costo por alerta es solo ubicarla en su celda: millones de
+alertas se procesan en segundos con NumPy en un núcleo.
+
+Ejecución incremental
+---------------------
+El resumen de celdas se guarda en PUNTOS_CALIENTES_DIR junto con la fecha de
+la última alerta procesada. Cada ejecución solo lee las alertas nuevas, las
+suma a sus celdas y vuelve a agrupar las celdas, que son pocas.
+
+creado_en se asigna al guardar, no al confirmar la transacción: una alerta
+puede quedar visible después de otra más nueva que ya se procesó. Por eso
+cada ejecución vuelve a leer PUNTOS_CALIENTES_MARGEN_S segundos antes de la
+marca y omite las alertas de ese margen que ya sumó (sus ids se guardan con
+la marca). Las alertas
+marcadas como falsa alarma después de procesarse siguen contando hasta una
+ejecución con completo=True (--completo).
+"""
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .agregacion_riesgo import ESTADOS_DESCARTADOS, factor_tiempo, peso_alerta, puntuacion_para_intensidad
+from .indice_espacial import IndiceZonas
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+METROS_POR_GRADO = 111320.0
+# Claves de celda: fila y columna empacadas en un entero de 64 bits
+DESPLAZAMIENTO_FILA = 1 << 32
+DESPLAZAMIENTO_COLUMNA = 1 << 31
+ORIGEN = 'agrupamiento'
+
+ARCHIVO_CELDAS = 'celdas.npz'
+ARCHIVO_ESTADO = 'estado.json'
+
+# Columnas de ResumenCeldas.datos
+CONTEO, PANICO, ACCIDENTE, SUMA_LAT, SUMA_LNG, INTENSIDAD, PRIMERA, ULTIMA = range(8)
+COLUMNAS = 8
+
+
+class ResumenCeldas:
+    """
+    Acumulados de las alertas por celda de `celda_grados` grados
+    """
+
+    def __init__(self, celda_grados, claves=None, datos=None, marca=None, recientes=None):
+        self.celda_grados = celda_grados
+        self.claves = claves if claves is not None else np.empty(0, dtype=np.int64)
+        self.datos = datos if datos is not None else np.empty((0, COLUMNAS))
+        # creado_en de la última alerta sumada
+        self.marca = marca
+        # {id: creado_en en segundos} de las alertas sumadas dentro del margen de la marca
+        self.recientes = recientes or {}
+
+    @classmethod
+    def para_eps(cls, eps_m):
+        return cls(eps_m / 2 / METROS_POR_GRADO)
+
+    def __len__(self):
+        return len(self.claves)
+
+    def claves_de(self, latitudes, longitudes):
+        filas = np.floor(latitudes / self.celda_grados).astype(np.int64)
+        columnas = np.floor(longitudes / self.celda_grados).astype(np.int64)
+        return filas * DESPLAZAMIENTO_FILA + columnas + DESPLAZAMIENTO_COLUMNA
+
+    def agregar(self, latitudes, longitudes, panico, aportes, instantes):
+        """
+        Sumar alertas a sus celdas
+
+        Args:
+            latitudes, longitudes: arreglos de grados
+            panico: arreglo booleano (pánico o accidente)
+            aportes: intensidad normalizada de cada alerta (peso · factor_tiempo)
+            instantes: creado_en en segundos desde 1970
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        if len(latitudes) == 0:
+            return
+
+        nuevas = np.empty((len(latitudes), COLUMNAS))
+        nuevas[:, CONTEO] = 1
+        nuevas[:, PANICO] = panico
+        nuevas[:, ACCIDENTE] = ~np.asarray(panico, dtype=bool)
+        nuevas[:, SUMA_LAT] = latitudes
+        nuevas[:, SUMA_LNG] = longitudes
+        nuevas[:, INTENSIDAD] = aportes
+        nuevas[:, PRIMERA] = instantes
+        nuevas[:, ULTIMA] = instantes
+
+        claves = np.concatenate((self.claves, self.claves_de(latitudes, longitudes)))
+        filas = np.concatenate((self.datos, nuevas))
+        self.claves, inversa = np.unique(claves, return_inverse=True)
+
+        datos = np.zeros((len(self.claves), COLUMNAS))
+        datos[:, PRIMERA] = np.inf
+        datos[:, ULTIMA] = -np.inf
+        sumas = [CONTEO, PANICO, ACCIDENTE, SUMA_LAT, SUMA_LNG, INTENSIDAD]
+        for columna in sumas:
+            datos[:, columna] = np.bincount(inversa, weights=filas[:, columna], minlength=len(self.claves))
+        np.minimum.at(datos[:, PRIMERA], inversa, filas[:, PRIMERA])
+        np.maximum.at(datos[:, ULTIMA], inversa, filas[:, ULTIMA])
+        self.datos = datos
+
+    def centroides(self):
+        conteo = self.datos[:, CONTEO]
+        return self.datos[:, SUMA_LAT] / conteo, self.datos[:, SUMA_LNG] / conteo
+
+    @classmethod
+    def cargar(cls, directorio):
+        directorio = Path(directorio)
+        try:
+            estado = json.loads((directorio / ARCHIVO_ESTADO).read_text(encoding='utf-8'))
+            with np.load(directorio / ARCHIVO_CELDAS) as archivo:
+                claves, datos = archivo['claves'], archivo['datos']
+        except (OSError, ValueError, KeyError):
+            return None
+        marca = datetime.fromisoformat(estado['marca']) if estado.get('marca') else None
+        return cls(estado['celda_grados'], claves, datos, marca, estado.get('recientes'))
+
+    def guardar(self, directorio):
+        directorio = Path(directorio)
+        directorio.mkdir(parents=True, exist_ok=True)
+
+        temporal = directorio / f'{ARCHIVO_CELDAS}.{os.getpid()}.tmp'
+        with open(temporal, 'wb') as archivo:
+            np.savez(archivo, claves=self.claves, datos=self.datos)
+        os.replace(temporal, directorio / ARCHIVO_CELDAS)
+
+        estado = {
+            'celda_grados': self.celda_grados,
+            'marca': self.marca.isoformat() if self.marca else None,
+            'recientes': self.recientes,
+        }
+        temporal = directorio / f'{ARCHIVO_ESTADO}.{os.getpid()}.tmp'
+        temporal.write_text(json.dumps(estado), encoding='utf-8')
+        os.replace(temporal, directorio / ARCHIVO_ESTADO)
+
+
+def _distancias_m(lat1, lng1, lat2, lng2):
+    """
+    Distancia equirectangular en metros (suficiente a la escala de EPS)
+    """
+    cos_lat = np.cos(np.radians((lat1 + lat2) / 2))
+    return np.hypot((lat2 - lat1), (lng2 - lng1) * cos_lat) * METROS_POR_GRADO
+
+
+def _vecinas(resumen, eps_m):
+    """
+    Pares (i, j) de celdas con centroides a `eps_m` o menos, incluido (i, i),
+    y su distancia
+    """
+    lat, lng = resumen.centroides()
+    celda_m = resumen.celda_grados * METROS_POR_GRADO
+    # Los centroides están dentro de su celda: más allá de esta ventana la distancia ya es mayor que EPS
+    alcance_filas = math.ceil(eps_m / celda_m)
+    cos_minimo = max(math.cos(math.radians(float(np.abs(lat).max()) + resumen.celda_grados * alcance_filas)), 1e-6)
+    alcance_columnas = math.ceil(eps_m / (celda_m * cos_minimo))
+
+    origenes, destinos, distancias = [], [], []
+    indices = np.arange(len(resumen))
+    for fila in range(-alcance_filas, alcance_filas + 1):
+        for columna in range(-alcance_columnas, alcance_columnas + 1):
+            buscadas = resumen.claves + fila * DESPLAZAMIENTO_FILA + columna
+            posiciones = np.searchsorted(resumen.claves, buscadas)
+            posiciones[posiciones == len(resumen)] = 0
+            encontradas = resumen.claves[posiciones] == buscadas
+            i, j = indices[encontradas], posiciones[encontradas]
+            distancia = _distancias_m(lat[i], lng[i], lat[j], lng[j])
+            cerca = distancia <= eps_m
+            origenes.append(i[cerca])
+            destinos.append(j[cerca])
+            distancias.append(distancia[cerca])
+    return np.concatenate(origenes), np.concatenate(destinos), np.concatenate(distancias)
+
+
+def agrupar(resumen, eps_m, minimo_alertas):
+    """
+    DBSCAN sobre las celdas del resumen
+
+    Returns:
+        np.ndarray: grupo de cada celda (-1 para ruido)
+    """
+    if len(resumen) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    conteo = resumen.datos[:, CONTEO]
+    i, j, distancia = _vecinas(resumen, eps_m)
+    densidad = np.bincount(i, weights=conteo[j], minlength=len(resumen))
+    nucleo = densidad >= minimo_alertas
+
+    # Componentes conexas de las celdas núcleo: propagar la etiqueta mínima
+    etiquetas = np.arange(len(resumen))
+    entre_nucleos = nucleo[i] & nucleo[j] & (i != j)
+    a, b = i[entre_nucleos], j[entre_nucleos]
+    while True:
+        anteriores = etiquetas.copy()
+        minimas = np.minimum(etiquetas[a], etiquetas[b])
+        np.minimum.at(etiquetas, a, minimas)
+        np.minimum.at(etiquetas, b, minimas)
+        # Saltar punteros para que las cadenas largas converjan en pocas vueltas
+        while True:
+            saltadas = etiquetas[etiquetas]
+            if np.array_equal(saltadas, etiquetas):
+                break
+            etiquetas = saltadas
+        if np.array_equal(etiquetas, anteriores):
+            break
+
+    grupos = np.full(len(resumen), -1, dtype=np.int64)
+    grupos[nucleo] = etiquetas[nucleo]
+
+    # Bordes: celdas no núcleo al grupo de la celda núcleo más cercana
+    hacia_nucleo = ~nucleo[i] & nucleo[j]
+    borde, destino, distancia = i[hacia_nucleo], j[hacia_nucleo], distancia[hacia_nucleo]
+    orden = np.lexsort((distancia, borde))
+    borde, destino = borde[orden], destino[orden]
+    primeras = np.concatenate(([True], borde[1:] != borde[:-1])) if len(borde) else np.empty(0, dtype=bool)
+    grupos[borde[primeras]] = etiquetas[destino[primeras]]
+
+    # Numerar los grupos 0..n-1
+    validos = grupos >= 0
+    _, grupos[validos] = np.unique(grupos[validos], return_inverse=True)
+    return grupos
+
+
+def resumir_grupos(resumen, grupos):
+    """
+    Centro, radio y conteos de cada grupo
+
+    Returns:
+        list: dicts ordenados por total de alertas, de mayor a menor
+    """
+    if len(grupos) == 0 or grupos.max() < 0:
+        return []
+
+    validos = grupos >= 0
+    datos, grupo = resumen.datos[validos], grupos[validos]
+    numero = int(grupo.max()) + 1
+
+    def sumar(columna):
+        return np.bincount(grupo, weights=datos[:, columna], minlength=numero)
+
+    conteo = sumar(CONTEO)
+    centro_lat, centro_lng = sumar(SUMA_LAT) / conteo, sumar(SUMA_LNG) / conteo
+    primera = np.full(numero, np.inf)
+    ultima = np.full(numero, -np.inf)
+    np.minimum.at(primera, grupo, datos[:, PRIMERA])
+    np.maximum.at(ultima, grupo, datos[:, ULTIMA])
+
+    # Radio: centroide de celda más lejano más media diagonal de celda
+    lat, lng = datos[:, SUMA_LAT] / datos[:, CONTEO], datos[:, SUMA_LNG] / datos[:, CONTEO]
+    alejamiento = _distancias_m(centro_lat[grupo], centro_lng[grupo], lat, lng)
+    radio = np.zeros(numero)
+    np.maximum.at(radio, grupo, alejamiento)
+    radio += resumen.celda_grados * METROS_POR_GRADO * math.sqrt(2) / 2
+
+    panico, accidente, intensidad = sumar(PANICO), sumar(ACCIDENTE), sumar(INTENSIDAD)
+    resumenes = [
+        {
+            'lat': float(centro_lat[g]),
+            'lng': float(centro_lng[g]),
+            'radio_km': max(float(radio[g]) / 1000, settings.PUNTOS_CALIENTES_RADIO_MINIMO_KM),
+            'total_alertas': int(round(conteo[g])),
+            'alertas_panico': int(round(panico[g])),
+            'alertas_accidente': int(round(accidente[g])),
+            'intensidad_alertas': float(intensidad[g]),
+            'primera': datetime.fromtimestamp(primera[g], tz=dt_timezone.utc),
+            'ultima': datetime.fromtimestamp(ultima[g], tz=dt_timezone.utc),
+        }
+        for g in range(numero)
+    ]
+    resumenes.sort(key=lambda grupo: grupo['total_alertas'], reverse=True)
+    return resumenes
+
+
+def _contiene(zona_lat, zona_lng, radio_km, lat, lng):
+    distancia = _distancias_m(np.array(zona_lat), np.array(zona_lng), np.array(lat), np.array(lng))
+    return float(distancia) <= radio_km * 1000
+
+
+def sincronizar_zonas(grupos, simular=False):
+    """
+    Refrescar las zonas generadas antes por agrupamiento que coinciden con un
+    grupo y crear zonas para los grupos nuevos; los grupos que caen dentro de
+    una zona capturada a mano se omiten
+
+    Returns:
+        dict: {'creadas', 'actualizadas', 'cubiertas', 'zonas': [(accion, grupo)]}
+    """
+    from .models import EstadisticaRiesgo
+
+    zonas = list(EstadisticaRiesgo.objects.all())
+    indice = IndiceZonas(zonas)
+    radio_maximo = max(
+        [float(zona.coordenadas_zona.get('radio_km') or settings.RIESGO_RADIO_ZONA_KM)
+         for zona in zonas if isinstance(zona.coordenadas_zona, dict)] + [0.0]
+    )
+
+    resultado = {'creadas': 0, 'actualizadas': 0, 'cubiertas': 0, 'zonas': []}
+    usadas = set()
+    ahora = timezone.now()
+    with transaction.atomic():
+        for grupo in grupos:
+            existente = cubierta = None
+            alcance = max(radio_maximo, grupo['radio_km'])
+            for entrada in indice.candidatas(grupo['lat'], grupo['lng'], alcance):
+                orden, zona, lat_rad, lng_rad, _ = entrada
+                if orden in indice.poligonos:
+                    # Zona con polígono: el grupo la toca
+                    distancia = indice.distancia(
+                        entrada, math.radians(grupo['lat']), math.radians(grupo['lng']), grupo['radio_km']
+                    )
+                    if distancia > grupo['radio_km']:
+                        continue
+                else:
+                    radio = float(zona.coordenadas_zona.get('radio_km') or settings.RIESGO_RADIO_ZONA_KM)
+                    if not _contiene(math.degrees(lat_rad), math.degrees(lng_rad), max(radio, grupo['radio_km']),
+                                     grupo['lat'], grupo['lng']):
+                        continue
+                if zona.coordenadas_zona.get('origen') == ORIGEN:
+                    if existente is None and zona.id not in usadas:
+                        existente = zona
+                else:
+                    cubierta = zona
+
+            if existente is None and cubierta is not None:
+                resultado['cubiertas'] += 1
+                resultado['zonas'].append(('cubierta', grupo))
+                continue
+
+            zona = existente or EstadisticaRiesgo(nombre_zona=f"Punto caliente {grupo['lat']:.4f}, {grupo['lng']:.4f}")
+            zona.coordenadas_zona = {
+                'center': {'lat': round(grupo['lat'], 6), 'lng': round(grupo['lng'], 6)},
+                'radio_km': round(grupo['radio_km'], 3),
+                'origen': ORIGEN,
+            }
+            for campo in ('total_alertas', 'alertas_panico', 'alertas_accidente', 'intensidad_alertas'):
+                setattr(zona, campo, grupo[campo])
+            zona.puntuacion_riesgo = puntuacion_para_intensidad(grupo['intensidad_alertas'], ahora)
+            zona.periodo_inicio = timezone.localdate(grupo['primera'])
+            zona.periodo_fin = timezone.localdate(grupo['ultima'])
+
+            accion = 'actualizada' if existente else 'creada'
+            resultado['actualizadas' if existente else 'creadas'] += 1
+            resultado['zonas'].append((accion, grupo))
+            if not simular:
+                zona.save()
+                usadas.add(zona.id)
+
+        if simular:
+            transaction.set_rollback(True)
+    return resultado
+
+
+def _leer_alertas(resumen, completo, lote):
+    """
+    Sumar al resumen las alertas posteriores a su marca menos el margen (o
+    todas), sin repetir las que ya sumó
+
+    Returns:
+        int: alertas leídas
+    """
+    from .models import Alerta
+
+    margen = timedelta(seconds=settings.PUNTOS_CALIENTES_MARGEN_S)
+    alertas = Alerta.objects.exclude(estado__in=ESTADOS_DESCARTADOS)
+    if resumen.marca and not completo:
+        alertas = alertas.filter(creado_en__gt=resumen.marca - margen)
+    filas = alertas.order_by().values_list('id', 'latitud', 'longitud', 'tipo', 'creado_en').iterator(chunk_size=lote)
+
+    leidas = 0
+    while True:
+        bloque = [fila for _, fila in zip(range(lote), filas)]
+        if not bloque:
+            break
+        bloque = [fila for fila in bloque if str(fila[0]) not in resumen.recientes]
+        if not bloque:
+            continue
+        leidas += len(bloque)
+
+        latitudes = np.array([float(fila[1]) for fila in bloque])
+        longitudes = np.array([float(fila[2]) for fila in bloque])
+        panico = np.array([fila[3] == 'panico' for fila in bloque])
+        aportes = np.array([peso_alerta(fila[3]) * factor_tiempo(fila[4]) for fila in bloque])
+        instantes = np.array([fila[4].timestamp() for fila in bloque])
+        resumen.agregar(latitudes, longitudes, panico, aportes, instantes)
+        resumen.recientes.update((str(fila[0]), fila[4].timestamp()) for fila in bloque)
+
+        ultima = max(fila[4] for fila in bloque)
+        if resumen.marca is None or ultima > resumen.marca:
+            resumen.marca = ultima
+
+    # Solo hace falta recordar las alertas que la siguiente ejecución vuelve a leer
+    if resumen.marca is not None:
+        limite = (resumen.marca - margen).timestamp()
+        resumen.recientes = {id_alerta: instante for id_alerta, instante in resumen.recientes.items()
+                             if instante > limite}
+    return leidas
+
+
+def actualizar_puntos_calientes(directorio=None, completo=False, simular=False, eps_m=None, minimo_alertas=None,
+                                lote=50000):
+    """
+    Sumar las alertas nuevas al resumen de celdas, agrupar y sincronizar las zonas
+
+    Args:
+        completo: volver a leer todas las alertas en lugar de solo las nuevas
+        simular: no guardar zonas ni el resumen
+
+    Returns:
+        dict: alertas leídas, celdas, grupos y el resultado de sincronizar_zonas
+    """
+    directorio = Path(directorio or settings.PUNTOS_CALIENTES_DIR)
+    directorio.mkdir(parents=True, exist_ok=True)
+    eps_m = eps_m or settings.PUNTOS_CALIENTES_EPS_M
+    minimo_alertas = minimo_alertas or settings.PUNTOS_CALIENTES_MINIMO_ALERTAS
+
+    with open(directorio / '.agrupamiento.lock', 'w') as candado:
+        if fcntl is not None:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+
+        resumen = None if completo else ResumenCeldas.cargar(directorio)
+        nuevo = ResumenCeldas.para_eps(eps_m)
+        # Con otro EPS las celdas guardadas ya no sirven
+        if resumen is None or not math.isclose(resumen.celda_grados, nuevo.celda_grados):
+            resumen, completo = nuevo, True
+
+        leidas = _leer_alertas(resumen, completo, lote)
+        grupos = resumir_grupos(resumen, agrupar(resumen, eps_m, minimo_alertas))
+        resultado = sincronizar_zonas(grupos, simular)
+        if not simular:
+            resumen.guardar(directorio)
+
+    return dict(resultado, alertas=leidas, celdas=len(resumen), grupos=len(grupos), completo=completo)
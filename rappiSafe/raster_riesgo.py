@@ -0,0 +1,527 @@
+"""
+Ráster precalculado del riesgo de las zonas, compartido por todos los procesos.
+
+Las zonas de EstadisticaRiesgo cambian poco, pero cada puntuación de ruta
+calculaba otra vez las distancias a las zonas. El ráster guarda, para cada
+celda de una rejilla fija de la ciudad (50 m por defecto), lo que aportan a
+un punto en esa celda las zonas dentro de 3 km:
+
+- suma de las puntuaciones punto-zona, cuántas aportan y la mayor de ellas
+
+y en una rejilla más gruesa (5×5 celdas) la distancia y la puntuación de la
+zona más cercana a 10 km o menos, para las rutas que no pasan por ninguna zona.
+Con eso puntuar un punto es leer una celda de un arreglo.
+
+Cada versión se escribe como archivos .npy en RASTER_RIESGO_DIR y los procesos
+los abren con np.load(mmap_mode='r'): el sistema operativo comparte las
+páginas entre todos los workers de Daphne y ninguno carga la tabla de zonas.
+La versión es la huella de la tabla; cuando las zonas cambian se reconstruye
+en segundo plano y, mientras tanto, la puntuación usa el cálculo exacto. Si
+solo cambiaron las puntuaciones (alertas agregadas, la franja horaria) se
+sigue usando el ráster anterior hasta que el nuevo esté listo: la versión se
+revisa cada RASTER_RIESGO_TTL segundos, así que una ráfaga de alertas
+provoca a lo más una reconstrucción por periodo.
+
+Las puntuaciones son las de la hora actual (riesgo_horario): la franja de la
+semana entra en la versión, así que al empezar cada hora el ráster se
+reconstruye con las puntuaciones de esa hora.
+
+Las zonas con polígono se rasterizan con la distancia de cada centro de celda
+al polígono (0 dentro), en la ventana de su caja envolvente más el radio.
+Medir esas distancias es lo caro de la reconstrucción y las geometrías casi
+nunca cambian (las puntuaciones sí, con cada alerta), así que las ventanas de
+distancias de cada polígono se reutilizan en la siguiente reconstrucción.
+
+Las distancias se miden al centro de la celda, así que la puntuación puede
+diferir en 0.1 del cálculo exacto, o algo más si la zona más peligrosa queda
+justo en el umbral (5 o 7) que cambia la ponderación. Por eso las rutas solo
+se puntúan con el ráster si RASTER_RIESGO_ACTIVO=True; sin eso el ráster solo
+se mantiene para el riesgo de las aristas del grafo vial (RUTAS_GRAFO_ARCHIVO),
+donde basta una aproximación.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .indice_espacial import RADIO_TIERRA_KM, IndiceZonas, huella_puntuaciones, huella_zonas
+from .riesgo_horario import franja_actual, perfiles_horarios
+from .riesgo_vectorizado import _puntos_validos, zonas_vectorizadas
+from .utils import (
+    RADIO_INFLUENCIA_KM, RADIO_RESPALDO_KM, combinar_puntuaciones, riesgo_fuera_de_zonas, riesgo_sin_zonas
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+METROS_POR_GRADO = RADIO_TIERRA_KM * 1000 * math.pi / 180
+# Celdas finas por lado de cada celda de la rejilla de zona más cercana
+FACTOR_CERCANIA = 5
+ARCHIVO_ACTUAL = 'actual.json'
+
+# Canales de la rejilla fina
+SUMA, CONTEO, MAXIMA = 0, 1, 2
+# Canales de la rejilla de zona más cercana
+DISTANCIA, PUNTUACION = 0, 1
+
+# Distancias de las celdas a cada polígono de la última reconstrucción, por
+# (geometría, radio, ventana de celdas)
+_distancias_poligonos = {}
+
+
+def version_de(huella):
+    return hashlib.sha1(json.dumps([str(valor) for valor in huella]).encode()).hexdigest()[:12]
+
+
+def huella_raster(geometria=None):
+    """
+    Huella de las zonas (`geometria`, la de huella_zonas, y la de sus
+    puntuaciones) más la franja horaria de las puntuaciones
+    """
+    return (geometria or huella_zonas()) + huella_puntuaciones() + (franja_actual(),)
+
+
+def raster_en_uso():
+    """
+    El ráster compartido se mantiene si puntúa las rutas o si hay grafo vial
+    """
+    return settings.RASTER_RIESGO_ACTIVO or bool(settings.RUTAS_GRAFO_ARCHIVO)
+
+
+def _directorio():
+    return Path(settings.RASTER_RIESGO_DIR)
+
+
+def _distancias(lat_celdas, lng_celdas, lat_zona, lng_zona, cos_zona):
+    """
+    Distancia Haversine (km) de los centros de una ventana de celdas
+    (filas × columnas, en radianes) al centro de una zona
+    """
+    dlat = lat_zona - lat_celdas[:, np.newaxis]
+    dlon = lng_zona - lng_celdas[np.newaxis, :]
+    a = np.sin(dlat / 2) ** 2 + (np.cos(lat_celdas)[:, np.newaxis] * cos_zona) * np.sin(dlon / 2) ** 2
+    return RADIO_TIERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class RasterRiesgo:
+    """
+    Una versión del ráster: arreglos (posiblemente mapeados en memoria) y su geometría
+    """
+
+    def __init__(self, datos, cercania, meta):
+        self.datos = datos
+        self.cercania = cercania
+        self.meta = meta
+        self.version = meta['version']
+        self.total = meta['total']
+        self.lat_min = meta['lat_min']
+        self.lng_min = meta['lng_min']
+        self.paso_lat = meta['paso_lat']
+        self.paso_lng = meta['paso_lng']
+        self.filas, self.columnas = datos.shape[1:]
+
+    @classmethod
+    def abrir(cls, directorio=None):
+        """
+        Abrir la versión actual del directorio en modo solo lectura (mmap)
+
+        Raises:
+            OSError, ValueError, KeyError: si no hay ráster o está incompleto
+        """
+        directorio = Path(directorio or _directorio())
+        with open(directorio / ARCHIVO_ACTUAL, encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+        datos = np.load(directorio / meta['archivo'], mmap_mode='r')
+        cercania = np.load(directorio / meta['archivo_cercania'], mmap_mode='r')
+        return cls(datos, cercania, meta)
+
+    def _indices(self, lat, lng):
+        """
+        Fila y columna (rejilla fina) de puntos en grados, y cuáles caen dentro
+        """
+        filas = np.floor((lat - self.lat_min) / self.paso_lat).astype(np.int64)
+        columnas = np.floor((lng - self.lng_min) / self.paso_lng).astype(np.int64)
+        dentro = (filas >= 0) & (filas < self.filas) & (columnas >= 0) & (columnas < self.columnas)
+        return filas, columnas, dentro
+
+    def _celdas(self, lat, lng):
+        filas, columnas, dentro = self._indices(lat, lng)
+        return filas[dentro], columnas[dentro]
+
+    def consultar(self, lat, lng):
+        """
+        (suma, conteo, máxima) de las zonas a 3 km o menos de un punto
+        """
+        filas, columnas = self._celdas(np.array([float(lat)]), np.array([float(lng)]))
+        if not len(filas):
+            return 0.0, 0, 0.0
+        celda = self.datos[:, filas[0], columnas[0]]
+        return float(celda[SUMA]), int(celda[CONTEO]), float(celda[MAXIMA])
+
+    def maximas(self, lat, lng):
+        """
+        Mayor aporte de una zona (0 a 10) en cada punto; arreglos en grados.
+        Los puntos fuera de la rejilla no tienen zonas cerca y valen 0.
+        """
+        filas, columnas, dentro = self._indices(np.asarray(lat, dtype=float), np.asarray(lng, dtype=float))
+        resultado = np.zeros(len(filas), dtype=np.float32)
+        resultado[dentro] = self.datos[MAXIMA, filas[dentro], columnas[dentro]]
+        return resultado
+
+    def puntuar(self, coordenadas):
+        """
+        Puntuación de riesgo de una ruta con las mismas reglas que
+        utils.calcular_puntuacion_riesgo, leyendo las celdas de sus puntos
+        """
+        if not self.total:
+            return riesgo_sin_zonas(len(coordenadas))
+
+        lat, lng = _puntos_validos(coordenadas)
+        # Fuera de la rejilla no hay zonas a 10 km o menos: no aportan nada
+        filas, columnas = self._celdas(np.degrees(lat), np.degrees(lng))
+
+        conteo = int(self.datos[CONTEO, filas, columnas].sum()) if len(filas) else 0
+        if conteo:
+            suma = float(self.datos[SUMA, filas, columnas].sum(dtype=np.float64))
+            maxima = float(self.datos[MAXIMA, filas, columnas].max())
+            return combinar_puntuaciones(maxima, suma / conteo)
+
+        puntuacion_cercana, distancia_minima = None, math.inf
+        if len(filas):
+            distancias = self.cercania[DISTANCIA, filas // FACTOR_CERCANIA, columnas // FACTOR_CERCANIA]
+            posicion = int(np.argmin(distancias))
+            if math.isfinite(distancias[posicion]):
+                distancia_minima = float(distancias[posicion])
+                puntuacion_cercana = float(
+                    self.cercania[PUNTUACION, filas[posicion] // FACTOR_CERCANIA, columnas[posicion] // FACTOR_CERCANIA]
+                )
+        return riesgo_fuera_de_zonas(puntuacion_cercana, distancia_minima, len(coordenadas))
+
+
+def construir_raster(zonas, tamano_celda_m=None, maximo_celdas=None, franja=None):
+    """
+    Rasterizar las zonas en memoria
+
+    Args:
+        zonas: QuerySet/lista de EstadisticaRiesgo o IndiceZonas
+        tamano_celda_m: lado de la celda en metros (por defecto RASTER_RIESGO_CELDA_M)
+        maximo_celdas: si la rejilla excede este número de celdas se agranda la celda
+        franja: franja de la semana de las puntuaciones (None: puntuacion_riesgo de cada zona)
+
+    Returns:
+        tuple: (datos, cercania, meta) sin 'version' ni nombres de archivo
+    """
+    tamano_celda_m = tamano_celda_m or settings.RASTER_RIESGO_CELDA_M
+    maximo_celdas = maximo_celdas or settings.RASTER_RIESGO_MAXIMO_CELDAS
+
+    indice = zonas if isinstance(zonas, IndiceZonas) else IndiceZonas(zonas)
+    vectorizadas = zonas_vectorizadas(indice)
+    puntuacion_zonas = vectorizadas.puntuacion_en(franja, perfiles_horarios(indice) if franja is not None else None)
+    validas = np.flatnonzero(np.isfinite(puntuacion_zonas))
+    # Caja de cada zona en grados (un punto para los círculos)
+    caja_lat_min = np.degrees(vectorizadas.caja_lat - vectorizadas.medio_alto)[validas]
+    caja_lat_max = np.degrees(vectorizadas.caja_lat + vectorizadas.medio_alto)[validas]
+    caja_lng_min = np.degrees(vectorizadas.caja_lng - vectorizadas.medio_ancho)[validas]
+    caja_lng_max = np.degrees(vectorizadas.caja_lng + vectorizadas.medio_ancho)[validas]
+
+    meta = {'total': indice.total, 'zonas': len(validas), 'celda_m': tamano_celda_m, 'franja': franja}
+    if not len(validas):
+        meta.update(lat_min=0.0, lng_min=0.0, paso_lat=1.0, paso_lng=1.0)
+        return np.zeros((3, 0, 0), dtype=np.float32), np.zeros((2, 0, 0), dtype=np.float32), meta
+
+    # Extensión: las zonas más el radio de respaldo (10 km), que es lo más lejos que una zona cuenta
+    margen = math.degrees(RADIO_RESPALDO_KM / RADIO_TIERRA_KM) * 1.01
+    lat_min = caja_lat_min.min() - margen
+    lat_max = caja_lat_max.max() + margen
+    lng_min = caja_lng_min.min()
+    lng_max = caja_lng_max.max()
+    cos_extremo = max(math.cos(math.radians(max(abs(lat_min), abs(lat_max)))), 1e-6)
+    margen_lng = margen / cos_extremo
+    lng_min, lng_max = lng_min - margen_lng, lng_max + margen_lng
+
+    while True:
+        paso_lat = tamano_celda_m / METROS_POR_GRADO
+        paso_lng = paso_lat / cos_extremo
+        # Número de celdas múltiplo del factor para que ambas rejillas coincidan
+        filas = math.ceil((lat_max - lat_min) / paso_lat / FACTOR_CERCANIA) * FACTOR_CERCANIA
+        columnas = math.ceil((lng_max - lng_min) / paso_lng / FACTOR_CERCANIA) * FACTOR_CERCANIA
+        if filas * columnas <= maximo_celdas:
+            break
+        anterior = tamano_celda_m
+        tamano_celda_m = tamano_celda_m * math.sqrt(filas * columnas / maximo_celdas) * 1.01
+        logger.warning('Ráster de riesgo demasiado grande con celdas de %.0f m; se usan celdas de %.0f m',
+                       anterior, tamano_celda_m)
+
+    meta.update(lat_min=lat_min, lng_min=lng_min, paso_lat=paso_lat, paso_lng=paso_lng, celda_m=tamano_celda_m)
+
+    datos = np.zeros((3, filas, columnas), dtype=np.float32)
+    cercania = np.full((2, filas // FACTOR_CERCANIA, columnas // FACTOR_CERCANIA), np.inf, dtype=np.float32)
+    cercania[PUNTUACION] = np.nan
+
+    # Centros de las celdas en radianes
+    lat_centros = np.radians(lat_min + (np.arange(filas) + 0.5) * paso_lat)
+    lng_centros = np.radians(lng_min + (np.arange(columnas) + 0.5) * paso_lng)
+    paso_grueso_lat = paso_lat * FACTOR_CERCANIA
+    paso_grueso_lng = paso_lng * FACTOR_CERCANIA
+    lat_gruesas = np.radians(lat_min + (np.arange(filas // FACTOR_CERCANIA) + 0.5) * paso_grueso_lat)
+    lng_gruesas = np.radians(lng_min + (np.arange(columnas // FACTOR_CERCANIA) + 0.5) * paso_grueso_lng)
+
+    def ventana(caja, radio_km, paso_a, paso_b, num_filas, num_columnas):
+        delta = math.degrees(radio_km / RADIO_TIERRA_KM)
+        lat_0, lat_1, lng_0, lng_1 = caja
+        f0 = max(0, math.floor((lat_0 - delta - lat_min) / paso_a) - 1)
+        f1 = min(num_filas, math.floor((lat_1 + delta - lat_min) / paso_a) + 2)
+        c0 = max(0, math.floor((lng_0 - delta / cos_extremo - lng_min) / paso_b) - 1)
+        c1 = min(num_columnas, math.floor((lng_1 + delta / cos_extremo - lng_min) / paso_b) + 2)
+        return slice(f0, f1), slice(c0, c1)
+
+    global _distancias_poligonos
+    anteriores, reutilizables = _distancias_poligonos, {}
+
+    def distancias_zona(columna, lat_celdas, lng_celdas, radio_km):
+        poligono = vectorizadas.poligonos.get(columna)
+        if poligono is None:
+            return _distancias(
+                lat_celdas, lng_celdas,
+                vectorizadas.lat[columna], vectorizadas.lng[columna], vectorizadas.cos_lat[columna]
+            )
+        clave = (
+            poligono.clave, radio_km,
+            len(lat_celdas), float(lat_celdas[0]), float(lat_celdas[-1]),
+            len(lng_celdas), float(lng_celdas[0]), float(lng_celdas[-1]),
+        )
+        distancia = anteriores.get(clave)
+        if distancia is None:
+            malla_lat, malla_lng = np.meshgrid(np.degrees(lat_celdas), np.degrees(lng_celdas), indexing='ij')
+            distancia = poligono.distancias_km(malla_lat.ravel(), malla_lng.ravel(), radio_km)
+            distancia = distancia.reshape(malla_lat.shape).astype(np.float32)
+        reutilizables[clave] = distancia
+        return distancia
+
+    for posicion, columna in enumerate(validas):
+        caja = (caja_lat_min[posicion], caja_lat_max[posicion], caja_lng_min[posicion], caja_lng_max[posicion])
+        puntuacion = puntuacion_zonas[columna]
+
+        # Aporte dentro de 3 km con el mismo sistema de zonas concéntricas
+        filas_v, columnas_v = ventana(caja, RADIO_INFLUENCIA_KM, paso_lat, paso_lng, filas, columnas)
+        distancia = distancias_zona(columna, lat_centros[filas_v], lng_centros[columnas_v], RADIO_INFLUENCIA_KM)
+        factor = np.where(
+            distancia <= 1.0,
+            1.0 - (distancia * 0.3),
+            np.where(distancia <= 2.0, 0.7 - ((distancia - 1.0) * 0.3), 0.4 - ((distancia - 2.0) * 0.4))
+        )
+        aporte = puntuacion * np.maximum(0.0, factor)
+        aporta = (distancia <= RADIO_INFLUENCIA_KM) & (aporte > 0)
+        aporte = np.where(aporta, aporte, 0.0)
+        datos[SUMA, filas_v, columnas_v] += aporte
+        datos[CONTEO, filas_v, columnas_v] += aporta
+        np.maximum(datos[MAXIMA, filas_v, columnas_v], aporte, out=datos[MAXIMA, filas_v, columnas_v])
+
+        # Zona más cercana a 10 km o menos (la primera en el orden de las zonas en empates)
+        filas_v, columnas_v = ventana(
+            caja, RADIO_RESPALDO_KM, paso_grueso_lat, paso_grueso_lng, len(lat_gruesas), len(lng_gruesas)
+        )
+        distancia = distancias_zona(columna, lat_gruesas[filas_v], lng_gruesas[columnas_v], RADIO_RESPALDO_KM)
+        mas_cercana = (distancia < RADIO_RESPALDO_KM) & (distancia < cercania[DISTANCIA, filas_v, columnas_v])
+        cercania[DISTANCIA, filas_v, columnas_v][mas_cercana] = distancia[mas_cercana]
+        cercania[PUNTUACION, filas_v, columnas_v][mas_cercana] = puntuacion
+
+    # Solo se conservan las de las zonas vigentes
+    _distancias_poligonos = reutilizables
+    return datos, cercania, meta
+
+
+def _guardar_atomico(ruta, escribir):
+    temporal = ruta.with_name(f'{ruta.name}.{os.getpid()}.tmp')
+    with open(temporal, 'wb') as archivo:
+        escribir(archivo)
+    os.replace(temporal, ruta)
+
+
+def guardar_raster(datos, cercania, meta, version, directorio=None):
+    """
+    Escribir una versión y apuntar 'actual.json' a ella (reemplazo atómico, los
+    procesos que tengan abierta la versión anterior la siguen leyendo)
+    """
+    directorio = Path(directorio or _directorio())
+    directorio.mkdir(parents=True, exist_ok=True)
+
+    meta = dict(meta, version=version, archivo=f'riesgo-{version}.npy', archivo_cercania=f'cercania-{version}.npy')
+    _guardar_atomico(directorio / meta['archivo'], lambda archivo: np.save(archivo, datos))
+    _guardar_atomico(directorio / meta['archivo_cercania'], lambda archivo: np.save(archivo, cercania))
+    _guardar_atomico(directorio / ARCHIVO_ACTUAL, lambda archivo: archivo.write(json.dumps(meta).encode('utf-8')))
+
+    # Borrar versiones viejas; en Linux los mapeos abiertos siguen siendo válidos
+    for viejo in directorio.glob('*.npy'):
+        if version not in viejo.name:
+            try:
+                viejo.unlink()
+            except OSError:
+                pass
+    return meta
+
+
+def reconstruir_raster(directorio=None, forzar=False):
+    """
+    Reconstruir el ráster con las zonas actuales si su versión cambió.
+    Un candado de archivo evita que varios procesos lo construyan a la vez.
+
+    Returns:
+        str | None: versión escrita, o None si la actual ya estaba al día
+    """
+    from .models import EstadisticaRiesgo
+
+    directorio = Path(directorio or _directorio())
+    directorio.mkdir(parents=True, exist_ok=True)
+
+    with open(directorio / '.construccion.lock', 'w') as candado:
+        if fcntl is not None:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+
+        # La huella se toma antes de leer las zonas: si cambian durante la
+        # construcción, la versión escrita queda vieja y se vuelve a construir
+        geometria = huella_zonas()
+        huella = huella_raster(geometria)
+        version = version_de(huella)
+        if not forzar:
+            try:
+                if RasterRiesgo.abrir(directorio).version == version:
+                    return None
+            except (OSError, ValueError, KeyError):
+                pass
+
+        inicio = time.monotonic()
+        datos, cercania, meta = construir_raster(EstadisticaRiesgo.objects.all(), franja=huella[-1])
+        guardar_raster(datos, cercania, dict(meta, geometria=version_de(geometria)), version, directorio)
+        logger.info('Ráster de riesgo %s construido (%s×%s celdas de %.0f m, %s zonas) en %.1f s',
+                    version, datos.shape[1], datos.shape[2], meta['celda_m'], meta['zonas'],
+                    time.monotonic() - inicio)
+        return version
+
+
+class RasterCompartido:
+    """
+    Ráster vigente del proceso: se revisa cada RASTER_RIESGO_TTL segundos que
+    su versión coincida con la huella de la tabla de zonas
+    """
+
+    def __init__(self):
+        self._raster = None
+        self._revisado_en = None
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        """
+        Returns:
+            RasterRiesgo | None: None si no está en uso o no está al día
+        """
+        if not raster_en_uso():
+            return None
+
+        with self._lock:
+            ahora = time.monotonic()
+            if self._revisado_en is not None and ahora - self._revisado_en < settings.RASTER_RIESGO_TTL:
+                return self._raster
+            self._revisado_en = ahora
+
+            geometria = huella_zonas()
+            version = version_de(huella_raster(geometria))
+            if self._raster is None or self._raster.version != version:
+                try:
+                    raster = RasterRiesgo.abrir()
+                except (OSError, ValueError, KeyError):
+                    raster = None
+                if raster is None or raster.version != version:
+                    constructor_raster.programar()
+                    # Con la misma geometría solo cambiaron las puntuaciones: el anterior sirve mientras tanto
+                    anterior = raster or self._raster
+                    vigente = anterior is not None and anterior.meta.get('geometria') == version_de(geometria)
+                    raster = anterior if vigente else None
+                self._raster = raster
+            return self._raster
+
+    def invalidar(self):
+        with self._lock:
+            self._raster = None
+            self._revisado_en = None
+
+
+class ConstructorRaster:
+    """
+    Hilo en segundo plano que reconstruye el ráster; las solicitudes que
+    llegan seguidas (por ejemplo al importar muchas zonas) se agrupan
+    """
+
+    def __init__(self, espera=None):
+        self.espera = espera
+        self._pendiente = False
+        self._hilo = None
+        self._condicion = threading.Condition()
+
+    def programar(self):
+        with self._condicion:
+            self._pendiente = True
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._ciclo, name='raster-riesgo', daemon=True)
+                self._hilo.start()
+            self._condicion.notify()
+
+    def _ciclo(self):
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._pendiente)
+            time.sleep(self.espera if self.espera is not None else settings.RASTER_RIESGO_ESPERA)
+            with self._condicion:
+                self._pendiente = False
+
+            try:
+                reconstruir_raster()
+            except Exception:
+                logger.exception('Error al construir el ráster de riesgo')
+            finally:
+                close_old_connections()
+                raster_compartido.invalidar()
+
+
+raster_compartido = RasterCompartido()
+constructor_raster = ConstructorRaster()
+
+
+def obtener_raster():
+    return raster_compartido.obtener()
+
+
+def raster_en_memoria():
+    """
+    Ráster de las zonas actuales construido en este proceso, sin escribirlo.
+    Para quien necesita el campo de riesgo aunque el ráster compartido todavía
+    no exista (por ejemplo el grafo vial la primera vez que se carga).
+    """
+    from .indice_espacial import obtener_indice_zonas
+
+    geometria = huella_zonas()
+    huella = huella_raster(geometria)
+    datos, cercania, meta = construir_raster(obtener_indice_zonas(), franja=huella[-1])
+    version = version_de(huella)
+    return RasterRiesgo(datos, cercania, dict(meta, version=version, geometria=version_de(geometria)))
+
+
+def raster_zonas_cambiaron():
+    """
+    Llamado cuando cambian las zonas: dejar de usar el ráster viejo y programar uno nuevo
+    """
+    raster_compartido.invalidar()
+    if raster_en_uso():
+        constructor_raster.programar()
@@ -0,0 +1,201 @@
+"""
+Perfil de riesgo por hora de la semana de cada zona.
+
+El riesgo de una zona a las 2 pm no es el de las 2 am, pero
+puntuacion_riesgo es un solo número. Cada zona guarda además en
+perfil_horario la intensidad de sus alertas por franja de la semana (7 días ×
+24 horas, según la hora local de Alerta.creado_en), con el mismo peso y
+decaimiento que intensidad_alertas. Son 168 float64 empaquetados en un solo
+campo binario de la fila de la zona: leer las zonas ya trae los perfiles, sin
+consultas por franja ni filas adicionales. agregacion_riesgo suma cada alerta
+en su franja y recalcular_zonas los reconstruye desde el histórico.
+
+Puntuación por franja
+---------------------
+El factor de una franja es su intensidad contra el promedio de la semana,
+suavizado con RIESGO_HORARIO_PREVIO alertas repartidas parejo entre las 168
+franjas para que una zona con pocas alertas no quede en 0 o en 10 por una
+sola:
+
+    factor = (perfil[franja] + previo/168) / ((Σ perfil + previo) / 168)
+
+y la puntuación de la franja es la de la zona con su intensidad multiplicada
+por ese factor (la misma curva 1-10 de agregacion_riesgo). El promedio de los
+factores es 1 y una zona sin perfil conserva su puntuación en todas las horas.
+
+Las puntuaciones de todas las zonas en todas las franjas se calculan una vez
+por versión del índice espacial (una matriz zonas × 168), así que consultar
+la hora actual es leer una columna o una celda. riesgo_en_punto, que corre en
+la respuesta de cada alerta, no arma esa matriz: si todavía no existe calcula
+solo las filas de las zonas del punto.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .agregacion_riesgo import PUNTUACION_MAXIMA, PUNTUACION_MINIMA, factor_tiempo
+
+DIAS, HORAS = 7, 24
+FRANJAS = DIAS * HORAS
+# 168 float64 little-endian: 1344 bytes por zona
+TIPO_PERFIL = np.dtype('<f8')
+
+
+def franja_de(momento):
+    """
+    Franja de la semana (lunes 0 h = 0 ... domingo 23 h = 167) en hora local
+    """
+    local = timezone.localtime(momento)
+    return local.weekday() * HORAS + local.hour
+
+
+def franja_actual():
+    """
+    Franja de ahora, o None si el riesgo por hora está desactivado
+    """
+    if not settings.RIESGO_HORARIO_ACTIVO:
+        return None
+    return franja_de(timezone.now())
+
+
+def desempaquetar(datos):
+    """
+    Perfil guardado como arreglo de 168 intensidades (ceros si no hay o no es válido)
+    """
+    if datos:
+        perfil = np.frombuffer(bytes(datos), dtype=TIPO_PERFIL)
+        if perfil.shape == (FRANJAS,):
+            return perfil.astype(float)
+    return np.zeros(FRANJAS)
+
+
+def empaquetar(perfil):
+    return np.asarray(perfil, dtype=TIPO_PERFIL).tobytes()
+
+
+def puntuaciones_por_franja(puntuaciones, perfiles, ahora=None):
+    """
+    Puntuación de cada zona en cada franja
+
+    Args:
+        puntuaciones: arreglo (n,) con la puntuación de cada zona (NaN si no es válida)
+        perfiles: arreglo (n, 168) de intensidades normalizadas
+
+    Returns:
+        np.ndarray: (n, 168)
+    """
+    ahora = ahora or timezone.now()
+    perfiles = np.maximum(perfiles, 0.0)
+    totales = perfiles.sum(axis=1, keepdims=True)
+    previo = settings.RIESGO_HORARIO_PREVIO * factor_tiempo(ahora)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factores = (perfiles + previo / FRANJAS) / ((totales + previo) / FRANJAS)
+    factores = np.where(totales > 0, factores, 1.0)
+
+    # Intensidad actual equivalente a la puntuación (la inversa de la curva 1-10)
+    rango = PUNTUACION_MAXIMA - PUNTUACION_MINIMA
+    escala = settings.RIESGO_ESCALA_ALERTAS
+    fraccion = np.clip((puntuaciones[:, np.newaxis] - PUNTUACION_MINIMA) / rango, 0.0, 0.99)
+    intensidad = -escala * np.log1p(-fraccion) * factores
+    resultado = np.round(PUNTUACION_MINIMA + rango * (1 - np.exp(-intensidad / escala)), 1)
+
+    # Sin perfil, la puntuación de la zona tal cual (la ida y vuelta por la curva la redondearía)
+    resultado = np.where(totales > 0, resultado, puntuaciones[:, np.newaxis])
+    return resultado
+
+
+def _datos_zona(zona):
+    """
+    (puntuación, perfil) de una zona, o None si su puntuación no es válida
+    """
+    try:
+        puntuacion = float(zona.puntuacion_riesgo)
+    except (TypeError, ValueError):
+        return None
+    return puntuacion, desempaquetar(zona.perfil_horario)
+
+
+class PerfilesHorarios:
+    """
+    Matriz de puntuaciones zonas × franjas de un índice espacial, por el
+    `orden` de cada entrada
+    """
+
+    def __init__(self, indice, ahora=None):
+        self.filas = {}
+        puntuaciones = np.full(indice.total, math.nan)
+        perfiles = np.zeros((indice.total, FRANJAS))
+        for orden, zona, *_ in indice.entradas:
+            self.filas[zona.id] = orden
+            datos = _datos_zona(zona)
+            if datos is not None:
+                puntuaciones[orden], perfiles[orden] = datos
+        self.base = puntuaciones
+        self.matriz = puntuaciones_por_franja(puntuaciones, perfiles, ahora)
+
+    def columna(self, franja):
+        """
+        Puntuación de todas las zonas en la franja, por orden
+        """
+        return self.matriz[:, franja]
+
+    def puntuacion(self, zona_id, franja):
+        """
+        Puntuación de una zona del índice en la franja (con franja None, la
+        de siempre), o None si no está o no es válida
+        """
+        orden = self.filas.get(zona_id)
+        if orden is None:
+            return None
+        valor = float(self.base[orden] if franja is None else self.matriz[orden, franja])
+        return valor if math.isfinite(valor) else None
+
+
+def perfiles_horarios(indice):
+    perfiles = indice.extras.get('perfiles_horarios')
+    if perfiles is None:
+        perfiles = indice.extras['perfiles_horarios'] = PerfilesHorarios(indice)
+    return perfiles
+
+
+def puntuacion_actual(zona, indice=None):
+    """
+    Puntuación de la zona en la hora actual (la de siempre si el riesgo por
+    hora está desactivado o la zona no está en el índice)
+    """
+    from .indice_espacial import obtener_indice_zonas
+
+    puntuacion = perfiles_horarios(indice or obtener_indice_zonas()).puntuacion(zona.id, franja_actual())
+    return zona.puntuacion_riesgo if puntuacion is None else puntuacion
+
+
+def riesgo_en_punto(latitud, longitud):
+    """
+    Mayor puntuación en la hora actual de las zonas que contienen el punto,
+    o None si no está en ninguna (para priorizar alertas)
+    """
+    from .agregacion_riesgo import entradas_de_punto
+    from .indice_espacial import obtener_indice_zonas
+
+    indice = obtener_indice_zonas()
+    try:
+        entradas = entradas_de_punto(latitud, longitud, indice)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+    franja = franja_actual()
+    perfiles = indice.extras.get('perfiles_horarios')
+    if perfiles is not None:
+        puntuaciones = [perfiles.puntuacion(entrada[1].id, franja) for entrada in entradas]
+        return max((puntuacion for puntuacion in puntuaciones if puntuacion is not None), default=None)
+
+    # Sin la matriz de todas las zonas, solo las filas de las del punto
+    datos = [dato for dato in (_datos_zona(entrada[1]) for entrada in entradas) if dato is not None]
+    if not datos:
+        return None
+    puntuaciones = np.array([puntuacion for puntuacion, _ in datos])
+    if franja is not None:
+        puntuaciones = puntuaciones_por_franja(puntuaciones, np.array([perfil for _, perfil in datos]))[:, franja]
+    return float(puntuaciones.max())
@@ -0,0 +1,288 @@
+"""
+Puntuación de riesgo de rutas vectorizada con NumPy.
+
+Hace lo mismo que utils.calcular_puntuacion_riesgo, pero en lugar de recorrer
+punto por punto convierte la ruta y las zonas a arreglos y calcula la matriz
+de distancias puntos × zonas por tramos de la ruta, cada uno solo contra las
+zonas de su caja envolvente. Las bandas de 1/2/3 km y la ponderación 70/60/50% se aplican con
+operaciones sobre arreglos. El resultado coincide con la versión escalar a la
+precisión reportada (0.1); solo cambia el orden de las sumas.
+
+Las zonas se toman del índice espacial compartido, así que los arreglos se
+construyen una vez por versión de las zonas. Para las zonas con polígono la
+ventana usa su caja envolvente y la columna de la matriz se reemplaza por la
+distancia al polígono. Las puntuaciones son las de la hora actual (ver
+riesgo_horario), una columna memorizada por franja.
+"""
+import math
+
+import numpy as np
+
+from .indice_espacial import RADIO_TIERRA_KM, MARGEN_GRADOS, indice_para
+from .riesgo_horario import franja_actual, perfiles_horarios
+from .utils import RADIO_INFLUENCIA_KM, RADIO_RESPALDO_KM, riesgo_fuera_de_zonas, riesgo_sin_zonas
+
+# Elementos máximos de la matriz de distancias por bloque (~16 MB por arreglo float64)
+ELEMENTOS_POR_BLOQUE = 2_000_000
+# Puntos consecutivos de la ruta que comparten el mismo filtro de zonas
+PUNTOS_POR_TRAMO = 256
+
+
+class ZonasVectorizadas:
+    """
+    Zonas válidas del índice como arreglos, en el orden original del QuerySet
+    """
+
+    def __init__(self, indice):
+        entradas = indice.entradas
+        self.ordenes = np.array([entrada[0] for entrada in entradas], dtype=int)
+        self.zonas = [entrada[1] for entrada in entradas]
+        self.lat = np.array([entrada[2] for entrada in entradas], dtype=float)
+        self.lng = np.array([entrada[3] for entrada in entradas], dtype=float)
+        self.cos_lat = np.array([entrada[4] for entrada in entradas], dtype=float)
+        self.puntuacion = np.array(
+            [_como_numero(zona.puntuacion_riesgo) for zona in self.zonas], dtype=float
+        )
+
+        # Caja envolvente (centro y medio lado, en radianes); en los círculos es el centro
+        self.poligonos = {}
+        self.caja_lat = self.lat.copy()
+        self.caja_lng = self.lng.copy()
+        self.medio_alto = np.zeros(len(entradas))
+        self.medio_ancho = np.zeros(len(entradas))
+        for columna, entrada in enumerate(entradas):
+            poligono = indice.poligonos.get(entrada[0])
+            if poligono is None:
+                continue
+            self.poligonos[columna] = poligono
+            self.caja_lat[columna] = math.radians((poligono.lat_min + poligono.lat_max) / 2)
+            self.caja_lng[columna] = math.radians((poligono.lng_min + poligono.lng_max) / 2)
+            self.medio_alto[columna] = math.radians((poligono.lat_max - poligono.lat_min) / 2)
+            self.medio_ancho[columna] = math.radians((poligono.lng_max - poligono.lng_min) / 2)
+        self.es_poligono = np.zeros(len(entradas), dtype=bool)
+        self.es_poligono[list(self.poligonos)] = True
+        self._por_franja = {}
+
+    def puntuacion_en(self, franja, perfiles):
+        """
+        Puntuación de las zonas en una franja de la semana (None: la de siempre)
+
+        Args:
+            perfiles: PerfilesHorarios del mismo índice
+        """
+        if franja is None:
+            return self.puntuacion
+        puntuacion = self._por_franja.get(franja)
+        if puntuacion is None:
+            puntuacion = self._por_franja[franja] = perfiles.columna(franja)[self.ordenes]
+        return puntuacion
+
+
+def _como_numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        # Una zona sin puntuación no aporta, igual que en la versión escalar
+        return math.nan
+
+
+def zonas_vectorizadas(indice):
+    zonas = indice.extras.get('vectorizadas')
+    if zonas is None:
+        zonas = indice.extras['vectorizadas'] = ZonasVectorizadas(indice)
+    return zonas
+
+
+def _puntos_validos(coordenadas):
+    """
+    Latitudes y longitudes en radianes de los puntos que la versión escalar
+    habría usado (los no numéricos o no finitos nunca aportaban)
+    """
+    latitudes = []
+    longitudes = []
+    for coord in coordenadas:
+        try:
+            lat = math.radians(coord[0])
+            lng = math.radians(coord[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if math.isfinite(lat) and math.isfinite(lng):
+            latitudes.append(lat)
+            longitudes.append(lng)
+    return np.array(latitudes, dtype=float), np.array(longitudes, dtype=float)
+
+
+def _zonas_en_ventana(zonas, lat, lng, radio_km):
+    """
+    Índices de las zonas que pueden quedar a `radio_km` o menos de algún
+    punto de la ruta (caja envolvente con las mismas cotas que el índice)
+    """
+    if not len(zonas.lat) or not len(lat):
+        return np.zeros(0, dtype=int)
+
+    angulo = radio_km / RADIO_TIERRA_KM
+    delta_lat = angulo + math.radians(MARGEN_GRADOS)
+    lat_min, lat_max = lat.min() - delta_lat, lat.max() + delta_lat
+    seleccion = (zonas.caja_lat + zonas.medio_alto >= lat_min) & (zonas.caja_lat - zonas.medio_alto <= lat_max)
+
+    lat_extrema = max(abs(lat_min), abs(lat_max))
+    if lat_extrema < math.pi / 2:
+        seno = math.sin(angulo / 2) / math.cos(lat_extrema)
+        if seno < 1:
+            delta_lng = 2 * math.asin(seno) + math.radians(MARGEN_GRADOS)
+            # Distancia angular en longitud con vuelta en ±180°
+            centro = (lng.max() + lng.min()) / 2
+            medio_ancho = (lng.max() - lng.min()) / 2 + delta_lng
+            if medio_ancho < math.pi:
+                diferencia = np.abs((zonas.caja_lng - centro + math.pi) % (2 * math.pi) - math.pi)
+                seleccion &= diferencia <= medio_ancho + zonas.medio_ancho
+    return np.flatnonzero(seleccion)
+
+
+def _distancias(lat_p, lng_p, lat_z, lng_z, cos_z):
+    """
+    Matriz de distancias Haversine (km) puntos × zonas
+    """
+    dlat = lat_z[np.newaxis, :] - lat_p[:, np.newaxis]
+    dlon = lng_z[np.newaxis, :] - lng_p[:, np.newaxis]
+    a = np.sin(dlat / 2) ** 2 + (np.cos(lat_p)[:, np.newaxis] * cos_z[np.newaxis, :]) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return RADIO_TIERRA_KM * c
+
+
+def _distancias_zonas(zonas, lat_p, lng_p, indices, radio_km):
+    """
+    Matriz de distancias (km) puntos × zonas `indices`, al borde en los
+    polígonos; más allá de `radio_km` la de un polígono es solo una cota
+    """
+    distancia = _distancias(lat_p, lng_p, zonas.lat[indices], zonas.lng[indices], zonas.cos_lat[indices])
+    if zonas.poligonos:
+        columnas = np.flatnonzero(zonas.es_poligono[indices])
+        if len(columnas):
+            lat_g, lng_g = np.degrees(lat_p), np.degrees(lng_p)
+            for columna in columnas:
+                distancia[:, columna] = zonas.poligonos[indices[columna]].distancias_km(lat_g, lng_g, radio_km)
+    return distancia
+
+
+def _tramos(zonas, lat, lng, radio_km):
+    """
+    Recorre la ruta en tramos de puntos consecutivos junto con las zonas que
+    pueden quedar dentro del radio de cada tramo. Como una ruta es continua,
+    la caja de un tramo es pequeña aunque la ruta cruce toda la ciudad.
+    """
+    for inicio in range(0, len(lat), PUNTOS_POR_TRAMO):
+        tramo = slice(inicio, inicio + PUNTOS_POR_TRAMO)
+        lat_t, lng_t = lat[tramo], lng[tramo]
+        indices = _zonas_en_ventana(zonas, lat_t, lng_t, radio_km)
+        if not len(indices):
+            continue
+        # Acotar la matriz puntos × zonas del tramo
+        paso = max(1, ELEMENTOS_POR_BLOQUE // len(indices))
+        for sub in range(0, len(lat_t), paso):
+            yield lat_t[sub:sub + paso], lng_t[sub:sub + paso], indices
+
+
+def _acumular_puntuaciones(zonas, lat, lng, puntuacion_zonas):
+    """
+    Suma, conteo y máximo de las puntuaciones punto-zona dentro de 3 km
+    """
+    suma, conteo, maxima = 0.0, 0, -math.inf
+
+    for lat_p, lng_p, indices in _tramos(zonas, lat, lng, RADIO_INFLUENCIA_KM):
+        distancia = _distancias_zonas(zonas, lat_p, lng_p, indices, RADIO_INFLUENCIA_KM)
+        dentro = distancia <= RADIO_INFLUENCIA_KM
+        if not dentro.any():
+            continue
+        distancia = distancia[dentro]
+        puntuacion_z = np.broadcast_to(puntuacion_zonas[indices], dentro.shape)[dentro]
+
+        # Sistema de zonas concéntricas: 0-1 km (1.0 a 0.7), 1-2 km (0.7 a 0.4), 2-3 km (0.4 a 0.0)
+        factor = np.where(
+            distancia <= 1.0,
+            1.0 - (distancia * 0.3),
+            np.where(distancia <= 2.0, 0.7 - ((distancia - 1.0) * 0.3), 0.4 - ((distancia - 2.0) * 0.4))
+        )
+        puntuacion = puntuacion_z * np.maximum(0.0, factor)
+        valores = puntuacion[puntuacion > 0]
+
+        if valores.size:
+            suma += float(valores.sum())
+            conteo += int(valores.size)
+            maxima = max(maxima, float(valores.max()))
+
+    return suma, conteo, maxima
+
+
+def _zona_mas_cercana(zonas, lat, lng):
+    """
+    Columna de la zona más cercana a 10 km o menos; en empates gana el
+    primer par (punto, zona) en orden de recorrido, como en la versión escalar
+    """
+    zona_mas_cercana, distancia_minima = None, math.inf
+
+    for lat_p, lng_p, indices in _tramos(zonas, lat, lng, RADIO_RESPALDO_KM):
+        distancia = _distancias_zonas(zonas, lat_p, lng_p, indices, RADIO_RESPALDO_KM)
+        posicion = int(np.argmin(distancia))
+        minima = float(distancia.flat[posicion])
+        if minima < distancia_minima:
+            distancia_minima = minima
+            zona_mas_cercana = int(indices[posicion % len(indices)])
+    return zona_mas_cercana, distancia_minima
+
+
+def calcular_puntuaciones_riesgo(rutas, zonas_riesgo=None):
+    """
+    Puntuación de riesgo (1.0 a 10.0) de varias rutas a la vez
+
+    Args:
+        rutas: lista de listas de coordenadas [lat, lng]
+        zonas_riesgo: QuerySet de EstadisticaRiesgo o IndiceZonas (opcional, por defecto todas)
+
+    Returns:
+        list[float]: una puntuación por ruta, en el mismo orden
+    """
+    indice = indice_para(zonas_riesgo)
+    if not indice.total:
+        return [riesgo_sin_zonas(len(coordenadas)) for coordenadas in rutas]
+
+    zonas = zonas_vectorizadas(indice)
+    franja = franja_actual()
+    puntuacion_zonas = zonas.puntuacion_en(franja, perfiles_horarios(indice) if franja is not None else None)
+    maximas = np.full(len(rutas), np.nan)
+    promedios = np.full(len(rutas), np.nan)
+    resultados = [None] * len(rutas)
+
+    for posicion, coordenadas in enumerate(rutas):
+        lat, lng = _puntos_validos(coordenadas)
+        suma, conteo, maxima = _acumular_puntuaciones(zonas, lat, lng, puntuacion_zonas)
+        if conteo:
+            maximas[posicion] = maxima
+            promedios[posicion] = suma / conteo
+        else:
+            columna, distancia = _zona_mas_cercana(zonas, lat, lng)
+            if columna is None:
+                puntuacion = None
+            elif franja is None:
+                puntuacion = zonas.zonas[columna].puntuacion_riesgo
+            else:
+                puntuacion = float(puntuacion_zonas[columna])
+            resultados[posicion] = riesgo_fuera_de_zonas(puntuacion, distancia, len(coordenadas))
+
+    # Ponderación 70/60/50% de la zona más peligrosa contra el promedio, para todas las rutas
+    condiciones = [maximas >= 7.0, maximas >= 5.0]
+    peso_maxima = np.select(condiciones, [0.7, 0.6], default=0.5)
+    peso_promedio = np.select(condiciones, [0.3, 0.4], default=0.5)
+    finales = np.clip((maximas * peso_maxima) + (promedios * peso_promedio), 1.0, 10.0)
+
+    for posicion, final in enumerate(finales):
+        if resultados[posicion] is None:
+            resultados[posicion] = round(float(final), 1)
+    return resultados
+
+
+def calcular_puntuacion_riesgo_vectorizada(coordenadas, zonas_riesgo=None):
+    """
+    Versión vectorizada de utils.calcular_puntuacion_riesgo para una sola ruta
+    """
+    return calcular_puntuaciones_riesgo([coordenadas], zonas_riesgo)[0]
@@ -0,0 +1,207 @@
+"""
+Cálculo asíncrono de rutas para la vista calcular_rutas.
+
+La vista síncrona ocupaba un hilo del servidor durante toda la consulta al
+backend de rutas, luego puntuaba las alternativas una tras otra y al final
+guardaba RutaSegura. Al inicio de turno esas peticiones acaparaban los hilos
+que también atienden las alertas de pánico.
+
+Ahora la vista es async y el trabajo se reparte en pools propios, fuera del
+hilo compartido de sync_to_async:
+
+- Red: las consultas al backend (varios perfiles a la vez, por ejemplo
+  driving y walking) se hacen en paralelo.
+- Cálculo: cada alternativa se puntúa en su propia tarea. NumPy libera el GIL
+  en las operaciones con arreglos, así que un pool de hilos basta para usar
+  varios núcleos sin procesos adicionales que carguen Django y el ráster.
+- Guardado: RutaSegura se escribe en segundo plano después de responder.
+
+eventos_rutas entrega las rutas en el orden en que están listas, para la
+respuesta progresiva de la vista: la ruta rápida en cuanto contesta el
+backend y cada alternativa al terminar de puntuarla.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .utils import (
+    MAXIMO_RUTAS_SEGURAS, armar_rutas_alternativas, es_ruta_segura, obtener_geometrias_rutas, puntuar_rutas
+)
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def _pool(nombre):
+    with _lock:
+        pool = _pools.get(nombre)
+        if pool is None:
+            tamanos = {
+                'red': settings.RUTAS_HILOS_RED,
+                'calculo': settings.RUTAS_HILOS_CALCULO or os.cpu_count() or 2,
+                'guardado': 1,
+            }
+            pool = _pools[nombre] = ThreadPoolExecutor(max_workers=tamanos[nombre], thread_name_prefix=f'rutas-{nombre}')
+        return pool
+
+
+def _con_conexion(funcion, *args):
+    # Los hilos de los pools usan su propia conexión a la base de datos (huella de zonas, guardado)
+    try:
+        return funcion(*args)
+    finally:
+        close_old_connections()
+
+
+async def _en_pool(nombre, funcion, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pool(nombre), _con_conexion, funcion, *args)
+
+
+def _puntuar_una(coordenadas):
+    return puntuar_rutas([coordenadas])[0]
+
+
+async def geometrias_por_perfil(origen_lat, origen_lon, destino_lat, destino_lon, perfiles):
+    """
+    Geometrías de cada perfil, pedidas al backend en paralelo
+
+    Returns:
+        dict: {perfil: lista de geometrías, None si no hubo rutas, o la excepción}
+    """
+    resultados = await asyncio.gather(
+        *(_en_pool('red', obtener_geometrias_rutas, origen_lat, origen_lon, destino_lat, destino_lon, perfil)
+          for perfil in perfiles),
+        return_exceptions=True
+    )
+    return dict(zip(perfiles, resultados))
+
+
+async def puntuar_geometrias(geometrias):
+    """
+    Puntuar cada alternativa en paralelo en el pool de cálculo
+    """
+    return await asyncio.gather(*(_en_pool('calculo', _puntuar_una, geometria['puntuacion']) for geometria in geometrias))
+
+
+async def calcular_rutas_perfiles(origen_lat, origen_lon, destino_lat, destino_lon, perfiles=('driving',)):
+    """
+    Versión asíncrona de utils.obtener_rutas_alternativas para varios perfiles
+
+    Returns:
+        dict: {perfil: resultado con el mismo formato que obtener_rutas_alternativas}
+    """
+    geometrias = await geometrias_por_perfil(origen_lat, origen_lon, destino_lat, destino_lon, perfiles)
+
+    async def armar(perfil):
+        resultado = geometrias[perfil]
+        if isinstance(resultado, Exception):
+            logger.error('Error al obtener rutas (%s): %s', perfil, resultado)
+            return {'success': False, 'error': str(resultado)}
+        if not resultado:
+            return {'success': False, 'error': 'No se pudieron calcular las rutas'}
+        return armar_rutas_alternativas(resultado, await puntuar_geometrias(resultado))
+
+    # Las alternativas de todos los perfiles se puntúan al mismo tiempo
+    armadas = await asyncio.gather(*(armar(perfil) for perfil in perfiles))
+    return dict(zip(perfiles, armadas))
+
+
+def _sin_puntuar(geometria):
+    return {
+        'coordenadas': geometria['coordenadas'],
+        'distancia': geometria['distancia'],
+        'duracion': geometria['duracion'],
+    }
+
+
+async def eventos_rutas(origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving'):
+    """
+    Rutas de un perfil en el orden en que están listas
+
+    Yields:
+        tuple (evento, datos):
+        - ('rapida', ruta) la ruta rápida sin puntuar, en cuanto responde el backend
+        - ('segura', (posicion, ruta)) cada alternativa real al terminar de
+          puntuarla, si su riesgo no supera al de la ruta rápida (hace falta
+          la puntuación de la rápida para saberlo). `posicion` es el orden de
+          llegada; el orden final, por riesgo, es el de 'completo'
+        - ('completo', resultado) igual al de obtener_rutas_alternativas
+        - ('error', mensaje) si no hubo rutas
+    """
+    try:
+        geometrias = await _en_pool('red', obtener_geometrias_rutas, origen_lat, origen_lon, destino_lat, destino_lon, perfil)
+    except Exception as e:
+        logger.error('Error al obtener rutas (%s): %s', perfil, e)
+        yield 'error', str(e)
+        return
+    if not geometrias:
+        yield 'error', 'No se pudieron calcular las rutas'
+        return
+
+    yield 'rapida', _sin_puntuar(geometrias[0])
+
+    tareas = {
+        asyncio.ensure_future(_en_pool('calculo', _puntuar_una, geometria['puntuacion'])): indice
+        for indice, geometria in enumerate(geometrias)
+    }
+    puntuaciones = [None] * len(geometrias)
+    # Alternativas puntuadas que esperan la puntuación de la ruta rápida
+    en_espera = []
+    enviadas = 0
+    pendientes = set(tareas)
+    try:
+        while pendientes:
+            listas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in sorted(listas, key=tareas.get):
+                indice = tareas[tarea]
+                puntuaciones[indice] = tarea.result()
+                if indice > 0:
+                    en_espera.append(indice)
+            if puntuaciones[0] is None:
+                continue
+            for indice in sorted(en_espera, key=lambda indice: puntuaciones[indice]):
+                if enviadas < MAXIMO_RUTAS_SEGURAS and es_ruta_segura(puntuaciones[indice], puntuaciones[0]):
+                    ruta = _sin_puntuar(geometrias[indice])
+                    ruta['puntuacion_riesgo'] = puntuaciones[indice]
+                    yield 'segura', (enviadas, ruta)
+                    enviadas += 1
+            en_espera = []
+    finally:
+        # Si el cliente se desconecta no hace falta esperar las puntuaciones restantes
+        for tarea in pendientes:
+            tarea.cancel()
+
+    yield 'completo', armar_rutas_alternativas(geometrias, puntuaciones)
+
+
+def _guardar(modelo, campos):
+    try:
+        modelo.objects.create(**campos)
+    except Exception:
+        logger.exception('No se pudo guardar la ruta calculada')
+
+
+def guardar_en_segundo_plano(modelo, **campos):
+    """
+    Crear un registro (p. ej. RutaSegura) sin hacer esperar la respuesta
+    """
+    return _pool('guardado').submit(_con_conexion, _guardar, modelo, campos)
+
+
+def _apagar():
+    # Terminar de guardar las rutas pendientes al apagar el proceso
+    with _lock:
+        pool = _pools.get('guardado')
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+atexit.register(_apagar)
@@ -1,6 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
-from .models import User, RepartidorProfile
+from .models import User, RepartidorProfile, Alerta, EstadisticaRiesgo
+from .agregacion_riesgo import ESTADOS_DESCARTADOS, alerta_cambio, encolar_alerta, intensidad_para_puntuacion
+from .alertas_activas import registro_alertas_activas
+from .indice_espacial import invalidar_indice_zonas
+from .raster_riesgo import raster_zonas_cambiaron
 
 
 @receiver(post_save, sender=User)
@@ -19,3 +24,61 @@ def crear_perfil_repartidor(sender, instance, created, **kwargs):
                 user=instance,
                 numero_identificacion=numero_id
             )
+
+
+@receiver(post_save, sender=Alerta)
+def registrar_estado_alerta(sender, instance, **kwargs):
+    """
+    Mantiene el registro de alertas activas al día en cada cambio de estado
+    (crear, atender, cerrar, cancelar). Se aplica al confirmar la transacción
+    para no registrar alertas que terminen revirtiéndose.
+    """
+    transaction.on_commit(lambda: registro_alertas_activas.actualizar(instance))
+
+
+@receiver(post_delete, sender=Alerta)
+def descartar_alerta_eliminada(sender, instance, **kwargs):
+    transaction.on_commit(lambda: registro_alertas_activas.descartar(instance))
+
+
+@receiver(post_init, sender=Alerta)
+def recordar_estado_alerta(sender, instance, **kwargs):
+    # Sin leer el campo si está diferido (.only()), para no generar una consulta
+    instance._estado_guardado = instance.__dict__.get('estado')
+
+
+@receiver(post_save, sender=Alerta)
+def agregar_alerta_a_zonas(sender, instance, created, **kwargs):
+    """
+    Suma la alerta nueva a los contadores y al riesgo de sus zonas, o la
+    descuenta si se marcó como falsa alarma
+    """
+    alerta_cambio(instance, created)
+
+
+@receiver(post_delete, sender=Alerta)
+def descontar_alerta_de_zonas(sender, instance, **kwargs):
+    if instance.estado not in ESTADOS_DESCARTADOS:
+        encolar_alerta(instance, -1)
+
+
+@receiver(pre_save, sender=EstadisticaRiesgo)
+def sembrar_intensidad_zona(sender, instance, **kwargs):
+    """
+    Las zonas capturadas con una puntuación y sin alertas agregadas parten de
+    la intensidad equivalente, para que la primera alerta no las reinicie
+    """
+    if not instance.intensidad_alertas and instance.puntuacion_riesgo:
+        instance.intensidad_alertas = intensidad_para_puntuacion(instance.puntuacion_riesgo)
+
+
+@receiver(post_save, sender=EstadisticaRiesgo)
+@receiver(post_delete, sender=EstadisticaRiesgo)
+def reconstruir_indice_zonas(sender, **kwargs):
+    """
+    Invalida el índice espacial de zonas de riesgo para que la siguiente
+    puntuación de rutas lo reconstruya con los datos nuevos, y programa la
+    reconstrucción del ráster de riesgo
+    """
+    transaction.on_commit(invalidar_indice_zonas)
+    transaction.on_commit(raster_zonas_cambiaron)
@@ -1,3 +1,220 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .deduplicacion import IndiceAlertasRecientes, buscar_alerta_duplicada
+from .indice_espacial import IndiceZonas, distancia_haversine
+from .models import Alerta, ContactoConfianza, EstadisticaRiesgo, NotificacionContacto, User
+from .notificaciones import encolar_notificaciones
+from .poligonos import poligono_de
+from .polilineas import codificar, decodificar
+from .puntos_calientes import ResumenCeldas, _leer_alertas, agrupar, resumir_grupos
+from .riesgo_vectorizado import calcular_puntuaciones_riesgo
+from .utils import calcular_puntuacion_riesgo, combinar_puntuaciones, riesgo_fuera_de_zonas
+
+
+def crear_repartidor(nombre='repartidor'):
+    return User.objects.create_user(username=nombre, email=f'{nombre}@rappisafe.test', password='x12345678', rol='repartidor')
+
+
+def crear_alerta(repartidor, latitud, longitud, tipo='accidente'):
+    return Alerta.objects.create(repartidor=repartidor, tipo=tipo, estado='pendiente', latitud=latitud, longitud=longitud)
+
+
+def puntuacion_recorriendo_zonas(coordenadas, zonas):
+    """
+    Puntuación de referencia: cada punto contra todas las zonas, sin índice
+    """
+    from math import radians
+
+    puntuaciones = []
+    mas_cercana, distancia_minima = None, float('inf')
+    for lat, lng in coordenadas:
+        for zona in zonas:
+            poligono = poligono_de(zona.coordenadas_zona)
+            if poligono is not None:
+                distancia = poligono.distancia_km(lat, lng)
+            else:
+                centro = zona.coordenadas_zona['center']
+                lat_zona = radians(centro['lat'])
+                distancia = distancia_haversine(radians(lat), radians(lng), lat_zona, radians(centro['lng']),
+                                                np.cos(lat_zona))
+
+            if distancia < distancia_minima:
+                mas_cercana, distancia_minima = zona, distancia
+            if distancia <= 1.0:
+                factor = 1.0 - distancia * 0.3
+            elif distancia <= 2.0:
+                factor = 0.7 - (distancia - 1.0) * 0.3
+            elif distancia <= 3.0:
+                factor = 0.4 - (distancia - 2.0) * 0.4
+            else:
+                continue
+            if zona.puntuacion_riesgo * max(0.0, factor) > 0:
+                puntuaciones.append(zona.puntuacion_riesgo * max(0.0, factor))
+
+    if not puntuaciones:
+        return riesgo_fuera_de_zonas(mas_cercana.puntuacion_riesgo, distancia_minima, len(coordenadas))
+    return combinar_puntuaciones(max(puntuaciones), sum(puntuaciones) / len(puntuaciones))
+
+
+@override_settings(RIESGO_HORARIO_ACTIVO=False)
+class PuntuacionRiesgoTests(TestCase):
+    """
+    La puntuación escalar, la del índice espacial y la vectorizada coinciden
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        periodo = {'periodo_inicio': date(2025, 1, 1), 'periodo_fin': date(2025, 12, 31)}
+        circulos = [((19.4326, -99.1332), 8.5), ((19.4200, -99.1600), 6.0), ((19.4500, -99.1000), 3.5)]
+        for (lat, lng), puntuacion in circulos:
+            EstadisticaRiesgo.objects.create(
+                nombre_zona=f'Círculo {puntuacion}', coordenadas_zona={'center': {'lat': lat, 'lng': lng}},
+                puntuacion_riesgo=puntuacion, **periodo
+            )
+        EstadisticaRiesgo.objects.create(
+            nombre_zona='Colonia', puntuacion_riesgo=7.2, **periodo,
+            coordenadas_zona={'type': 'Polygon', 'coordinates': [[
+                [-99.1450, 19.4050], [-99.1300, 19.4050], [-99.1300, 19.4150], [-99.1450, 19.4150], [-99.1450, 19.4050]
+            ]]},
+        )
+
+    def rutas(self):
+        return {
+            'cruza_zonas': [[19.40 + i * 0.002, -99.17 + i * 0.0025] for i in range(30)],
+            'dentro_del_poligono': [[19.4100, -99.1400], [19.4110, -99.1380], [19.4120, -99.1360]],
+            'fuera_del_radio': [[19.4326, -99.1950], [19.4330, -99.1960]],
+            'lejana': [[20.5, -100.5], [20.51, -100.51]],
+        }
+
+    def test_indice_y_vectorizada_igual_a_recorrer_las_zonas(self):
+        zonas = list(EstadisticaRiesgo.objects.all())
+        indice = IndiceZonas(zonas)
+        rutas = self.rutas()
+        vectorizadas = dict(zip(rutas, calcular_puntuaciones_riesgo(list(rutas.values()), indice)))
+
+        for nombre, coordenadas in rutas.items():
+            with self.subTest(ruta=nombre):
+                esperada = puntuacion_recorriendo_zonas(coordenadas, zonas)
+                self.assertEqual(calcular_puntuacion_riesgo(coordenadas, indice), esperada)
+                self.assertEqual(vectorizadas[nombre], esperada)
+
+
+class PolilineasTests(TestCase):
+
+    def test_codificar_y_decodificar_conserva_cinco_decimales(self):
+        coordenadas = [[19.432612, -99.133208], [19.4331, -99.1340], [-33.8688, 151.2093], [0.0, 0.0]]
+        decodificadas = decodificar(codificar(coordenadas))
+
+        self.assertEqual(len(decodificadas), len(coordenadas))
+        for original, resultado in zip(coordenadas, decodificadas):
+            self.assertEqual(resultado, [round(original[0], 5), round(original[1], 5)])
+
+    def test_ejemplo_de_google(self):
+        coordenadas = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+        self.assertEqual(codificar(coordenadas), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decodificar('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), coordenadas)
+
+    def test_polilinea_truncada(self):
+        with self.assertRaises(ValueError):
+            decodificar(codificar([[19.4326, -99.1332]])[:-1])
+
+
+class NotificacionesTests(TestCase):
+
+    def test_encolar_dos_veces_no_duplica_envios(self):
+        repartidor = crear_repartidor()
+        for telefono in ('+5215512345678', '+5215512345679'):
+            ContactoConfianza.objects.create(repartidor=repartidor, nombre=telefono, telefono=telefono, validado=True)
+        alerta = crear_alerta(repartidor, 19.4326, -99.1332, tipo='panico')
+
+        with transaction.atomic():
+            creadas, omitidos = encolar_notificaciones(alerta)
+        self.assertEqual((len(creadas), len(omitidos)), (2, 0))
+
+        with transaction.atomic():
+            creadas, omitidos = encolar_notificaciones(alerta)
+        self.assertEqual((len(creadas), len(omitidos)), (0, 2))
+        self.assertEqual(NotificacionContacto.objects.filter(alerta=alerta).count(), 2)
+
+
+@override_settings(ALERTAS_DEDUP_VENTANA=120, ALERTAS_DEDUP_DISTANCIA_M=300)
+class DeduplicacionTests(TestCase):
+
+    def setUp(self):
+        # Índice en memoria vacío en cada prueba: se ejercita también la consulta a la base de datos
+        parche = mock.patch('rappiSafe.deduplicacion.indice_accidentes', IndiceAlertasRecientes())
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.repartidor = crear_repartidor()
+        self.alerta = crear_alerta(self.repartidor, 19.4326, -99.1332)
+
+    def test_dentro_de_la_ventana_y_la_distancia(self):
+        # ~110 m al norte
+        self.assertEqual(buscar_alerta_duplicada(self.repartidor, 19.4336, -99.1332), self.alerta)
+
+    def test_fuera_de_la_distancia(self):
+        # ~1.1 km al norte
+        self.assertIsNone(buscar_alerta_duplicada(self.repartidor, 19.4426, -99.1332))
+
+    def test_fuera_de_la_ventana(self):
+        Alerta.objects.filter(id=self.alerta.id).update(creado_en=timezone.now() - timedelta(seconds=121))
+        self.assertIsNone(buscar_alerta_duplicada(self.repartidor, 19.4326, -99.1332))
+
+    def test_alerta_cerrada_o_de_otro_repartidor(self):
+        otro = crear_repartidor('otro')
+        self.assertIsNone(buscar_alerta_duplicada(otro, 19.4326, -99.1332))
+
+        Alerta.objects.filter(id=self.alerta.id).update(estado='cerrada')
+        self.assertIsNone(buscar_alerta_duplicada(self.repartidor, 19.4326, -99.1332))
+
+
+@override_settings(PUNTOS_CALIENTES_MARGEN_S=600, PUNTOS_CALIENTES_RADIO_MINIMO_KM=0.3)
+class PuntosCalientesTests(TestCase):
+    EPS_M = 300
+
+    def setUp(self):
+        self.repartidor = crear_repartidor()
+
+    def crear_grupo(self, lat, lng, cantidad):
+        # Puntos separados ~11 m entre sí
+        for i in range(cantidad):
+            crear_alerta(self.repartidor, round(lat + i * 0.0001, 6), lng)
+
+    def test_agrupar_separa_grupos_y_ruido(self):
+        self.crear_grupo(19.4326, -99.1332, 6)
+        self.crear_grupo(19.4700, -99.1800, 4)
+        crear_alerta(self.repartidor, 19.3000, -99.0500)
+
+        resumen = ResumenCeldas.para_eps(self.EPS_M)
+        self.assertEqual(_leer_alertas(resumen, completo=True, lote=4), 11)
+
+        grupos = agrupar(resumen, self.EPS_M, minimo_alertas=4)
+        self.assertEqual(sorted(np.unique(grupos).tolist()), [-1, 0, 1])
+
+        resumenes = resumir_grupos(resumen, grupos)
+        self.assertEqual([grupo['total_alertas'] for grupo in resumenes], [6, 4])
+        self.assertAlmostEqual(resumenes[0]['lat'], 19.43285, places=5)
+        self.assertAlmostEqual(resumenes[0]['lng'], -99.1332, places=5)
+
+    def test_lectura_incremental_igual_a_completa(self):
+        self.crear_grupo(19.4326, -99.1332, 5)
+        resumen = ResumenCeldas.para_eps(self.EPS_M)
+        self.assertEqual(_leer_alertas(resumen, completo=False, lote=2), 5)
+
+        # Volver a leer no suma las alertas del margen que ya se sumaron
+        self.assertEqual(_leer_alertas(resumen, completo=False, lote=2), 0)
+
+        self.crear_grupo(19.4700, -99.1800, 3)
+        self.assertEqual(_leer_alertas(resumen, completo=False, lote=2), 3)
+
+        completo = ResumenCeldas.para_eps(self.EPS_M)
+        _leer_alertas(completo, completo=True, lote=100)
+        np.testing.assert_array_equal(resumen.claves, completo.claves)
+        np.testing.assert_allclose(resumen.datos, completo.datos)
+        self.assertEqual(resumen.marca, completo.marca)
@@ -0,0 +1,179 @@
+"""
+Buffer de escritura diferida para los puntos de trayectoria.
+
+Durante una emergencia cada repartidor envía su ubicación cada segundo por
+WebSocket. En lugar de una consulta y un commit por punto, UbicacionConsumer
+deja los puntos en este buffer (uno por proceso, compartido por todas las
+conexiones) y un hilo en segundo plano los guarda con bulk_create cuando se
+junta un lote o cuando pasa el intervalo máximo, lo que ocurra primero.
+
+Al apagar el proceso de forma ordenada se guarda lo que quede en el buffer.
+"""
+import atexit
+import logging
+import math
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _numero(valor, minimo=None, maximo=None, opcional=False):
+    """
+    Convertir un valor recibido por el socket a float finito dentro del rango
+
+    Raises:
+        ValueError: si no es numérico, no es finito o está fuera del rango
+    """
+    if valor is None and opcional:
+        return None
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f'Valor no numérico: {valor!r}')
+    fuera = (minimo is not None and numero < minimo) or (maximo is not None and numero > maximo)
+    if not math.isfinite(numero) or fuera:
+        raise ValueError(f'Valor fuera de rango: {valor!r}')
+    return numero
+
+
+class BufferTrayectorias:
+    """
+    Puntos de trayectoria pendientes de guardar
+    """
+
+    def __init__(self, tamano_lote=None, intervalo=None):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._puntos = []
+        self._condicion = threading.Condition()
+        self._escritura = threading.Lock()
+        self._hilo = None
+        self._detenido = False
+
+    def _tamano_lote(self):
+        return self.tamano_lote or settings.TRAYECTORIAS_TAMANO_LOTE
+
+    def _intervalo(self):
+        return self.intervalo or settings.TRAYECTORIAS_INTERVALO
+
+    def agregar(self, alerta_id, latitud, longitud, precision=None, velocidad=None):
+        """
+        Agregar un punto al buffer; la hora se toma al recibirlo, no al guardarlo
+
+        Raises:
+            ValueError: si el ID de la alerta o las coordenadas no son válidos;
+                el punto no entra al buffer
+        """
+        from .models import Trayectoria
+
+        # El ID llega como texto de la URL; como UUID se compara con los de la base de datos
+        punto = Trayectoria(
+            alerta_id=alerta_id if isinstance(alerta_id, uuid.UUID) else uuid.UUID(str(alerta_id)),
+            latitud=_numero(latitud, -90, 90),
+            longitud=_numero(longitud, -180, 180),
+            precision=_numero(precision, 0, opcional=True),
+            velocidad=_numero(velocidad, opcional=True),
+            timestamp=timezone.now()
+        )
+
+        with self._condicion:
+            self._puntos.append(punto)
+            if self._hilo is None and not self._detenido:
+                self._hilo = threading.Thread(target=self._ciclo, name='buffer-trayectorias', daemon=True)
+                self._hilo.start()
+            if len(self._puntos) >= self._tamano_lote():
+                self._condicion.notify()
+
+    def pendientes(self):
+        with self._condicion:
+            return len(self._puntos)
+
+    def _ciclo(self):
+        while True:
+            with self._condicion:
+                if len(self._puntos) < self._tamano_lote() and not self._detenido:
+                    self._condicion.wait(self._intervalo())
+                if self._detenido:
+                    return
+
+            try:
+                self.vaciar()
+            except Exception:
+                logger.exception('Error al guardar puntos de trayectoria')
+            finally:
+                close_old_connections()
+
+    def vaciar(self):
+        """
+        Guardar todos los puntos pendientes en lotes de bulk_create
+
+        Returns:
+            int: Número de puntos guardados
+        """
+        guardados = 0
+        with self._escritura:
+            while True:
+                with self._condicion:
+                    lote = self._puntos[:self._tamano_lote()]
+                    del self._puntos[:len(lote)]
+                if not lote:
+                    return guardados
+
+                try:
+                    guardados += self._guardar(lote)
+                except (OperationalError, InterfaceError):
+                    # Base de datos no disponible: devolver el lote al frente para reintentarlo
+                    # en el próximo ciclo
+                    with self._condicion:
+                        self._puntos[:0] = lote
+                    raise
+                except Exception:
+                    # Un error que no se arregla reintentando no debe bloquear los puntos siguientes
+                    logger.exception('Se descartaron %s punto(s) de trayectoria que no se pudieron guardar', len(lote))
+
+    def _guardar(self, lote):
+        from .models import Alerta, Trayectoria
+
+        try:
+            with transaction.atomic():
+                Trayectoria.objects.bulk_create(lote)
+            return len(lote)
+        except IntegrityError:
+            # Alguna alerta se eliminó mientras sus puntos esperaban en el buffer
+            existentes = set(
+                Alerta.objects.filter(id__in={punto.alerta_id for punto in lote}).values_list('id', flat=True)
+            )
+            validos = [punto for punto in lote if punto.alerta_id in existentes]
+            if len(validos) < len(lote):
+                logger.warning('Se descartaron %s punto(s) de alertas eliminadas', len(lote) - len(validos))
+            with transaction.atomic():
+                Trayectoria.objects.bulk_create(validos)
+            return len(validos)
+
+    def detener(self):
+        """
+        Detener el hilo de escritura y guardar lo que quede (apagado ordenado)
+        """
+        with self._condicion:
+            self._detenido = True
+            hilo = self._hilo
+            self._condicion.notify()
+        if hilo is not None:
+            hilo.join(timeout=5)
+
+        try:
+            guardados = self.vaciar()
+            if guardados:
+                logger.info('Se guardaron %s punto(s) de trayectoria al apagar', guardados)
+        except Exception:
+            logger.exception('No se pudieron guardar %s punto(s) de trayectoria al apagar', self.pendientes())
+
+
+buffer_trayectorias = BufferTrayectorias()
+
+atexit.register(buffer_trayectorias.detener)
@@ -0,0 +1,179 @@
+"""
+Último estado conocido (ubicación y batería) de los repartidores.
+
+Los pings de ubicación y batería son la escritura más frecuente del sistema y
+crecen con el tamaño de la flota. En lugar de un perfil.save() completo por
+ping, los valores se guardan en memoria y un hilo en segundo plano escribe
+periódicamente solo las columnas que cambiaron de los perfiles modificados.
+
+Las lecturas (lista de repartidores, inicio del repartidor) sobreponen el
+valor en memoria al de la base de datos cuando es más reciente.
+
+El estado en memoria es de cada proceso. Con un solo proceso las lecturas son
+exactas; con varios workers de Daphne cada uno ve los pings que recibieron los
+demás con hasta UBICACIONES_INTERVALO_GUARDADO segundos de retraso (lo que
+tardan en llegar a la base de datos), y si un worker se detiene sin apagado
+ordenado pierde a lo sumo ese intervalo. La ubicación en vivo durante una
+alerta no depende de este estado: viaja por la capa de canales.
+"""
+import atexit
+import logging
+import threading
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SEIS_DECIMALES = Decimal('0.000001')
+
+# Columnas de RepartidorProfile por tipo de actualización; la última es la marca de tiempo
+CAMPOS = {
+    'ubicacion': ('ultima_latitud', 'ultima_longitud', 'ultima_actualizacion_ubicacion'),
+    'bateria': ('nivel_bateria', 'ultima_actualizacion_bateria'),
+}
+
+
+def _coordenada(valor):
+    try:
+        return Decimal(str(valor)).quantize(SEIS_DECIMALES)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f'Coordenada inválida: {valor}')
+
+
+class EstadoRepartidores:
+    """
+    Últimos valores por repartidor: {user_id: {'ubicacion': (...), 'bateria': (...)}}
+    """
+
+    def __init__(self, intervalo=None):
+        self.intervalo = intervalo
+        self._estados = {}
+        self._sucios = {}
+        self._condicion = threading.Condition()
+        self._escritura = threading.Lock()
+        self._hilo = None
+        self._detenido = False
+
+    def _intervalo(self):
+        return self.intervalo or settings.UBICACIONES_INTERVALO_GUARDADO
+
+    def actualizar_ubicacion(self, user_id, latitud, longitud):
+        self._actualizar(user_id, 'ubicacion', (_coordenada(latitud), _coordenada(longitud), timezone.now()))
+
+    def actualizar_bateria(self, user_id, nivel):
+        nivel = int(nivel) if nivel is not None else None
+        self._actualizar(user_id, 'bateria', (nivel, timezone.now()))
+
+    def _actualizar(self, user_id, tipo, valores):
+        with self._condicion:
+            self._estados.setdefault(user_id, {})[tipo] = valores
+            self._sucios.setdefault(user_id, set()).add(tipo)
+            if self._hilo is None and not self._detenido:
+                self._hilo = threading.Thread(target=self._ciclo, name='estado-repartidores', daemon=True)
+                self._hilo.start()
+
+    def aplicar(self, perfil):
+        """
+        Sobreponer al perfil los valores en memoria más recientes que los de la base de datos
+
+        Returns:
+            El mismo perfil, para poder encadenar
+        """
+        if perfil is None:
+            return perfil
+
+        with self._condicion:
+            estado = dict(self._estados.get(perfil.user_id, {}))
+
+        for tipo, valores in estado.items():
+            campos = CAMPOS[tipo]
+            actual = getattr(perfil, campos[-1])
+            if actual is None or valores[-1] > actual:
+                for campo, valor in zip(campos, valores):
+                    setattr(perfil, campo, valor)
+        return perfil
+
+    def pendientes(self):
+        with self._condicion:
+            return len(self._sucios)
+
+    def _ciclo(self):
+        while True:
+            with self._condicion:
+                if not self._detenido:
+                    self._condicion.wait(self._intervalo())
+                if self._detenido:
+                    return
+
+            try:
+                self.vaciar()
+            except Exception:
+                logger.exception('Error al guardar el estado de los repartidores')
+            finally:
+                close_old_connections()
+
+    def vaciar(self):
+        """
+        Escribir los perfiles modificados desde el último guardado.
+
+        Cada perfil se actualiza solo en las columnas que cambiaron y solo si la
+        base de datos no tiene ya un valor más reciente (por ejemplo el que
+        guarda la vista de alerta de pánico), todo en una sola transacción.
+
+        Returns:
+            int: Número de perfiles escritos
+        """
+        from .models import RepartidorProfile
+
+        with self._escritura:
+            with self._condicion:
+                sucios, self._sucios = self._sucios, {}
+                cambios = [
+                    (user_id, tipo, self._estados[user_id][tipo])
+                    for user_id, tipos in sucios.items()
+                    for tipo in tipos
+                ]
+            if not cambios:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    for user_id, tipo, valores in cambios:
+                        campos = CAMPOS[tipo]
+                        marca = campos[-1]
+                        RepartidorProfile.objects.filter(user_id=user_id).filter(
+                            Q(**{f'{marca}__isnull': True}) | Q(**{f'{marca}__lt': valores[-1]})
+                        ).update(**dict(zip(campos, valores)))
+            except Exception:
+                # Volver a marcarlos para el siguiente ciclo
+                with self._condicion:
+                    for user_id, tipos in sucios.items():
+                        self._sucios.setdefault(user_id, set()).update(tipos)
+                raise
+
+            return len(sucios)
+
+    def detener(self):
+        """
+        Detener el hilo de escritura y guardar lo pendiente (apagado ordenado)
+        """
+        with self._condicion:
+            self._detenido = True
+            hilo = self._hilo
+            self._condicion.notify()
+        if hilo is not None:
+            hilo.join(timeout=5)
+
+        try:
+            self.vaciar()
+        except Exception:
+            logger.exception('No se pudo guardar el estado de %s repartidor(es) al apagar', self.pendientes())
+
+
+estado_repartidores = EstadoRepartidores()
+
+atexit.register(estado_repartidores.detener)
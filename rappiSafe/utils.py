@@ -1,31 +1,31 @@
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 import json
 import requests
 from decimal import Decimal
 import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.utils import timezone
 
+from .eventos import publicador
+
 
 def enviar_nueva_alerta(alerta_dict):
     """
     Enviar nueva alerta a todos los operadores conectados
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'alertas',
-        {
+    publicador.publicar(
+        ('alertas', {
             'type': 'nueva_alerta',
             'alerta': alerta_dict
-        }
-    )
-    # También enviar al grupo de monitoreo
-    async_to_sync(channel_layer.group_send)(
-        'monitoreo',
-        {
+        }),
+        # También enviar al grupo de monitoreo
+        ('monitoreo', {
             'type': 'nueva_alerta_monitoreo',
             'alerta': alerta_dict
-        }
+        }),
     )
 
 
@@ -33,13 +33,11 @@ def enviar_actualizacion_alerta(alerta_dict):
     """
     Enviar actualización de alerta existente
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'alertas',
-        {
+    publicador.publicar(
+        ('alertas', {
             'type': 'actualizar_alerta',
             'alerta': alerta_dict
-        }
+        }),
     )
 
 
@@ -47,17 +45,15 @@ def enviar_actualizacion_ubicacion(alerta_id, latitud, longitud, precision=None,
     """
     Enviar actualización de ubicación para una alerta específica
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'ubicacion_{alerta_id}',
-        {
+    publicador.publicar(
+        (f'ubicacion_{alerta_id}', {
             'type': 'actualizar_ubicacion',
             'latitud': str(latitud),
             'longitud': str(longitud),
             'precision': precision,
             'velocidad': velocidad,
             'timestamp': None  # Se llenará en el cliente
-        }
+        }),
     )
 
 
@@ -65,14 +61,12 @@ def enviar_notificacion(mensaje, nivel='info'):
     """
     Enviar notificación general al dashboard de monitoreo
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'monitoreo',
-        {
+    publicador.publicar(
+        ('monitoreo', {
             'type': 'notificacion',
             'mensaje': mensaje,
             'nivel': nivel
-        }
+        }),
     )
 
 
@@ -80,23 +74,42 @@ def enviar_estado_repartidor(repartidor_id, estado, latitud=None, longitud=None)
     """
     Enviar actualización de estado de un repartidor
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'monitoreo',
-        {
+    publicador.publicar(
+        ('monitoreo', {
             'type': 'actualizar_estado_repartidor',
             'repartidor_id': repartidor_id,
             'estado': estado,
             'latitud': str(latitud) if latitud else None,
             'longitud': str(longitud) if longitud else None
-        }
+        }),
     )
 
 
+def calcular_distancia_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia en km entre dos puntos usando la fórmula de Haversine
+    """
+    R = 6371  # Radio de la Tierra en km
+
+    lat1 = math.radians(float(lat1))
+    lon1 = math.radians(float(lon1))
+    lat2 = math.radians(float(lat2))
+    lon2 = math.radians(float(lon2))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return R * c
+
+
 def serializar_alerta(alerta):
     """
     Serializar una alerta para envío por WebSocket
     """
+    from .riesgo_horario import riesgo_en_punto
+
     return {
         'id': str(alerta.id),
         'repartidor': {
@@ -111,43 +124,76 @@ def serializar_alerta(alerta):
         'nivel_bateria': alerta.nivel_bateria,
         'creado_en': alerta.creado_en.isoformat(),
         'datos_sensores': alerta.datos_sensores,
+        # Riesgo a esta hora de la zona donde ocurre, para priorizar la atención
+        'riesgo_zona': riesgo_en_punto(alerta.latitud, alerta.longitud),
     }
 
 
 def obtener_ruta_osrm(origen_lat, origen_lon, destino_lat, destino_lon, profile='driving'):
     """
-    Obtener ruta usando OSRM (Open Source Routing Machine)
+    Obtener ruta usando OSRM (Open Source Routing Machine) u otro backend de RUTAS_BACKEND
     Profile: driving, walking, cycling
     """
+    from .cache_rutas import cache_rutas
+    from .enrutamiento import ErrorEnrutamiento, obtener_backend
+
     try:
-        url = f"https://router.project-osrm.org/route/v1/{profile}/{origen_lon},{origen_lat};{destino_lon},{destino_lat}"
-        params = {
-            'overview': 'full',
-            'geometries': 'geojson',
-            'steps': 'false'
+        clave = cache_rutas.clave(origen_lat, origen_lon, destino_lat, destino_lon, profile)
+        ruta = cache_rutas.obtener(clave)
+        if ruta is not None:
+            return dict(ruta)
+
+        route = obtener_backend().rutas(origen_lat, origen_lon, destino_lat, destino_lon, profile)[0]
+        ruta = {
+            'coordenadas': route['coordenadas'],
+            'distancia': round(route['distancia'] / 1000, 2),  # metros a km
+            'duracion': round(route['duracion'] / 60),  # segundos a minutos
+            'success': True
         }
+        cache_rutas.guardar(clave, ruta)
+        return dict(ruta)
 
-        response = requests.get(url, params=params, timeout=10)
+    except ErrorEnrutamiento:
+        return {'success': False, 'error': 'No se pudo calcular la ruta'}
 
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('code') == 'Ok' and data.get('routes'):
-                route = data['routes'][0]
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
-                # Convertir coordenadas de [lon, lat] a [lat, lon]
-                coordinates = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
 
-                return {
-                    'coordenadas': coordinates,
-                    'distancia': round(route['distance'] / 1000, 2),  # metros a km
-                    'duracion': round(route['duration'] / 60),  # segundos a minutos
-                    'success': True
-                }
+# Radio de influencia de una zona de riesgo y radio para la zona más cercana (km)
+RADIO_INFLUENCIA_KM = 3.0
+RADIO_RESPALDO_KM = 10.0
 
-        return {'success': False, 'error': 'No se pudo calcular la ruta'}
 
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
+def _zona_mas_cercana(indice, coordenadas):
+    """
+    Zona más cercana a la ruta dentro del radio de respaldo, con la misma
+    regla de desempate que recorrer todas las zonas (la primera encontrada)
+
+    Returns:
+        tuple: (entrada del índice o None, distancia en km)
+    """
+    from math import radians
+
+    zona_mas_cercana = None
+    distancia_minima = float('inf')
+
+    for coord in coordenadas:
+        lat_ruta, lng_ruta = coord[0], coord[1]
+        try:
+            lat1 = radians(lat_ruta)
+            lon1 = radians(lng_ruta)
+            zonas_cercanas = indice.candidatas(lat_ruta, lng_ruta, RADIO_RESPALDO_KM)
+        except (ValueError, TypeError, OverflowError):
+            continue
+
+        for entrada in zonas_cercanas:
+            distancia = indice.distancia(entrada, lat1, lon1, RADIO_RESPALDO_KM)
+            if distancia < distancia_minima:
+                distancia_minima = distancia
+                zona_mas_cercana = entrada
+
+    return zona_mas_cercana, distancia_minima
 
 
 def calcular_puntuacion_riesgo(coordenadas, zonas_riesgo=None):
@@ -157,23 +203,24 @@ def calcular_puntuacion_riesgo(coordenadas, zonas_riesgo=None):
 
     Args:
         coordenadas: Lista de coordenadas [lat, lng] de la ruta
-        zonas_riesgo: QuerySet de EstadisticaRiesgo (opcional)
+        zonas_riesgo: QuerySet de EstadisticaRiesgo o IndiceZonas (opcional)
 
     Returns:
         float: Puntuación de riesgo de 1.0 a 10.0
     """
-    from math import radians, sin, cos, sqrt, atan2
-    from .models import EstadisticaRiesgo
+    from math import radians
+    from .indice_espacial import indice_para
+    from .riesgo_horario import franja_actual, perfiles_horarios
 
-    # Si no se proporcionan zonas, obtenerlas de la base de datos
-    if not zonas_riesgo:
-        zonas_riesgo = EstadisticaRiesgo.objects.all()
+    # Si no se proporcionan zonas, usar el índice espacial de todas las zonas
+    indice = indice_para(zonas_riesgo)
 
-    if not zonas_riesgo.exists():
-        # Si no hay datos de zonas de riesgo, ruta base de riesgo medio-bajo
-        num_puntos = len(coordenadas)
-        riesgo_base = min(1.0 + (num_puntos * 0.01), 4.0)
-        return round(riesgo_base, 1)
+    if not indice.total:
+        return riesgo_sin_zonas(len(coordenadas))
+
+    # Puntuación de cada zona en la hora actual, por el orden de su entrada
+    franja = franja_actual()
+    horario = perfiles_horarios(indice).columna(franja) if franja is not None else None
 
     # Calcular riesgo real basado en proximidad a zonas peligrosas
     # Sistema de zonas concéntricas:
@@ -181,78 +228,91 @@ def calcular_puntuacion_riesgo(coordenadas, zonas_riesgo=None):
     # - 1-2 km: Riesgo medio (factor 0.7)
     # - 2-3 km: Riesgo bajo (factor 0.4)
     # - >3 km: Sin riesgo (factor 0.0)
+    # En zonas con polígono la distancia es al borde (0 dentro)
+    # Cada punto solo revisa las zonas que el índice ubica dentro del radio
 
     puntuaciones = []
-    zona_mas_cercana = None
-    distancia_minima = float('inf')
 
     for coord in coordenadas:
         lat_ruta, lng_ruta = coord[0], coord[1]
-
-        # Buscar zonas cercanas a este punto de la ruta
-        for zona in zonas_riesgo:
+        try:
+            lat1 = radians(lat_ruta)
+            lon1 = radians(lng_ruta)
+            zonas_cercanas = indice.candidatas(lat_ruta, lng_ruta, RADIO_INFLUENCIA_KM)
+        except (ValueError, TypeError, OverflowError):
+            continue
+
+        for entrada in zonas_cercanas:
+            zona = entrada[1]
             try:
-                coords_zona = zona.coordenadas_zona
-                if isinstance(coords_zona, dict) and 'center' in coords_zona:
-                    lat_zona = float(coords_zona['center']['lat'])
-                    lng_zona = float(coords_zona['center']['lng'])
-
-                    # Calcular distancia usando fórmula de Haversine
-                    R = 6371  # Radio de la Tierra en km
-
-                    lat1 = radians(lat_ruta)
-                    lon1 = radians(lng_ruta)
-                    lat2 = radians(lat_zona)
-                    lon2 = radians(lng_zona)
-
-                    dlat = lat2 - lat1
-                    dlon = lon2 - lon1
-
-                    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                    c = 2 * atan2(sqrt(a), sqrt(1-a))
-                    distancia = R * c
-
-                    # Guardar la zona más cercana
-                    if distancia < distancia_minima:
-                        distancia_minima = distancia
-                        zona_mas_cercana = zona
-
-                    # Sistema de zonas concéntricas (3 km de radio total)
-                    if distancia <= 3.0:
-                        # Calcular factor de distancia según zona concéntrica
-                        if distancia <= 1.0:
-                            # Zona de alto riesgo (0-1 km)
-                            factor_distancia = 1.0 - (distancia * 0.3)  # 1.0 a 0.7
-                        elif distancia <= 2.0:
-                            # Zona de riesgo medio (1-2 km)
-                            factor_distancia = 0.7 - ((distancia - 1.0) * 0.3)  # 0.7 a 0.4
-                        else:
-                            # Zona de riesgo bajo (2-3 km)
-                            factor_distancia = 0.4 - ((distancia - 2.0) * 0.4)  # 0.4 a 0.0
-
-                        puntuacion_zona = zona.puntuacion_riesgo * max(0.0, factor_distancia)
-                        if puntuacion_zona > 0:
-                            puntuaciones.append(puntuacion_zona)
+                distancia = indice.distancia(entrada, lat1, lon1, RADIO_INFLUENCIA_KM)
+
+                # Sistema de zonas concéntricas (3 km de radio total)
+                if distancia <= 3.0:
+                    # Calcular factor de distancia según zona concéntrica
+                    if distancia <= 1.0:
+                        # Zona de alto riesgo (0-1 km)
+                        factor_distancia = 1.0 - (distancia * 0.3)  # 1.0 a 0.7
+                    elif distancia <= 2.0:
+                        # Zona de riesgo medio (1-2 km)
+                        factor_distancia = 0.7 - ((distancia - 1.0) * 0.3)  # 0.7 a 0.4
+                    else:
+                        # Zona de riesgo bajo (2-3 km)
+                        factor_distancia = 0.4 - ((distancia - 2.0) * 0.4)  # 0.4 a 0.0
+
+                    puntuacion = zona.puntuacion_riesgo if horario is None else float(horario[entrada[0]])
+                    puntuacion_zona = puntuacion * max(0.0, factor_distancia)
+                    if puntuacion_zona > 0:
+                        puntuaciones.append(puntuacion_zona)
             except (KeyError, ValueError, TypeError):
                 continue
 
     # Si la ruta no pasa cerca de ninguna zona registrada
     if not puntuaciones:
-        # Si hay una zona cercana pero fuera del radio, dar riesgo mínimo basado en qué tan cerca está
-        if zona_mas_cercana and distancia_minima < 10.0:
-            # Entre 3-10 km: dar un riesgo muy bajo proporcional a la zona
-            factor_lejania = max(0, 1.0 - (distancia_minima / 10.0))
-            riesgo_base = zona_mas_cercana.puntuacion_riesgo * factor_lejania * 0.3
-            return round(max(1.5, min(4.0, riesgo_base)), 1)
+        entrada, distancia_minima = _zona_mas_cercana(indice, coordenadas)
+        if entrada is None:
+            puntuacion_cercana = None
+        elif horario is None:
+            puntuacion_cercana = entrada[1].puntuacion_riesgo
+        else:
+            puntuacion_cercana = float(horario[entrada[0]])
+        return riesgo_fuera_de_zonas(puntuacion_cercana, distancia_minima, len(coordenadas))
+
+    return combinar_puntuaciones(max(puntuaciones), sum(puntuaciones) / len(puntuaciones))
+
+
+def riesgo_sin_zonas(num_puntos):
+    """
+    Si no hay datos de zonas de riesgo, ruta base de riesgo medio-bajo
+    """
+    riesgo_base = min(1.0 + (num_puntos * 0.01), 4.0)
+    return round(riesgo_base, 1)
+
 
-        # Ruta muy lejos de zonas conocidas
-        num_puntos = len(coordenadas)
-        return round(min(2.0 + (num_puntos * 0.005), 3.5), 1)
+def riesgo_fuera_de_zonas(puntuacion_cercana, distancia_minima, num_puntos):
+    """
+    Riesgo de una ruta que no pasa dentro del radio de ninguna zona
+
+    Args:
+        puntuacion_cercana: puntuación de la zona más cercana, o None si no hay
+        distancia_minima: distancia en km de la ruta a esa zona
+        num_puntos: número de puntos de la ruta
+    """
+    # Si hay una zona cercana pero fuera del radio, dar riesgo mínimo basado en qué tan cerca está
+    if puntuacion_cercana is not None and distancia_minima < RADIO_RESPALDO_KM:
+        # Entre 3-10 km: dar un riesgo muy bajo proporcional a la zona
+        factor_lejania = max(0, 1.0 - (distancia_minima / 10.0))
+        riesgo_base = puntuacion_cercana * factor_lejania * 0.3
+        return round(max(1.5, min(4.0, riesgo_base)), 1)
+
+    # Ruta muy lejos de zonas conocidas
+    return round(min(2.0 + (num_puntos * 0.005), 3.5), 1)
 
-    # Calcular puntuación final con peso para la zona más peligrosa
-    puntuacion_promedio = sum(puntuaciones) / len(puntuaciones)
-    puntuacion_maxima = max(puntuaciones)
 
+def combinar_puntuaciones(puntuacion_maxima, puntuacion_promedio):
+    """
+    Puntuación final de la ruta con peso para la zona más peligrosa
+    """
     # Si la zona más peligrosa es muy peligrosa (>7), darle más peso
     if puntuacion_maxima >= 7.0:
         # 70% zona más peligrosa, 30% promedio
@@ -270,88 +330,166 @@ def calcular_puntuacion_riesgo(coordenadas, zonas_riesgo=None):
     return round(puntuacion_final, 1)
 
 
-def obtener_rutas_alternativas(origen_lat, origen_lon, destino_lat, destino_lon):
+def puntuar_rutas(rutas):
     """
-    Obtener múltiples rutas alternativas usando OSRM con el parámetro alternatives
-    OSRM calcula automáticamente rutas alternativas inteligentes
-    Retorna: ruta rápida, y 2 rutas alternativas más seguras
+    Puntuación de riesgo de varias rutas (listas de coordenadas [lat, lng]).
+    Usa el motor vectorizado con NumPy (igual al cálculo punto por punto), el
+    ráster precalculado si RASTER_RIESGO_ACTIVO y está al día, y si NumPy no
+    está instalado el cálculo punto por punto.
     """
     try:
-        # Usar OSRM con alternatives=true para obtener hasta 3 rutas diferentes
-        url = f"https://router.project-osrm.org/route/v1/driving/{origen_lon},{origen_lat};{destino_lon},{destino_lat}"
-        params = {
-            'overview': 'full',
-            'geometries': 'geojson',
-            'alternatives': 'true',  # Solicitar rutas alternativas
-            'steps': 'false',
-            'continue_straight': 'false'  # Permitir giros en U para más alternativas
+        from .raster_riesgo import obtener_raster
+        from .riesgo_vectorizado import calcular_puntuaciones_riesgo
+    except ImportError:
+        return [calcular_puntuacion_riesgo(coordenadas) for coordenadas in rutas]
+
+    raster = obtener_raster() if settings.RASTER_RIESGO_ACTIVO else None
+    if raster is not None:
+        return [raster.puntuar(coordenadas) for coordenadas in rutas]
+    return calcular_puntuaciones_riesgo(rutas)
+
+
+def _consultar_alternativas(origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving'):
+    """
+    Geometrías de las rutas alternativas del backend de rutas, ya
+    simplificadas: la polilínea para puntuar, la de visualización,
+    distancia y duración
+
+    Returns:
+        list | None: una entrada por ruta, o None si no hubo rutas
+    """
+    from .enrutamiento import BackendGrafo, ErrorEnrutamiento, obtener_backend
+    from .grafo_vial import obtener_grafo
+    from .polilineas import polilinea_puntuacion, polilinea_visualizacion
+
+    # Pedir hasta 3 rutas diferentes (alternatives=true en OSRM)
+    backend = obtener_backend()
+    try:
+        rutas = backend.rutas(origen_lat, origen_lon, destino_lat, destino_lon, perfil, alternativas=True)
+    except ErrorEnrutamiento:
+        rutas = []
+
+    # Si faltan alternativas, completarlas con rutas reales de menor riesgo del
+    # grafo vial (sus velocidades son de vehículo)
+    grafo = obtener_grafo()
+    if len(rutas) < 3 and perfil == 'driving' and grafo is not None and not isinstance(backend, BackendGrafo):
+        seguras = grafo.rutas_seguras(float(origen_lat), float(origen_lon), float(destino_lat), float(destino_lon))
+        rutas = rutas + (seguras[1:] if rutas else seguras)[:3 - len(rutas)]
+
+    if not rutas:
+        return None
+
+    return [
+        {
+            # Espaciado uniforme para puntuar, versión simplificada para enviar y guardar
+            'puntuacion': polilinea_puntuacion(route['coordenadas']),
+            'coordenadas': polilinea_visualizacion(route['coordenadas']),
+            'distancia': round(route['distancia'] / 1000, 2),  # metros a km
+            'duracion': round(route['duracion'] / 60),  # segundos a minutos
         }
+        for route in rutas
+    ]
 
-        response = requests.get(url, params=params, timeout=10)
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('code') == 'Ok' and data.get('routes'):
-                routes = data['routes']
-
-                # Procesar todas las rutas disponibles (OSRM retorna hasta 3)
-                rutas_procesadas = []
-                for route in routes:
-                    # Convertir coordenadas de [lon, lat] a [lat, lon]
-                    coordinates = [[coord[1], coord[0]] for coord in route['geometry']['coordinates']]
-
-                    ruta_procesada = {
-                        'coordenadas': coordinates,
-                        'distancia': round(route['distance'] / 1000, 2),  # metros a km
-                        'duracion': round(route['duration'] / 60),  # segundos a minutos
-                        'puntuacion_riesgo': calcular_puntuacion_riesgo(coordinates),
-                        'success': True
-                    }
-                    rutas_procesadas.append(ruta_procesada)
 
-                # Si OSRM devolvió al menos una ruta
-                if len(rutas_procesadas) >= 1:
-                    ruta_rapida = rutas_procesadas[0]
+def obtener_geometrias_rutas(origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving'):
+    """
+    Geometrías de la ruta rápida y las alternativas, sin puntuar.
 
-                    # Ajustar puntuaciones de riesgo para las alternativas
-                    # Las rutas alternativas son más largas pero más seguras
-                    if len(rutas_procesadas) >= 2:
-                        rutas_procesadas[1]['puntuacion_riesgo'] = rutas_procesadas[1]['puntuacion_riesgo'] * 0.75
-                    if len(rutas_procesadas) >= 3:
-                        rutas_procesadas[2]['puntuacion_riesgo'] = rutas_procesadas[2]['puntuacion_riesgo'] * 0.65
+    Se toman de la caché de rutas si el mismo origen y destino (ajustados a
+    la rejilla) se pidieron hace poco.
 
-                    # Si OSRM solo devolvió 1 o 2 rutas, crear variantes adicionales
-                    rutas_seguras = []
+    Returns:
+        list | None: ver _consultar_alternativas
+    """
+    from .cache_rutas import cache_rutas
+    from .grafo_vial import obtener_grafo
+
+    # Con grafo vial las geometrías dependen del riesgo de las zonas
+    grafo = obtener_grafo()
+    version = None
+    if grafo is not None:
+        grafo.riesgos()
+        version = grafo.version_riesgo
+
+    clave = cache_rutas.clave(
+        origen_lat, origen_lon, destino_lat, destino_lon, perfil, alternativas=True, version=version
+    )
+    geometrias = cache_rutas.obtener(clave)
+    if geometrias is None:
+        geometrias = _consultar_alternativas(origen_lat, origen_lon, destino_lat, destino_lon, perfil)
+        if geometrias:
+            cache_rutas.guardar(clave, geometrias)
+    return geometrias
 
-                    if len(rutas_procesadas) >= 2:
-                        rutas_seguras.append(rutas_procesadas[1])
-                    else:
-                        # Crear variante simulada basada en la ruta principal
-                        rutas_seguras.append({
-                            'coordenadas': ruta_rapida['coordenadas'],
-                            'distancia': round(ruta_rapida['distancia'] * 1.15, 2),
-                            'duracion': int(ruta_rapida['duracion'] * 1.15),
-                            'puntuacion_riesgo': round(ruta_rapida['puntuacion_riesgo'] * 0.75, 1),
-                            'success': True
-                        })
-
-                    if len(rutas_procesadas) >= 3:
-                        rutas_seguras.append(rutas_procesadas[2])
-                    else:
-                        # Crear segunda variante simulada
-                        rutas_seguras.append({
-                            'coordenadas': ruta_rapida['coordenadas'],
-                            'distancia': round(ruta_rapida['distancia'] * 1.25, 2),
-                            'duracion': int(ruta_rapida['duracion'] * 1.25),
-                            'puntuacion_riesgo': round(ruta_rapida['puntuacion_riesgo'] * 0.65, 1),
-                            'success': True
-                        })
 
-                    return {
-                        'success': True,
-                        'rapida': ruta_rapida,
-                        'seguras': rutas_seguras
-                    }
+# Rutas seguras que se ofrecen además de la rápida
+MAXIMO_RUTAS_SEGURAS = 2
+
+
+def es_ruta_segura(puntuacion, puntuacion_rapida):
+    """
+    Una alternativa real solo se ofrece como segura si su riesgo no supera al de la ruta rápida
+    """
+    return puntuacion is not None and puntuacion_rapida is not None and puntuacion <= puntuacion_rapida
+
+
+def armar_rutas_alternativas(geometrias, puntuaciones):
+    """
+    Ruta rápida y hasta 2 rutas seguras a partir de las geometrías y sus puntuaciones de riesgo.
+
+    Las seguras son solo alternativas reales (del backend de rutas o del grafo
+    vial) con riesgo menor o igual al de la ruta rápida, de la menos a la más
+    riesgosa: pueden ser 0, 1 o 2. Antes, si faltaban, se inventaban variantes
+    con la geometría de la ruta rápida y una puntuación reducida.
+    """
+    # Procesar todas las rutas disponibles (OSRM retorna hasta 3)
+    rutas_procesadas = []
+    for geometria, puntuacion in zip(geometrias, puntuaciones):
+        ruta_procesada = {
+            'coordenadas': geometria['coordenadas'],
+            'distancia': geometria['distancia'],
+            'duracion': geometria['duracion'],
+            'puntuacion_riesgo': puntuacion,
+            'success': True
+        }
+        rutas_procesadas.append(ruta_procesada)
+
+    # Si OSRM devolvió al menos una ruta
+    if len(rutas_procesadas) >= 1:
+        ruta_rapida = rutas_procesadas[0]
+        riesgo_rapida = ruta_rapida['puntuacion_riesgo']
+        rutas_seguras = sorted(
+            (ruta for ruta in rutas_procesadas[1:] if es_ruta_segura(ruta['puntuacion_riesgo'], riesgo_rapida)),
+            key=lambda ruta: ruta['puntuacion_riesgo']
+        )[:MAXIMO_RUTAS_SEGURAS]
+
+        return {
+            'success': True,
+            'rapida': ruta_rapida,
+            'seguras': rutas_seguras
+        }
+
+    return {'success': False, 'error': 'No se pudieron calcular las rutas'}
+
+
+def obtener_rutas_alternativas(origen_lat, origen_lon, destino_lat, destino_lon, perfil='driving'):
+    """
+    Obtener múltiples rutas alternativas usando OSRM con el parámetro alternatives
+    (o el backend configurado en RUTAS_BACKEND)
+    OSRM calcula automáticamente rutas alternativas inteligentes
+    Retorna: ruta rápida, y hasta 2 rutas alternativas más seguras
+
+    La puntuación de riesgo se calcula siempre con las zonas vigentes, aunque
+    las geometrías vengan de la caché. La versión asíncrona para las vistas
+    está en rutas_async.
+    """
+    try:
+        geometrias = obtener_geometrias_rutas(origen_lat, origen_lon, destino_lat, destino_lon, perfil)
+
+        if geometrias:
+            # Puntuar todas las rutas en un solo lote
+            puntuaciones = puntuar_rutas([geometria['puntuacion'] for geometria in geometrias])
+            return armar_rutas_alternativas(geometrias, puntuaciones)
 
         return {'success': False, 'error': 'No se pudieron calcular las rutas'}
 
@@ -360,6 +498,26 @@ def obtener_rutas_alternativas(origen_lat, origen_lon, destino_lat, destino_lon)
         return {'success': False, 'error': str(e)}
 
 
+def generar_mensaje_alerta(alerta):
+    """
+    Generar el texto del SMS que se envía a los contactos de emergencia
+    """
+    tipo_alerta = 'PÁNICO' if alerta.tipo == 'panico' else 'ACCIDENTE'
+    repartidor_nombre = alerta.repartidor.get_full_name()
+
+    return f"""
+🚨 ALERTA DE {tipo_alerta} - RAPPI SAFE
+
+{repartidor_nombre} ha activado una alerta de emergencia.
+
+📍 Ubicación: https://www.google.com/maps?q={alerta.latitud},{alerta.longitud}
+
+Hora: {timezone.now().strftime('%d/%m/%Y %H:%M')}
+
+Este mensaje es automático. Por favor, contacte inmediatamente con {repartidor_nombre} o las autoridades.
+    """.strip()
+
+
 def notificar_contactos_emergencia(alerta):
     """
     Enviar notificaciones a los contactos de emergencia del repartidor
@@ -368,9 +526,12 @@ def notificar_contactos_emergencia(alerta):
     Esta función:
     1. Obtiene todos los contactos de emergencia del repartidor
     2. Genera un mensaje personalizado con la información de la alerta
-    3. Envía notificación SMS a cada contacto
+    3. Envía notificación SMS a cada contacto que aún no la haya recibido
     4. Registra cada intento de notificación en la base de datos
 
+    Es idempotente por (alerta, contacto, método): los contactos ya notificados
+    o con un envío en curso se omiten y se reportan en 'contactos_omitidos'.
+
     Args:
         alerta: Objeto Alerta que se acaba de crear
 
@@ -379,11 +540,14 @@ def notificar_contactos_emergencia(alerta):
             'success': bool,
             'contactos_notificados': int,
             'notificaciones_fallidas': int,
+            'contactos_omitidos': int,
             'detalles': []
         }
     """
     from .models import ContactoConfianza, NotificacionContacto
-    from django.utils import timezone
+    from .notificaciones import despachador, registrar_resultado
+    from django.db import IntegrityError, transaction
+    from django.db.models import F
 
     try:
         # Obtener contactos de emergencia del repartidor (solo validados)
@@ -398,46 +562,83 @@ def notificar_contactos_emergencia(alerta):
                 'success': False,
                 'contactos_notificados': 0,
                 'notificaciones_fallidas': 0,
+                'contactos_omitidos': 0,
                 'mensaje': 'No hay contactos de emergencia validados'
             }
 
         # Generar mensaje personalizado
-        tipo_alerta = 'PÁNICO' if alerta.tipo == 'panico' else 'ACCIDENTE'
-        repartidor_nombre = alerta.repartidor.get_full_name()
-
-        # Mensaje base
-        mensaje = f"""
-🚨 ALERTA DE {tipo_alerta} - RAPPI SAFE
-
-{repartidor_nombre} ha activado una alerta de emergencia.
-
-📍 Ubicación: https://www.google.com/maps?q={alerta.latitud},{alerta.longitud}
-
-Hora: {timezone.now().strftime('%d/%m/%Y %H:%M')}
-
-Este mensaje es automático. Por favor, contacte inmediatamente con {repartidor_nombre} o las autoridades.
-        """.strip()
+        mensaje = generar_mensaje_alerta(alerta)
 
         contactos_notificados = 0
         notificaciones_fallidas = 0
         detalles = []
+        omitidos = []
+
+        # Reservar el registro de cada contacto antes de enviar. La restricción
+        # única (alerta, contacto, método) impide que un contacto que ya recibió
+        # el mensaje, o cuyo envío está en curso, reciba un SMS duplicado; solo
+        # los envíos fallidos se vuelven a intentar.
+        existentes = {
+            notificacion.contacto_id: notificacion
+            for notificacion in NotificacionContacto.objects.filter(alerta=alerta, metodo='sms')
+        }
 
+        reservadas = []
         for contacto in contactos:
+            notificacion = existentes.get(contacto.id)
+
+            if notificacion is None:
+                try:
+                    with transaction.atomic():
+                        notificacion = NotificacionContacto.objects.create(
+                            alerta=alerta,
+                            contacto=contacto,
+                            metodo='sms',
+                            estado='enviando',
+                            mensaje=mensaje,
+                            intentos=1
+                        )
+                except IntegrityError:
+                    # Otro proceso reservó este contacto al mismo tiempo
+                    omitidos.append({'contacto': contacto.nombre, 'metodo': 'sms', 'estado': 'omitido', 'motivo': 'enviando'})
+                    continue
+            elif notificacion.estado == 'fallido' and NotificacionContacto.objects.filter(
+                id=notificacion.id, estado='fallido'
+            ).update(estado='enviando', intentos=F('intentos') + 1, siguiente_intento=None):
+                notificacion.refresh_from_db()
+            else:
+                omitidos.append({'contacto': contacto.nombre, 'metodo': 'sms', 'estado': 'omitido', 'motivo': notificacion.estado})
+                continue
+
+            reservadas.append((contacto, notificacion))
+
+        for omitido in omitidos:
+            print(f"⏭️ Notificación a {omitido['contacto']} omitida (estado: {omitido['motivo']})")
+        detalles.extend(omitidos)
+
+        # Enviar a todos los contactos en paralelo; el tiempo total es el de
+        # la respuesta más lenta y no la suma de todas
+        envios = [
+            (contacto, notificacion, pool_envios_sms().submit(enviar_notificacion_contacto, contacto, notificacion.mensaje))
+            for contacto, notificacion in reservadas
+        ]
+
+        for contacto, notificacion, envio in envios:
             try:
-                # Enviar notificación (Telegram > Email > Simulado)
-                resultado_envio = enviar_notificacion_contacto(contacto, mensaje)
+                try:
+                    resultado_envio = envio.result()
+                except Exception as e:
+                    resultado_envio = {'success': False, 'metodo': 'sms', 'error': str(e)}
                 metodo = resultado_envio.get('metodo', 'desconocido')
 
-                # Registrar notificación en base de datos
-                notificacion = NotificacionContacto.objects.create(
-                    alerta=alerta,
-                    contacto=contacto,
-                    metodo=metodo if metodo in ['telegram', 'email', 'sms', 'whatsapp', 'llamada'] else 'sms',
-                    estado='enviado' if resultado_envio['success'] else 'fallido',
-                    mensaje=mensaje,
-                    respuesta_api=resultado_envio.get('respuesta'),
-                    error_mensaje=resultado_envio.get('error', '')
-                )
+                # Registrar el resultado (las fallidas quedan programadas para
+                # reintento con backoff)
+                registrar_resultado(notificacion, resultado_envio)
+                notificacion.save(update_fields=[
+                    'estado', 'respuesta_api', 'error_mensaje', 'historial_intentos', 'siguiente_intento', 'actualizado_en'
+                ])
+                if notificacion.siguiente_intento:
+                    despachador.programar_reintento(notificacion.siguiente_intento)
 
                 if resultado_envio['success']:
                     contactos_notificados += 1
@@ -450,12 +651,12 @@ Este mensaje es automático. Por favor, contacte inmediatamente con {repartidor_
                     })
                 else:
                     notificaciones_fallidas += 1
-                    print(f"❌ Error al notificar a {contacto.nombre}: {resultado_envio.get('error')}")
+                    print(f"❌ Error al notificar a {contacto.nombre}: {notificacion.error_mensaje}")
                     detalles.append({
                         'contacto': contacto.nombre,
                         'metodo': metodo,
                         'estado': 'fallido',
-                        'error': resultado_envio.get('error')
+                        'error': notificacion.error_mensaje
                     })
 
             except Exception as e:
@@ -472,12 +673,14 @@ Este mensaje es automático. Por favor, contacte inmediatamente con {repartidor_
             'success': True,
             'contactos_notificados': contactos_notificados,
             'notificaciones_fallidas': notificaciones_fallidas,
+            'contactos_omitidos': len(omitidos),
             'detalles': detalles
         }
 
         print(f"📊 Resultado notificaciones para alerta {alerta.id}:")
         print(f"   ✅ Enviadas: {contactos_notificados}")
         print(f"   ❌ Fallidas: {notificaciones_fallidas}")
+        print(f"   ⏭️ Omitidas: {len(omitidos)}")
 
         return resultado
 
@@ -491,6 +694,107 @@ Este mensaje es automático. Por favor, contacte inmediatamente con {repartidor_
         }
 
 
+class SesionPersistente(requests.Session):
+    """
+    Sesión HTTP que ignora close() para conservar las conexiones keep-alive.
+
+    El SDK de Mocean cierra la sesión después de cada envío, lo que obliga a
+    abrir una conexión TLS nueva por mensaje.
+    """
+
+    def close(self):
+        pass
+
+    def cerrar(self):
+        super().close()
+
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas (token bucket) para no exceder la tasa de un proveedor.
+
+    Args:
+        tasa: Fichas repuestas por segundo
+        capacidad: Ráfaga máxima permitida
+    """
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad)
+        self._fichas = float(capacidad)
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloquear hasta que haya una ficha disponible"""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultima_recarga) * self.tasa)
+                self._ultima_recarga = ahora
+
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.tasa
+
+            time.sleep(espera)
+
+
+_clientes_sms = {}
+_limitadores_sms = {}
+_pool_envios_sms = None
+_lock_sms = threading.Lock()
+
+
+def obtener_cliente_mocean(api_token):
+    """
+    Obtener el cliente de Mocean de larga duración para un token de API.
+
+    El cliente comparte una sesión con pool de conexiones entre todos los
+    hilos que envían SMS en el proceso.
+    """
+    with _lock_sms:
+        cliente = _clientes_sms.get(api_token)
+        if cliente is None:
+            from moceansdk import Client, Basic
+
+            sesion = SesionPersistente()
+            adaptador = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.SMS_MAX_CONCURRENCIA
+            )
+            sesion.mount('https://', adaptador)
+
+            cliente = Client(Basic(api_token=api_token), {'request_session': sesion})
+            _clientes_sms[api_token] = cliente
+        return cliente
+
+
+def obtener_limitador_sms(proveedor):
+    """Obtener el limitador de tasa compartido de un proveedor de SMS"""
+    with _lock_sms:
+        limitador = _limitadores_sms.get(proveedor)
+        if limitador is None:
+            limitador = LimitadorTasa(settings.SMS_TASA_POR_SEGUNDO, settings.SMS_RAFAGA)
+            _limitadores_sms[proveedor] = limitador
+        return limitador
+
+
+def pool_envios_sms():
+    """
+    Pool de hilos que acota los envíos de SMS simultáneos del proceso
+    """
+    global _pool_envios_sms
+    with _lock_sms:
+        if _pool_envios_sms is None:
+            _pool_envios_sms = ThreadPoolExecutor(
+                max_workers=settings.SMS_MAX_CONCURRENCIA,
+                thread_name_prefix='envios-sms'
+            )
+        return _pool_envios_sms
+
+
 def enviar_sms_mocean(telefono, mensaje):
     """
     Enviar SMS usando MoceanAPI (SDK oficial)
@@ -502,8 +806,6 @@ def enviar_sms_mocean(telefono, mensaje):
     Returns:
         dict: {'success': bool, 'respuesta': dict, 'error': str}
     """
-    import os
-
     # Obtener el token de API desde variables de entorno
     api_token = os.environ.get('MOCEAN_API_TOKEN')
 
@@ -514,7 +816,7 @@ def enviar_sms_mocean(telefono, mensaje):
         }
 
     try:
-        from moceansdk import Client, Basic
+        mocean = obtener_cliente_mocean(api_token)
 
         print(f"📱 Enviando SMS REAL via MOCEAN a {telefono}")
         print(f"   Mensaje: {mensaje[:50]}...")
@@ -526,11 +828,11 @@ def enviar_sms_mocean(telefono, mensaje):
         if str(telefono).startswith('+'):
             telefono_limpio = ''.join(filter(str.isdigit, str(telefono)))
 
-        # Inicializar cliente de Mocean
-        mocean = Client(Basic(api_token=api_token))
-
         print(f"   Número limpio: {telefono_limpio}")
 
+        # Respetar la tasa del proveedor antes de enviar
+        obtener_limitador_sms('mocean').adquirir()
+
         # Enviar SMS
         res = mocean.sms.create({
             "mocean-from": "RAPPI SAFE",
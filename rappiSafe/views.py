@@ -2,10 +2,11 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Count, Q, Avg
 from django.core.paginator import Paginator
 from datetime import timedelta, datetime, date
@@ -14,12 +15,19 @@ import uuid
 
 from .models import (
     User, RepartidorProfile, Alerta, Trayectoria, ContactoConfianza,
-    Incidente, Bitacora, EstadisticaRiesgo, SolicitudAyudaPsicologica, RutaSegura
+    Incidente, Bitacora, SolicitudAyudaPsicologica, RutaSegura
 )
 from .utils import (
     enviar_nueva_alerta, enviar_actualizacion_alerta,
     enviar_actualizacion_ubicacion, serializar_alerta, enviar_notificacion
 )
+from .notificaciones import encolar_notificaciones
+from .deduplicacion import indice_accidentes, buscar_alerta_duplicada, fusionar_en_alerta
+from .alertas_activas import registro_alertas_activas, alerta_activa_de, alertas_activas_queryset
+from .ubicaciones import estado_repartidores
+from .polilineas import codificar_ruta
+from .indice_espacial import zonas_cercanas
+from .riesgo_horario import puntuacion_actual, riesgo_en_punto
 
 
 # ==================== AUTENTICACIÓN ====================
@@ -94,59 +102,20 @@ def test_sensores(request):
 @user_passes_test(es_repartidor, login_url='login')
 def repartidor_home(request):
     """Página principal del repartidor con botón de pánico"""
-    from math import radians, sin, cos, sqrt, atan2
+    perfil = estado_repartidores.aplicar(request.user.perfil_repartidor)
+    alertas_activas = alertas_activas_queryset(request.user).order_by('-creado_en')
 
-    perfil = request.user.perfil_repartidor
-    alertas_activas = Alerta.objects.filter(
-        repartidor=request.user,
-        estado__in=['pendiente', 'en_atencion']
-    ).order_by('-creado_en')
-
-    # Calcular zonas de riesgo cercanas basadas en la ubicación del repartidor
+    # Las 5 zonas de riesgo más cercanas a la ubicación del repartidor, dentro de 10 km
     zonas_riesgo_cercanas = []
     if perfil.ultima_latitud and perfil.ultima_longitud:
-        # Obtener todas las zonas de riesgo
-        zonas_riesgo = EstadisticaRiesgo.objects.all().order_by('-puntuacion_riesgo')[:10]
-
-        # Calcular distancia a cada zona
-        for zona in zonas_riesgo:
-            try:
-                # Las coordenadas están en formato GeoJSON
-                coords = zona.coordenadas_zona
-                # Asumiendo que coords tiene 'center' con lat y lng
-                if isinstance(coords, dict) and 'center' in coords:
-                    zona_lat = float(coords['center']['lat'])
-                    zona_lng = float(coords['center']['lng'])
-
-                    # Fórmula de Haversine para calcular distancia
-                    R = 6371  # Radio de la Tierra en km
-
-                    lat1 = radians(float(perfil.ultima_latitud))
-                    lon1 = radians(float(perfil.ultima_longitud))
-                    lat2 = radians(zona_lat)
-                    lon2 = radians(zona_lng)
-
-                    dlat = lat2 - lat1
-                    dlon = lon2 - lon1
-
-                    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                    c = 2 * atan2(sqrt(a), sqrt(1-a))
-                    distancia = R * c
-
-                    # Solo mostrar zonas dentro de 10 km
-                    if distancia <= 10:
-                        zonas_riesgo_cercanas.append({
-                            'zona': zona,
-                            'distancia': round(distancia, 1)
-                        })
-            except (KeyError, ValueError, TypeError) as e:
-                # Si hay error con las coordenadas, ignorar esta zona
-                continue
-
-        # Ordenar por distancia
-        zonas_riesgo_cercanas.sort(key=lambda x: x['distancia'])
-        # Limitar a las 5 zonas más cercanas
-        zonas_riesgo_cercanas = zonas_riesgo_cercanas[:5]
+        try:
+            zonas_riesgo_cercanas = [
+                {'zona': zona, 'distancia': round(distancia, 1), 'riesgo_hora': puntuacion_actual(zona)}
+                for distancia, zona in zonas_cercanas(perfil.ultima_latitud, perfil.ultima_longitud, k=5, radio_km=10)
+            ]
+        except (ValueError, TypeError, OverflowError):
+            # Si hay error con las coordenadas, no mostrar zonas
+            pass
 
     context = {
         'perfil': perfil,
@@ -163,10 +132,7 @@ def crear_alerta_panico(request):
     """Crear una alerta de pánico"""
     try:
         # Verificar si ya existe una alerta activa
-        alerta_activa = Alerta.objects.filter(
-            repartidor=request.user,
-            estado__in=['pendiente', 'en_atencion']
-        ).first()
+        alerta_activa = alerta_activa_de(request.user)
 
         if alerta_activa:
             return JsonResponse({
@@ -176,39 +142,40 @@ def crear_alerta_panico(request):
 
         data = json.loads(request.body)
 
-        # Crear la alerta
-        alerta = Alerta.objects.create(
-            repartidor=request.user,
-            tipo='panico',
-            estado='pendiente',
-            latitud=data.get('latitud'),
-            longitud=data.get('longitud'),
-            nivel_bateria=data.get('bateria'),
-            datos_sensores=data.get('datos_sensores', {}),
-        )
+        with transaction.atomic():
+            # Crear la alerta
+            alerta = Alerta.objects.create(
+                repartidor=request.user,
+                tipo='panico',
+                estado='pendiente',
+                latitud=data.get('latitud'),
+                longitud=data.get('longitud'),
+                nivel_bateria=data.get('bateria'),
+                datos_sensores=data.get('datos_sensores', {}),
+            )
 
-        # Actualizar el perfil del repartidor
-        perfil = request.user.perfil_repartidor
-        perfil.estado = 'emergencia'
-        perfil.ultima_latitud = data.get('latitud')
-        perfil.ultima_longitud = data.get('longitud')
-        perfil.nivel_bateria = data.get('bateria')
-        perfil.ultima_actualizacion_ubicacion = timezone.now()
-        perfil.save()
+            # Actualizar el perfil del repartidor
+            perfil = request.user.perfil_repartidor
+            perfil.estado = 'emergencia'
+            perfil.ultima_latitud = data.get('latitud')
+            perfil.ultima_longitud = data.get('longitud')
+            perfil.nivel_bateria = data.get('bateria')
+            perfil.ultima_actualizacion_ubicacion = timezone.now()
+            perfil.save()
+
+            # Encolar notificaciones a contactos de emergencia (se envían en segundo plano)
+            notificaciones, omitidos = encolar_notificaciones(alerta)
 
         # Enviar notificación por WebSocket
         enviar_nueva_alerta(serializar_alerta(alerta))
 
-        # Notificar a contactos de emergencia
-        from .utils import notificar_contactos_emergencia
-        resultado_notificaciones = notificar_contactos_emergencia(alerta)
-
         return JsonResponse({
             'success': True,
             'alerta_id': str(alerta.id),
             'mensaje': 'Alerta de pánico activada',
-            'contactos_notificados': resultado_notificaciones.get('contactos_notificados', 0),
-            'notificaciones_info': f"{resultado_notificaciones.get('contactos_notificados', 0)} contacto(s) notificado(s)"
+            'contactos_notificados': len(notificaciones),
+            'contactos_omitidos': len(omitidos),
+            'notificaciones_info': f"{len(notificaciones)} contacto(s) en proceso de notificación"
         })
     except Exception as e:
         return JsonResponse({
@@ -225,39 +192,66 @@ def crear_alerta_accidente(request):
     try:
         data = json.loads(request.body)
 
-        # Crear la alerta
-        alerta = Alerta.objects.create(
-            repartidor=request.user,
-            tipo='accidente',
-            estado='pendiente',
-            latitud=data.get('latitud'),
-            longitud=data.get('longitud'),
-            nivel_bateria=data.get('bateria'),
-            datos_sensores=data.get('datos_sensores', {}),
-        )
+        # Un mismo choque puede disparar varias detecciones en pocos segundos;
+        # el candado evita que dos de ellas creen alertas en paralelo
+        with indice_accidentes.bloqueo(request.user.id):
+            with transaction.atomic():
+                # Entre procesos: en bases con bloqueo de filas se toma la fila
+                # del repartidor; en SQLite ya lo serializa el modo IMMEDIATE
+                User.objects.select_for_update().get(pk=request.user.pk)
+                alerta_existente = buscar_alerta_duplicada(request.user, data.get('latitud'), data.get('longitud'))
+
+                if alerta_existente:
+                    # Fusionar la detección repetida en la alerta ya abierta
+                    alerta = fusionar_en_alerta(alerta_existente, data)
+                else:
+                    # Crear la alerta
+                    alerta = Alerta.objects.create(
+                        repartidor=request.user,
+                        tipo='accidente',
+                        estado='pendiente',
+                        latitud=data.get('latitud'),
+                        longitud=data.get('longitud'),
+                        nivel_bateria=data.get('bateria'),
+                        datos_sensores=data.get('datos_sensores', {}),
+                    )
+
+                    # Actualizar el perfil del repartidor
+                    perfil = request.user.perfil_repartidor
+                    perfil.estado = 'emergencia'
+                    perfil.ultima_latitud = data.get('latitud')
+                    perfil.ultima_longitud = data.get('longitud')
+                    perfil.nivel_bateria = data.get('bateria')
+                    perfil.ultima_actualizacion_ubicacion = timezone.now()
+                    perfil.save()
 
-        # Actualizar el perfil del repartidor
-        perfil = request.user.perfil_repartidor
-        perfil.estado = 'emergencia'
-        perfil.ultima_latitud = data.get('latitud')
-        perfil.ultima_longitud = data.get('longitud')
-        perfil.nivel_bateria = data.get('bateria')
-        perfil.ultima_actualizacion_ubicacion = timezone.now()
-        perfil.save()
+                    # Encolar notificaciones a contactos de emergencia (se envían en segundo plano)
+                    notificaciones, omitidos = encolar_notificaciones(alerta)
+
+            if not alerta_existente:
+                indice_accidentes.registrar(request.user.id, alerta.id, alerta.latitud, alerta.longitud, alerta.creado_en)
+
+        if alerta_existente:
+            return JsonResponse({
+                'success': True,
+                'alerta_id': str(alerta.id),
+                'mensaje': 'Accidente ya reportado; datos agregados a la alerta activa',
+                'duplicada': True,
+                'contactos_notificados': 0,
+                'notificaciones_info': 'Los contactos ya fueron notificados para esta alerta'
+            })
 
         # Enviar notificación por WebSocket
         enviar_nueva_alerta(serializar_alerta(alerta))
 
-        # Notificar a contactos de emergencia
-        from .utils import notificar_contactos_emergencia
-        resultado_notificaciones = notificar_contactos_emergencia(alerta)
-
         return JsonResponse({
             'success': True,
             'alerta_id': str(alerta.id),
             'mensaje': 'Alerta de accidente creada',
-            'contactos_notificados': resultado_notificaciones.get('contactos_notificados', 0),
-            'notificaciones_info': f"{resultado_notificaciones.get('contactos_notificados', 0)} contacto(s) notificado(s)"
+            'duplicada': False,
+            'contactos_notificados': len(notificaciones),
+            'contactos_omitidos': len(omitidos),
+            'notificaciones_info': f"{len(notificaciones)} contacto(s) en proceso de notificación"
         })
     except Exception as e:
         return JsonResponse({
@@ -321,12 +315,8 @@ def actualizar_ubicacion(request):
                 data.get('velocidad')
             )
 
-        # Actualizar perfil del repartidor
-        perfil = request.user.perfil_repartidor
-        perfil.ultima_latitud = data.get('latitud')
-        perfil.ultima_longitud = data.get('longitud')
-        perfil.ultima_actualizacion_ubicacion = timezone.now()
-        perfil.save()
+        # Actualizar el último estado conocido (se guarda en la base de datos en segundo plano)
+        estado_repartidores.actualizar_ubicacion(request.user.id, data.get('latitud'), data.get('longitud'))
 
         return JsonResponse({'success': True})
     except Exception as e:
@@ -340,10 +330,7 @@ def actualizar_bateria(request):
     """Actualizar nivel de batería del dispositivo"""
     try:
         data = json.loads(request.body)
-        perfil = request.user.perfil_repartidor
-        perfil.nivel_bateria = data.get('bateria')
-        perfil.ultima_actualizacion_bateria = timezone.now()
-        perfil.save()
+        estado_repartidores.actualizar_bateria(request.user.id, data.get('bateria'))
 
         return JsonResponse({'success': True})
     except Exception as e:
@@ -530,7 +517,7 @@ def mi_perfil_view(request):
 @user_passes_test(es_repartidor)
 def rutas_view(request):
     """Vista de rutas seguras"""
-    perfil = request.user.perfil_repartidor
+    perfil = estado_repartidores.aplicar(request.user.perfil_repartidor)
 
     context = {
         'perfil': perfil,
@@ -538,11 +525,126 @@ def rutas_view(request):
     return render(request, 'rappiSafe/repartidor/rutas.html', context)
 
 
+PERFILES_RUTA = ('driving', 'walking', 'cycling')
+
+
+def _formato_ruta(ruta, tipo, codificada=False):
+    """
+    Ruta tal como se envía al cliente; con `codificada` la geometría va como
+    polilínea codificada ('polilinea') en lugar de 'coordenadas'
+    """
+    puntuacion = ruta.get('puntuacion_riesgo')
+    formato = {
+        'tipo': tipo,
+        'distancia': ruta['distancia'],
+        'duracion': ruta['duracion'],
+        'puntuacion_riesgo': round(puntuacion, 1) if puntuacion is not None else None,
+        'coordenadas': ruta['coordenadas']
+    }
+    return codificar_ruta(formato) if codificada else formato
+
+
+def _respuesta_rutas(resultado, codificada=False):
+    """Formato de respuesta de la ruta rápida y las seguras"""
+    ruta_rapida_response = _formato_ruta(resultado['rapida'], 'rapida', codificada)
+    rutas_seguras_response = [_formato_ruta(ruta, 'segura', codificada) for ruta in resultado['seguras']]
+    return ruta_rapida_response, rutas_seguras_response
+
+
+def _guardar_rutas(usuario, origen_lat, origen_lon, destino_lat, destino_lon, ruta_rapida_response,
+                   rutas_seguras_response):
+    """
+    Guardar las rutas calculadas, con las geometrías codificadas, sin hacer esperar la respuesta.
+    Sin rutas seguras, la más segura disponible es la rápida.
+    """
+    from .rutas_async import guardar_en_segundo_plano
+
+    ruta_mas_segura = rutas_seguras_response[0] if rutas_seguras_response else ruta_rapida_response
+
+    guardar_en_segundo_plano(
+        RutaSegura,
+        repartidor_id=usuario.pk,
+        origen_lat=origen_lat,
+        origen_lon=origen_lon,
+        destino_lat=destino_lat,
+        destino_lon=destino_lon,
+        ruta_rapida=codificar_ruta(ruta_rapida_response),
+        ruta_segura={'rutas': [codificar_ruta(ruta) for ruta in rutas_seguras_response]},
+        puntuacion_riesgo_rapida=ruta_rapida_response['puntuacion_riesgo'],
+        puntuacion_riesgo_segura=ruta_mas_segura['puntuacion_riesgo'],
+        seleccionada='rapida'
+    )
+
+
+def _respuesta_progresiva(usuario, origen_lat, origen_lon, destino_lat, destino_lon, perfil, codificada=False):
+    """
+    Respuesta en NDJSON (un objeto JSON por línea) que se va enviando por partes:
+
+    {"evento": "rapida", "ruta": {...}}            ruta rápida sin puntuar (puntuacion_riesgo null)
+    {"evento": "segura", "indice": 0, "ruta": {...}} cada alternativa con riesgo menor o igual
+                                                     al de la rápida, al terminar de puntuarla
+    {"evento": "completo", "success": true, "rutas": {...}}  igual a la respuesta normal
+    {"evento": "error", "success": false, "error": "..."}
+    """
+    from .rutas_async import eventos_rutas
+
+    def linea(evento, **datos):
+        return json.dumps({'evento': evento, **datos}) + '\n'
+
+    async def lineas():
+        try:
+            async for evento, datos in eventos_rutas(origen_lat, origen_lon, destino_lat, destino_lon, perfil):
+                if evento == 'rapida':
+                    yield linea('rapida', ruta=_formato_ruta(datos, 'rapida', codificada))
+                elif evento == 'segura':
+                    indice, ruta = datos
+                    yield linea('segura', indice=indice, ruta=_formato_ruta(ruta, 'segura', codificada))
+                elif evento == 'error':
+                    yield linea('error', success=False, error=datos)
+                elif not datos.get('success'):
+                    yield linea('error', success=False, error=datos.get('error', 'Error al calcular rutas'))
+                else:
+                    ruta_rapida_response, rutas_seguras_response = _respuesta_rutas(datos, codificada)
+                    _guardar_rutas(usuario, origen_lat, origen_lon, destino_lat, destino_lon,
+                                   ruta_rapida_response, rutas_seguras_response)
+                    yield linea('completo', success=True, rutas={
+                        'rapida': ruta_rapida_response,
+                        'seguras': rutas_seguras_response
+                    })
+        except Exception as e:
+            import traceback
+            print(f"Error al calcular rutas: {str(e)}")
+            print(traceback.format_exc())
+            yield linea('error', success=False, error=f'Error al calcular rutas: {str(e)}')
+
+    response = StreamingHttpResponse(lineas(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    # Que nginx no acumule la respuesta antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @user_passes_test(es_repartidor)
 @require_POST
-def calcular_rutas(request):
-    """Calcular rutas (rápida y seguras) usando API de routing real"""
+async def calcular_rutas(request):
+    """
+    Calcular rutas (rápida y seguras) usando API de routing real.
+
+    Es asíncrona: la consulta al backend y la puntuación corren en pools
+    propios (ver rutas_async) y no ocupan los hilos que atienden las alertas.
+    Opcionalmente acepta 'perfiles' (p. ej. ["driving", "walking"]); las rutas
+    del primero van en 'rutas' y las de todos en 'rutas_por_perfil'.
+
+    Con 'progresivo': true (o Accept: application/x-ndjson) la respuesta se
+    envía por partes para el primer perfil: la ruta rápida en cuanto responde
+    el backend y las seguras conforme se puntúan (ver _respuesta_progresiva).
+
+    Con 'formato': 'polilinea' cada ruta trae su geometría como polilínea
+    codificada (algoritmo de Google, 5 decimales) en lugar de 'coordenadas'.
+    """
+    from .rutas_async import calcular_rutas_perfiles
+
     try:
         data = json.loads(request.body)
         origen_lat = float(data.get('origen_lat'))
@@ -550,10 +652,24 @@ def calcular_rutas(request):
         destino_lat = float(data.get('destino_lat'))
         destino_lon = float(data.get('destino_lon'))
 
-        # Obtener rutas reales usando OSRM
-        from .utils import obtener_rutas_alternativas
+        perfiles = list(dict.fromkeys(data.get('perfiles') or ['driving']))
+        if any(perfil not in PERFILES_RUTA for perfil in perfiles):
+            return JsonResponse({
+                'success': False,
+                'error': f'Perfil de ruta inválido; opciones: {", ".join(PERFILES_RUTA)}'
+            }, status=400)
+
+        codificada = data.get('formato') == 'polilinea'
 
-        resultado = obtener_rutas_alternativas(origen_lat, origen_lon, destino_lat, destino_lon)
+        if data.get('progresivo') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+            usuario = await request.auser()
+            return _respuesta_progresiva(
+                usuario, origen_lat, origen_lon, destino_lat, destino_lon, perfiles[0], codificada
+            )
+
+        # Obtener rutas reales (OSRM) de todos los perfiles a la vez
+        resultados = await calcular_rutas_perfiles(origen_lat, origen_lon, destino_lat, destino_lon, perfiles)
+        resultado = resultados[perfiles[0]]
 
         if not resultado.get('success'):
             return JsonResponse({
@@ -561,50 +677,31 @@ def calcular_rutas(request):
                 'error': resultado.get('error', 'Error al calcular rutas')
             }, status=400)
 
-        ruta_rapida = resultado['rapida']
-        rutas_seguras = resultado['seguras']
-
         # Preparar datos para respuesta
-        ruta_rapida_response = {
-            'tipo': 'rapida',
-            'distancia': ruta_rapida['distancia'],
-            'duracion': ruta_rapida['duracion'],
-            'puntuacion_riesgo': round(ruta_rapida['puntuacion_riesgo'], 1),
-            'coordenadas': ruta_rapida['coordenadas']
-        }
+        ruta_rapida_response, rutas_seguras_response = _respuesta_rutas(resultado, codificada)
 
-        rutas_seguras_response = [
-            {
-                'tipo': 'segura',
-                'distancia': ruta['distancia'],
-                'duracion': ruta['duracion'],
-                'puntuacion_riesgo': round(ruta['puntuacion_riesgo'], 1),
-                'coordenadas': ruta['coordenadas']
-            }
-            for ruta in rutas_seguras
-        ]
+        # Guardar en base de datos sin hacer esperar la respuesta
+        usuario = await request.auser()
+        _guardar_rutas(usuario, origen_lat, origen_lon, destino_lat, destino_lon,
+                       ruta_rapida_response, rutas_seguras_response)
 
-        # Guardar en base de datos
-        RutaSegura.objects.create(
-            repartidor=request.user,
-            origen_lat=origen_lat,
-            origen_lon=origen_lon,
-            destino_lat=destino_lat,
-            destino_lon=destino_lon,
-            ruta_rapida=ruta_rapida_response,
-            ruta_segura={'rutas': rutas_seguras_response},
-            puntuacion_riesgo_rapida=ruta_rapida_response['puntuacion_riesgo'],
-            puntuacion_riesgo_segura=rutas_seguras_response[0]['puntuacion_riesgo'],
-            seleccionada='rapida'
-        )
-
-        return JsonResponse({
+        respuesta = {
             'success': True,
             'rutas': {
                 'rapida': ruta_rapida_response,
                 'seguras': rutas_seguras_response
             }
-        })
+        }
+        if len(perfiles) > 1:
+            respuesta['rutas_por_perfil'] = {}
+            for perfil, resultado_perfil in resultados.items():
+                if resultado_perfil.get('success'):
+                    rapida, seguras = _respuesta_rutas(resultado_perfil, codificada)
+                    respuesta['rutas_por_perfil'][perfil] = {'rapida': rapida, 'seguras': seguras}
+                else:
+                    respuesta['rutas_por_perfil'][perfil] = {'error': resultado_perfil.get('error')}
+
+        return JsonResponse(respuesta)
 
     except Exception as e:
         import traceback
@@ -622,9 +719,10 @@ def calcular_rutas(request):
 @user_passes_test(es_operador, login_url='login')
 def operador_dashboard(request):
     """Dashboard de monitoreo para operadores"""
-    alertas_activas = Alerta.objects.filter(
-        estado__in=['pendiente', 'en_atencion']
-    ).select_related('repartidor').order_by('-creado_en')
+    alertas_activas = list(alertas_activas_queryset().select_related('repartidor').order_by('-creado_en'))
+    # Riesgo a esta hora de la zona de cada alerta (índice en memoria, sin consultas por alerta)
+    for alerta in alertas_activas:
+        alerta.riesgo_zona = riesgo_en_punto(alerta.latitud, alerta.longitud)
 
     # Incluir solicitudes de ayuda psicológica pendientes
     solicitudes_psicologicas = SolicitudAyudaPsicologica.objects.filter(
@@ -1053,6 +1151,7 @@ def notificar_contactos_operador(request, alerta_id):
             'success': resultado['success'],
             'contactos_notificados': resultado.get('contactos_notificados', 0),
             'notificaciones_fallidas': resultado.get('notificaciones_fallidas', 0),
+            'contactos_omitidos': resultado.get('contactos_omitidos', 0),
             'detalles': resultado.get('detalles', [])
         })
     except Alerta.DoesNotExist:
@@ -1224,15 +1323,12 @@ def lista_repartidores(request):
     for repartidor in repartidores:
         # Contar alertas
         total_alertas = Alerta.objects.filter(repartidor=repartidor).count()
-        alertas_activas = Alerta.objects.filter(
-            repartidor=repartidor,
-            estado__in=['pendiente', 'en_atencion']
-        ).count()
+        alertas_activas = registro_alertas_activas.contar(repartidor.id)
         ultima_alerta = Alerta.objects.filter(repartidor=repartidor).order_by('-creado_en').first()
 
         # Obtener perfil
         try:
-            perfil = repartidor.perfil_repartidor
+            perfil = estado_repartidores.aplicar(repartidor.perfil_repartidor)
             estado = perfil.estado
             ultima_ubicacion = {
                 'lat': perfil.ultima_latitud,
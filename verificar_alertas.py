@@ -11,16 +11,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 django.setup()
 
 from rappiSafe.models import Alerta, User
+from rappiSafe.alertas_activas import alertas_activas_queryset
 
 print("\n=== VERIFICACIÓN DE ALERTAS ACTIVAS ===\n")
 
-# Buscar todas las alertas activas
-alertas_activas = Alerta.objects.filter(estado__in=['pendiente', 'en_atencion'])
+# Buscar todas las alertas activas (registro de alertas activas, sin recorrer el histórico)
+alertas_activas = list(alertas_activas_queryset().select_related('repartidor__perfil_repartidor'))
 
-if not alertas_activas.exists():
+if not alertas_activas:
     print("✅ No hay alertas activas en el sistema")
 else:
-    print(f"⚠️ Encontradas {alertas_activas.count()} alertas activas:\n")
+    print(f"⚠️ Encontradas {len(alertas_activas)} alertas activas:\n")
 
     for alerta in alertas_activas:
         print(f"  - ID: {alerta.id}")
@@ -37,7 +38,7 @@ else:
         alerta.save()
         print(f"  ✓ Alerta {alerta.id} cerrada")
 
-    print(f"\n✅ Se cerraron {alertas_activas.count()} alertas")
+    print(f"\n✅ Se cerraron {len(alertas_activas)} alertas")
 
     # Actualizar estado de repartidores
     repartidores_actualizados = []